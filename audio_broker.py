@@ -0,0 +1,215 @@
+import threading
+import time
+import discord
+from typing import Callable, Dict, List, Optional, Set
+
+FRAME_DURATION = 0.02  # seconds of audio in one frame read by the voice client
+JOIN_WINDOW = 10.0  # seconds after a shared stream starts during which other guilds can join it
+MAX_LAG_FRAMES = 3000  # 60 seconds, subscribers further behind get their own stream
+
+# creates the upstream source of a track starting at the given offset in seconds
+SourceFactory = Callable[[float], discord.AudioSource]
+
+
+class SharedStream:
+    """One decode of a track whose frames are read by several guilds.
+    Frames are kept in a buffer from the slowest subscriber's position to the
+    fastest one's, each subscriber reads it with its own cursor. One subscriber
+    at a time reads the upstream source, outside the lock, so subscribing from
+    the event loop never waits on FFmpeg.
+    """
+
+    def __init__(
+        self,
+        video_id: str,
+        source_factory: SourceFactory,
+        on_close: Callable[["SharedStream"], None],
+    ):
+        """Initializes a SharedStream instance and starts its upstream source.
+        Args:
+            video_id (str): The id of the video being played.
+            source_factory (SourceFactory): Creates the upstream source of the track.
+            on_close: Called once the last subscriber left and the upstream source is cleaned up.
+        """
+        self.video_id = video_id
+        self.source_factory = source_factory
+        self.started_at = time.monotonic()
+        self._on_close = on_close
+        self._source = source_factory(0.0)
+        self._frames: List[bytes] = []
+        self._base = 0  # frame index of self._frames[0]
+        self._finished = False
+        self._closed = False
+        self._reading = False  # a subscriber is reading the next frame from the upstream source
+        self._lock = threading.Condition()
+        self._subscribers: Set["SharedAudioSource"] = set()
+
+    def is_opus(self) -> bool:
+        return self._source.is_opus()
+
+    def _can_join(self) -> bool:
+        '''Returns True if a new subscriber can still start from the beginning of the track'''
+        return (
+            not self._closed
+            and not self._finished
+            and self._base == 0
+            and time.monotonic() - self.started_at < JOIN_WINDOW
+        )
+
+    def subscribe(self) -> Optional["SharedAudioSource"]:
+        '''Returns a new audio source reading this stream from its beginning
+        Returns:
+            Optional[SharedAudioSource]: The source, None if the stream can't be joined anymore
+        '''
+        with self._lock:
+            if not self._can_join():
+                return None
+            subscriber = SharedAudioSource(self)
+            self._subscribers.add(subscriber)
+            return subscriber
+
+    def unsubscribe(self, subscriber: "SharedAudioSource") -> None:
+        '''Removes a subscriber, closing the upstream source after the last one leaves'''
+        with self._lock:
+            self._subscribers.discard(subscriber)
+            if self._subscribers or self._closed:
+                self._trim()
+                return
+            self._closed = True
+            self._frames = []
+            self._lock.notify_all()
+        self._source.cleanup()
+        self._on_close(self)
+
+    def read_frame(self, index: int) -> Optional[bytes]:
+        '''Returns the frame at index, decoding the frames up to it if needed
+        Returns:
+            Optional[bytes]: The frame, b"" at the end of the track or None if
+            the frame was already dropped from the buffer
+        '''
+        while True:
+            with self._lock:
+                while True:
+                    if index < self._base or self._closed:
+                        return None
+                    position = index - self._base
+                    if position < len(self._frames):
+                        frame = self._frames[position]
+                        self._trim()
+                        return frame
+                    if self._finished:
+                        return b""
+                    if not self._reading:
+                        break
+                    self._lock.wait()  # another subscriber is reading the next frame
+                self._reading = True
+
+            frame = b""
+            try:
+                frame = self._source.read()  # blocking, the lock isn't held
+            finally:
+                with self._lock:
+                    self._reading = False
+                    if not frame:
+                        self._finished = True
+                    elif not self._closed:
+                        self._frames.append(frame)
+                    self._lock.notify_all()
+
+    def _trim(self) -> None:
+        '''Drops the frames every subscriber has read, detaching subscribers that lag too far
+        Must be called with the lock held.
+        '''
+        if self._can_join():
+            return  # late joiners still need the beginning of the track
+        head = self._base + len(self._frames)
+        attached = []
+        for subscriber in self._subscribers:
+            if head - subscriber.cursor > MAX_LAG_FRAMES:
+                subscriber.detached = True
+            if not subscriber.detached:
+                attached.append(subscriber.cursor)
+        oldest = min(attached, default=head)
+        if oldest > self._base:
+            del self._frames[:oldest - self._base]
+            self._base = oldest
+
+
+class SharedAudioSource(discord.AudioSource):
+    """The audio source of one guild reading a SharedStream with its own cursor.
+    Pausing or skipping only affects this guild. A subscriber that falls too far
+    behind (e.g. paused for a long time) continues on its own upstream source.
+    """
+
+    def __init__(self, stream: SharedStream):
+        """Initializes a SharedAudioSource instance.
+        Args:
+            stream (SharedStream): The stream to read from.
+        """
+        self.stream = stream
+        self.cursor = 0
+        self.detached = False
+        self._private_source: Optional[discord.AudioSource] = None
+        self._opus = stream.is_opus()
+
+    def read(self) -> bytes:
+        if not self.detached:
+            frame = self.stream.read_frame(self.cursor)
+            if frame is not None:
+                self.cursor += 1
+                return frame
+            self.detached = True
+
+        if self._private_source is None:
+            # continue where this guild was, on a decode of its own
+            self._private_source = self.stream.source_factory(self.cursor * FRAME_DURATION)
+        return self._private_source.read()
+
+    def is_opus(self) -> bool:
+        return self._opus
+
+    def cleanup(self) -> None:
+        if self._private_source is not None:
+            self._private_source.cleanup()
+            self._private_source = None
+        self.stream.unsubscribe(self)
+
+
+class SharedAudioBroker:
+    """Lets guilds that start the same track at about the same time share one decode.
+    The number of FFmpeg processes and upstream connections grows with the number
+    of distinct tracks playing instead of the number of guilds.
+    """
+
+    def __init__(self):
+        """Initializes a SharedAudioBroker instance."""
+        self._streams: Dict[str, SharedStream] = {}  # video id -> latest stream of the track
+        self._lock = threading.Lock()
+
+    @property
+    def stream_count(self) -> int:
+        '''The number of tracks currently being decoded'''
+        return len(self._streams)
+
+    def subscribe(self, video_id: str, source_factory: SourceFactory) -> SharedAudioSource:
+        '''Returns an audio source for a track, joining a running decode of it when possible
+        Args:
+            video_id (str): The id of the video to play
+            source_factory (SourceFactory): Creates the upstream source if a new decode is needed
+        Returns:
+            SharedAudioSource: The source to give to VoiceClient.play
+        '''
+        with self._lock:
+            stream = self._streams.get(video_id)
+            subscriber = stream.subscribe() if stream is not None else None
+            if subscriber is None:
+                stream = SharedStream(video_id, source_factory, self._forget)
+                self._streams[video_id] = stream
+                subscriber = stream.subscribe()
+            return subscriber
+
+    def _forget(self, stream: SharedStream) -> None:
+        '''Removes a closed stream unless a newer stream of the same track replaced it'''
+        with self._lock:
+            if self._streams.get(stream.video_id) is stream:
+                del self._streams[stream.video_id]
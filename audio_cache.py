@@ -0,0 +1,159 @@
+import asyncio
+import os
+import shlex
+from collections import OrderedDict
+from youtube_api import TTLCache
+from typing import Optional, Set
+
+AUDIO_CACHE_DIR = "audio_cache"
+AUDIO_CACHE_MAX_BYTES = 2 * 1024 ** 3  # 2 GiB
+MIN_PLAYS_TO_CACHE = 2  # a track is stored once it is played this many times
+PLAY_COUNT_TTL = 24 * 3600  # plays older than a day don't count towards caching
+MAX_CONCURRENT_DOWNLOADS = 2
+AUDIO_FILE_EXTENSION = ".opus"  # Ogg Opus, played back without transcoding
+
+
+class AudioCache:
+    """An on-disk cache of encoded audio keyed by video id.
+    Tracks are downloaded in the background once they are played often enough,
+    and the least recently played files are deleted when the total size goes over
+    the byte budget.
+    """
+
+    def __init__(
+        self,
+        directory: str = AUDIO_CACHE_DIR,
+        max_bytes: int = AUDIO_CACHE_MAX_BYTES,
+        before_options: str = "",
+    ):
+        """Initializes an AudioCache instance and indexes the files already in the directory.
+        Args:
+            directory (str): The directory the audio files are stored in.
+            max_bytes (int): The maximum total size of the stored files.
+            before_options (str): FFmpeg input options used when downloading a stream.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.before_options = before_options
+        os.makedirs(directory, exist_ok=True)
+
+        self._files: "OrderedDict[str, int]" = OrderedDict()  # video id -> size, least recent first
+        self._total_bytes = 0
+        self._play_counts = TTLCache(100000, PLAY_COUNT_TTL)
+        self._downloads = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+        self._in_flight: Set[str] = set()
+        self._background: Set[asyncio.Task] = set()
+
+        entries = []
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.endswith(".part"):
+                os.remove(path)  # left over from an interrupted download
+            elif name.endswith(AUDIO_FILE_EXTENSION):
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, name[:-len(AUDIO_FILE_EXTENSION)], stat.st_size))
+        for _, video_id, size in sorted(entries):
+            self._files[video_id] = size
+            self._total_bytes += size
+        self._evict()
+
+    @property
+    def total_bytes(self) -> int:
+        '''The total size of the stored files'''
+        return self._total_bytes
+
+    def path_for(self, video_id: str) -> str:
+        '''Returns the path of the audio file of a video'''
+        return os.path.join(self.directory, video_id + AUDIO_FILE_EXTENSION)
+
+    def get(self, video_id: str) -> Optional[str]:
+        '''Returns the path of the cached audio of a video and marks it as recently played
+        Returns:
+            Optional[str]: The path of the audio file, None if the video isn't cached
+        '''
+        if video_id not in self._files:
+            return None
+        path = self.path_for(video_id)
+        try:
+            os.utime(path)  # the modification time keeps the recency across restarts
+        except FileNotFoundError:
+            self._remove(video_id)
+            return None
+        self._files.move_to_end(video_id)
+        return path
+
+    def record_play(self, video_id: str, stream_url: str, codec: Optional[str]) -> None:
+        '''Counts a play of a video and downloads it in the background once it is played often
+        Args:
+            video_id (str): The id of the video
+            stream_url (str): The direct audio URL of the video
+            codec (Optional[str]): The audio codec of the stream if known
+        '''
+        if video_id in self._files or video_id in self._in_flight:
+            return
+        plays = self._play_counts.get(video_id, 0) + 1
+        self._play_counts.set(video_id, plays)
+        if plays < MIN_PLAYS_TO_CACHE:
+            return
+
+        self._in_flight.add(video_id)
+        task = asyncio.create_task(self._download(video_id, stream_url, codec))
+        self._background.add(task)  # keep a reference until it is done
+        task.add_done_callback(self._background.discard)
+
+    async def _download(self, video_id: str, stream_url: str, codec: Optional[str]) -> None:
+        '''Stores the audio of a stream as an Ogg Opus file'''
+        path = self.path_for(video_id)
+        part_path = path + ".part"
+        # Opus is copied as is, other codecs are encoded once
+        audio_codec = "copy" if codec in ("opus", "libopus") else "libopus"
+        args = [
+            *shlex.split(self.before_options), "-i", stream_url,
+            "-vn", "-map_metadata", "-1", "-c:a", audio_codec,
+            "-f", "opus", "-loglevel", "error", "-y", part_path,
+        ]
+        try:
+            async with self._downloads:
+                process = await asyncio.create_subprocess_exec(
+                    "ffmpeg", *args,
+                    stdin=asyncio.subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.PIPE,
+                )
+                try:
+                    _, stderr = await process.communicate()
+                except asyncio.CancelledError:
+                    process.kill()
+                    raise
+            if process.returncode != 0:
+                print(f"Caching {video_id} failed: {stderr.decode(errors='replace').strip()}")
+                return
+            os.replace(part_path, path)
+            size = os.path.getsize(path)
+            self._files[video_id] = size
+            self._total_bytes += size
+            self._evict()
+        except Exception as e:
+            print(e)
+        finally:
+            self._in_flight.discard(video_id)
+            if os.path.exists(part_path):
+                os.remove(part_path)
+
+    def _remove(self, video_id: str) -> None:
+        '''Forgets a video and deletes its file'''
+        self._total_bytes -= self._files.pop(video_id, 0)
+        try:
+            os.remove(self.path_for(video_id))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self) -> None:
+        '''Deletes the least recently played files until the cache fits its byte budget'''
+        while self._total_bytes > self.max_bytes and self._files:
+            self._remove(next(iter(self._files)))
+
+    def close(self) -> None:
+        '''Cancels the running downloads'''
+        for task in list(self._background):
+            task.cancel()
@@ -0,0 +1,65 @@
+import discord
+from metrics import METRICS
+from typing import Optional
+
+# how the audio of a stream is handed to the voice client
+AUDIO_MODE_PASSTHROUGH = "passthrough"  # copy Opus streams as they are, encode the others once
+AUDIO_MODE_TRANSCODE = "transcode"  # always let FFmpeg encode Opus
+AUDIO_MODE_PCM = "pcm"  # decode to PCM and let discord.py encode Opus (the old behaviour)
+AUDIO_MODES = (AUDIO_MODE_PASSTHROUGH, AUDIO_MODE_TRANSCODE, AUDIO_MODE_PCM)
+
+OPUS_CODECS = ("opus", "libopus")
+
+
+def make_audio_source(
+    url: str,
+    mode: str,
+    ffmpeg_options: dict,
+    codec: Optional[str] = None,
+    offset: float = 0.0,
+) -> discord.AudioSource:
+    """Creates the audio source that plays a stream URL in a voice channel.
+    In passthrough mode Opus streams (YouTube's WebM audio) are copied without
+    transcoding, every other codec is encoded to Opus once by FFmpeg so the bot
+    process never has to encode audio itself.
+    Args:
+        url (str): The direct URL (or path) of the audio.
+        mode (str): One of AUDIO_MODES.
+        ffmpeg_options (dict): The before_options and options passed to FFmpeg.
+        codec (Optional[str]): The audio codec of the stream, in passthrough mode
+            an unknown codec is encoded.
+        offset (float): The position in seconds to start playing from.
+    Returns:
+        discord.AudioSource: The source to give to VoiceClient.play.
+    """
+    if offset > 0:
+        ffmpeg_options = dict(ffmpeg_options)
+        ffmpeg_options["before_options"] = (
+            f"-ss {offset:.2f} " + ffmpeg_options.get("before_options", "")
+        ).strip()
+
+    if mode == AUDIO_MODE_PCM:
+        return discord.FFmpegPCMAudio(url, **ffmpeg_options)
+
+    if mode == AUDIO_MODE_TRANSCODE:
+        return discord.FFmpegOpusAudio(url, codec="libopus", **ffmpeg_options)
+
+    if mode != AUDIO_MODE_PASSTHROUGH:
+        raise ValueError(f"Unknown audio mode {mode!r}, expected one of {AUDIO_MODES}")
+
+    codec = "copy" if codec in OPUS_CODECS else "libopus"
+    return discord.FFmpegOpusAudio(url, codec=codec, **ffmpeg_options)
+
+
+async def probe_codec(url: str, mode: str, codec: Optional[str] = None) -> Optional[str]:
+    """Returns the audio codec of a stream, probing it with ffprobe only when passthrough needs it.
+    Args:
+        url (str): The direct URL (or path) of the audio.
+        mode (str): One of AUDIO_MODES.
+        codec (Optional[str]): The codec if already known.
+    """
+    if codec is None and mode == AUDIO_MODE_PASSTHROUGH:
+        # probes in an executor
+        with METRICS.stage("probe"):
+            codec, _ = await discord.FFmpegOpusAudio.probe(url)
+    return codec
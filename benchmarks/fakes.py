@@ -0,0 +1,323 @@
+"""Local stand-ins for YouTube and Discord used by the load simulation.
+
+Nothing here talks to the network: searches and watch pages are served by a local
+aiohttp server, voice clients only keep time, and text channels store messages.
+"""
+import asyncio
+import hashlib
+import json
+import random
+import time
+from typing import Callable, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import discord
+from aiohttp import web
+
+from request_scheduler import PRIORITY_INTERACTIVE, RequestScheduler
+from youtube_api import YoutubeAPI
+
+RESULTS_PER_SEARCH = 5
+VIDEO_ID_ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_"
+
+
+def fake_video_id(seed: str) -> str:
+    """Returns a stable 11 character video id for a seed."""
+    digest = hashlib.sha1(seed.encode()).digest()
+    return "".join(VIDEO_ID_ALPHABET[byte % 64] for byte in digest[:11])
+
+
+def search_page(query: str, duration: int) -> str:
+    """Returns a search results page with the ytInitialData layout YoutubeAPI parses."""
+    renderers = [
+        {
+            "videoRenderer": {
+                "videoId": fake_video_id(f"{query}/{rank}"),
+                "title": {"runs": [{"text": f"{query} (result {rank})"}]},
+                "lengthText": {"simpleText": f"{duration // 60}:{duration % 60:02d}"},
+                "ownerText": {"runs": [{"text": "Fake Channel"}]},
+            }
+        }
+        for rank in range(RESULTS_PER_SEARCH)
+    ]
+    data = {"contents": {"sectionListRenderer": {"contents": [{"itemSectionRenderer": {"contents": renderers}}]}}}
+    return f"<html><script>var ytInitialData = {json.dumps(data)};</script></html>"
+
+
+class FakeYoutubeServer:
+    """Serves /results and /watch pages on localhost with a simulated latency."""
+
+    def __init__(self, search_latency: float, watch_latency: float, track_duration: int):
+        """Initializes a FakeYoutubeServer instance.
+        Args:
+            search_latency (float): The mean number of seconds a search takes.
+            watch_latency (float): The mean number of seconds a watch page takes.
+            track_duration (int): The duration in seconds of every video.
+        """
+        self.search_latency = search_latency
+        self.watch_latency = watch_latency
+        self.track_duration = track_duration
+        self.search_count = 0
+        self.watch_count = 0
+        self._runner: Optional[web.AppRunner] = None
+        self.base_url = ""
+
+    @staticmethod
+    async def _delay(mean: float) -> None:
+        await asyncio.sleep(random.uniform(0.5, 1.5) * mean)
+
+    async def _search(self, request: web.Request) -> web.Response:
+        self.search_count += 1
+        await self._delay(self.search_latency)
+        page = search_page(request.query.get("q", ""), self.track_duration)
+        return web.Response(text=page, content_type="text/html")
+
+    async def _watch(self, request: web.Request) -> web.Response:
+        self.watch_count += 1
+        await self._delay(self.watch_latency)
+        return web.Response(text=f"<html>{request.query.get('v', '')}</html>", content_type="text/html")
+
+    async def start(self) -> None:
+        '''Starts the server on a free port'''
+        app = web.Application()
+        app.router.add_get("/results", self._search)
+        app.router.add_get("/watch", self._watch)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{port}"
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+class FakeExtractor:
+    """Replaces the ExtractionPool: fetches the watch page from the fake server instead of running youtube_dl."""
+
+    def __init__(self, server: FakeYoutubeServer, scheduler: RequestScheduler):
+        self.server = server
+        self.scheduler = scheduler
+        self.size = 1
+
+    async def extract(self, video_url: str, priority: int = PRIORITY_INTERACTIVE) -> Tuple[str, Optional[str]]:
+        video_id = parse_qs(urlparse(video_url).query)["v"][0]
+        url = f"{self.server.base_url}/watch?v={video_id}"
+
+        async def request() -> None:
+            async with YoutubeAPI.get_session().get(url) as response:
+                await response.text()
+
+        await self.scheduler.run(request, priority)
+        expire = int(time.time()) + 6 * 3600
+        return f"{self.server.base_url}/stream/{video_id}?expire={expire}", "opus"
+
+    def shutdown(self) -> None:
+        pass
+
+
+class NullAudioCache:
+    """Replaces the AudioCache, the simulation has no FFmpeg to download tracks with."""
+
+    total_bytes = 0
+
+    def get(self, video_id: Optional[str]) -> None:
+        return None
+
+    def record_play(self, video_id: str, stream_url: str, codec: Optional[str]) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class NullLyrics:
+    """Replaces the LyricsService so playing a song doesn't search Genius."""
+
+    hit_rate = 0.0
+
+    def prefetch(self, title: str, video_id: Optional[str] = None) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class FakeAudioSource(discord.AudioSource):
+    """An Opus source without frames, FFmpeg isn't started."""
+
+    def read(self) -> bytes:
+        return b""
+
+    def is_opus(self) -> bool:
+        return True
+
+
+def make_fake_audio_source(location, mode, ffmpeg_options, codec=None, offset=0.0) -> discord.AudioSource:
+    """Drop-in for audio_source.make_audio_source."""
+    return FakeAudioSource()
+
+
+class PlaybackStats:
+    """The timings recorded by the fake voice clients."""
+
+    def __init__(self):
+        self.track_gaps: List[float] = []  # seconds between the end of a track and the start of the next
+        self.first_play_delays: List[float] = []  # seconds between the first -play and the first track
+        self.plays = 0
+
+
+class FakeVoiceClient:
+    """Plays a track by waiting for its duration, then calls the after callback like discord.py does."""
+
+    def __init__(self, guild: "FakeGuild", channel: "FakeVoiceChannel", stats: PlaybackStats, track_seconds: float):
+        self.guild = guild
+        self.channel = channel
+        self.stats = stats
+        self.track_seconds = track_seconds
+        self.plays = 0
+        self._source: Optional[discord.AudioSource] = None
+        self._paused = False
+        self._ended_at: Optional[float] = None
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._after: Optional[Callable[[Optional[Exception]], None]] = None
+
+    def is_playing(self) -> bool:
+        return self._source is not None and not self._paused
+
+    def is_paused(self) -> bool:
+        return self._source is not None and self._paused
+
+    def is_connected(self) -> bool:
+        return self.guild.voice_client is self
+
+    def play(self, source: discord.AudioSource, *, after: Callable[[Optional[Exception]], None]) -> None:
+        now = time.perf_counter()
+        if self._ended_at is not None:
+            self.stats.track_gaps.append(now - self._ended_at)
+        elif self.guild.first_play_at is not None:
+            self.stats.first_play_delays.append(now - self.guild.first_play_at)
+        self.plays += 1
+        self.stats.plays += 1
+        self._source = source
+        self._after = after
+        # the audio thread of discord.py calls after() once the source is exhausted
+        self._timer = asyncio.get_running_loop().call_later(self.track_seconds, self._finish, after)
+
+    def _finish(self, after: Callable[[Optional[Exception]], None]) -> None:
+        source, self._source = self._source, None
+        self._timer = None
+        if source is None:
+            return
+        source.cleanup()
+        self._ended_at = time.perf_counter()
+        after(None)
+
+    def pause(self) -> None:
+        self._paused = True
+
+    def resume(self) -> None:
+        self._paused = False
+
+    def stop(self) -> None:
+        # discord.py calls after() when a track is stopped too, e.g. by -skip
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+            self._finish(self._after)
+
+    async def disconnect(self, *, force: bool = False) -> None:
+        # like discord.py, the playing track is stopped first so its after() callback runs
+        self.stop()
+        self.guild.voice_client = None
+
+
+class FakeVoiceChannel:
+    def __init__(self, channel_id: int, guild: "FakeGuild", stats: PlaybackStats, track_seconds: float):
+        self.id = channel_id
+        self.guild = guild
+        self.stats = stats
+        self.track_seconds = track_seconds
+
+    async def connect(self) -> FakeVoiceClient:
+        self.guild.voice_client = FakeVoiceClient(self.guild, self, self.stats, self.track_seconds)
+        return self.guild.voice_client
+
+
+class FakeMessage:
+    def __init__(self, message_id: int, channel: "FakeTextChannel", content: str):
+        self.id = message_id
+        self.channel = channel
+        self.content = content
+
+    async def edit(self, *, content: str) -> "FakeMessage":
+        self.channel.edit_count += 1
+        self.content = content
+        return self
+
+
+class FakeTextChannel:
+    """Counts the messages and edits of the bot."""
+
+    _next_message_id = 1
+
+    def __init__(self, channel_id: int):
+        self.id = channel_id
+        self.last_message_id: Optional[int] = None
+        self.send_count = 0
+        self.edit_count = 0
+
+    async def send(self, content: str = "", **_) -> FakeMessage:
+        self.send_count += 1
+        FakeTextChannel._next_message_id += 1
+        message = FakeMessage(FakeTextChannel._next_message_id, self, content)
+        self.last_message_id = message.id
+        return message
+
+
+class FakeGuild:
+    """A guild with one voice channel and one text channel."""
+
+    def __init__(self, guild_id: int, stats: PlaybackStats, track_seconds: float):
+        self.id = guild_id
+        self.voice_client: Optional[FakeVoiceClient] = None
+        self.voice_channel = FakeVoiceChannel(guild_id * 10 + 1, self, stats, track_seconds)
+        self.text_channel = FakeTextChannel(guild_id * 10 + 2)
+        self.first_play_at: Optional[float] = None
+
+    def get_channel(self, channel_id: int):
+        for channel in (self.voice_channel, self.text_channel):
+            if channel.id == channel_id:
+                return channel
+        return None
+
+    async def change_voice_state(self, **_) -> None:
+        pass
+
+
+class FakeVoiceState:
+    def __init__(self, channel: FakeVoiceChannel):
+        self.channel = channel
+
+
+class FakeAuthor:
+    def __init__(self, guild: FakeGuild):
+        self.voice = FakeVoiceState(guild.voice_channel)
+
+
+class FakeContext:
+    """The parts of commands.Context the commands of FunkyBot use."""
+
+    def __init__(self, guild: FakeGuild):
+        self.guild = guild
+        self.author = FakeAuthor(guild)
+        self.channel = guild.text_channel
+        self.message = self  # ctx.message.channel is the text channel too
+
+    async def send(self, content: str = "", **kwargs) -> FakeMessage:
+        return await self.channel.send(content, **kwargs)
+
+    async def reply(self, content: str = "", **kwargs) -> FakeMessage:
+        return await self.channel.send(content, **kwargs)
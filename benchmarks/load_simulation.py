@@ -0,0 +1,245 @@
+"""Load simulation of FunkyBot with local stand-ins for YouTube and Discord.
+
+Every simulated guild joins the bot to its voice channel and enqueues a few songs
+with -play, the fake voice clients then play them back to back. The run reports,
+for each number of guilds:
+
+- enqueue latency: how long the -play command takes to return
+- first play: the time between the first -play of a guild and its first track
+- track-change gap: the time between the end of a track and the start of the next
+- loop lag: how late the event loop runs a task that sleeps for a few milliseconds
+- RSS: the resident memory of the process before, at the peak and after leaving
+
+Usage:
+    python benchmarks/load_simulation.py --guilds 10 100 1000 --json bench_output.json
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import funky_bot  # noqa: E402
+import youtube_api  # noqa: E402
+from funky_bot import FunkyBot  # noqa: E402
+from request_scheduler import RequestScheduler  # noqa: E402
+from youtube_api import (  # noqa: E402
+    YoutubeAPI, TTLCache, EMPTY_SEARCH_TTL, SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL, TITLE_CACHE_SIZE, TITLE_CACHE_TTL,
+)
+from fakes import (  # noqa: E402
+    FakeContext, FakeExtractor, FakeGuild, FakeYoutubeServer, NullAudioCache, NullLyrics,
+    PlaybackStats, make_fake_audio_source,
+)
+
+LOOP_PROBE_INTERVAL = 0.005  # seconds the loop lag probe sleeps between samples
+
+
+def rss_bytes() -> int:
+    """Returns the resident memory of the process, the peak if the current value isn't available."""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def percentiles(values: List[float], points=(50, 95, 99)) -> Dict[str, Optional[float]]:
+    """Returns the given percentiles of values in milliseconds, None when there are no values."""
+    ordered = sorted(values)
+    result = {}
+    for point in points:
+        if not ordered:
+            result[f"p{point}"] = None
+            continue
+        index = min(len(ordered) - 1, round(point / 100 * (len(ordered) - 1)))
+        result[f"p{point}"] = ordered[index] * 1000
+    result["max"] = ordered[-1] * 1000 if ordered else None
+    return result
+
+
+class LoopLagProbe:
+    """Measures how late the event loop wakes up a task that sleeps for a fixed time."""
+
+    def __init__(self, interval: float = LOOP_PROBE_INTERVAL):
+        self.interval = interval
+        self.samples: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - start - self.interval))
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+
+
+def create_bot(server: FakeYoutubeServer, directory: str) -> FunkyBot:
+    """Creates a FunkyBot whose YouTube, extraction, audio and lyrics dependencies are the local stand-ins."""
+    bot = FunkyBot(
+        command_prefix="-",
+        genius_token="unused",
+        extraction_workers=1,
+        audio_cache_dir=os.path.join(directory, "audio_cache"),
+        snapshot_path=None,
+        metrics_port=None,
+        title_index_path=None,
+        lyrics_cache_dir=os.path.join(directory, "lyrics_cache"),
+    )
+    bot._extraction_pool.shutdown()
+    bot._extraction_pool = FakeExtractor(server, YoutubeAPI.scheduler)
+    bot._resolver.extractor = bot._extraction_pool
+    bot._audio_cache = NullAudioCache()
+    bot._lyrics = NullLyrics()
+    return bot
+
+
+async def simulate(guild_count: int, args: argparse.Namespace) -> dict:
+    """Runs the simulation with guild_count guilds and returns its measurements."""
+    rng = random.Random(args.seed)
+    server = FakeYoutubeServer(args.search_latency, args.watch_latency, args.track_duration)
+    await server.start()
+    # every run starts cold: empty caches and a fresh scheduler bound to this event loop
+    youtube_api.BASE_SEARCH_URL = server.base_url + "/results?q="
+    YoutubeAPI.search_cache = TTLCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL, EMPTY_SEARCH_TTL)
+    YoutubeAPI.title_cache = TTLCache(TITLE_CACHE_SIZE, TITLE_CACHE_TTL)
+    YoutubeAPI.scheduler = RequestScheduler(args.request_rate, args.request_rate, args.request_concurrency)
+    funky_bot.make_audio_source = make_fake_audio_source
+
+    gc.collect()
+    rss_start = rss_bytes()
+    stats = PlaybackStats()
+    titles = [f"benchmark song {i}" for i in range(args.title_pool)]
+    weights = [1 / (rank + 1) for rank in range(args.title_pool)]  # a few songs are very popular
+    enqueue_latencies: List[float] = []
+    probe = LoopLagProbe()
+
+    with tempfile.TemporaryDirectory() as directory:
+        bot = create_bot(server, directory)
+        play = bot.get_command("play").callback
+        guilds = [FakeGuild(guild_id, stats, args.track_seconds) for guild_id in range(1, guild_count + 1)]
+
+        async def user(guild: FakeGuild) -> None:
+            await asyncio.sleep(rng.uniform(0, args.ramp))
+            context = FakeContext(guild)
+            guild.first_play_at = time.perf_counter()
+            for _ in range(args.songs_per_guild):
+                title = rng.choices(titles, weights)[0]
+                start = time.perf_counter()
+                await play(context, title=title)
+                enqueue_latencies.append(time.perf_counter() - start)
+                await asyncio.sleep(rng.uniform(0, args.enqueue_spacing))
+
+        probe.start()
+        started = time.perf_counter()
+        await asyncio.gather(*(user(guild) for guild in guilds))
+        expected_plays = guild_count * args.songs_per_guild
+        rss_peak = rss_bytes()
+        while stats.plays < expected_plays and time.perf_counter() - started < args.timeout:
+            await asyncio.sleep(0.1)
+            rss_peak = max(rss_peak, rss_bytes())
+        duration = time.perf_counter() - started
+        probe.stop()
+
+        for guild in guilds:
+            bot._leave_channel(guild.id)
+            if guild.voice_client is not None:
+                await guild.voice_client.disconnect()
+        await bot.close()
+    await server.stop()
+    gc.collect()
+
+    return {
+        "guilds": guild_count,
+        "plays": stats.plays,
+        "expected_plays": expected_plays,
+        "duration_s": duration,
+        "enqueue_ms": percentiles(enqueue_latencies),
+        "first_play_ms": percentiles(stats.first_play_delays),
+        "track_gap_ms": percentiles(stats.track_gaps),
+        "loop_lag_ms": percentiles(probe.samples),
+        "rss_start_mb": rss_start / 2 ** 20,
+        "rss_peak_mb": rss_peak / 2 ** 20,
+        "rss_end_mb": rss_bytes() / 2 ** 20,
+        "searches": server.search_count,
+        "extractions": server.watch_count,
+        "messages_sent": sum(guild.text_channel.send_count for guild in guilds),
+        "messages_edited": sum(guild.text_channel.edit_count for guild in guilds),
+    }
+
+
+def format_ms(stats: Dict[str, Optional[float]]) -> str:
+    '''Formats percentiles as p50/p95/p99 in milliseconds'''
+    return "/".join("-" if stats[key] is None else f"{stats[key]:.1f}" for key in ("p50", "p95", "p99"))
+
+
+def print_report(results: List[dict]) -> None:
+    '''Prints one line of measurements per number of guilds'''
+    header = (
+        f"{'guilds':>6} {'plays':>11} {'enqueue ms':>18} {'first play ms':>22} "
+        f"{'track gap ms':>18} {'loop lag ms':>18} {'RSS MB start/peak/end':>22} {'msgs':>6}"
+    )
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        rss = f"{result['rss_start_mb']:.0f}/{result['rss_peak_mb']:.0f}/{result['rss_end_mb']:.0f}"
+        print(
+            f"{result['guilds']:>6} {result['plays']:>5}/{result['expected_plays']:<5} "
+            f"{format_ms(result['enqueue_ms']):>18} {format_ms(result['first_play_ms']):>22} "
+            f"{format_ms(result['track_gap_ms']):>18} {format_ms(result['loop_lag_ms']):>18} "
+            f"{rss:>22} {result['messages_sent']:>6}"
+        )
+    print("percentiles are p50/p95/p99")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--guilds", type=int, nargs="+", default=[10, 100, 1000], help="numbers of guilds to simulate")
+    parser.add_argument("--songs-per-guild", type=int, default=4)
+    parser.add_argument("--track-seconds", type=float, default=2.0, help="how long the fake voice clients play a track")
+    parser.add_argument("--track-duration", type=int, default=2, help="duration of the videos in the search results")
+    parser.add_argument("--title-pool", type=int, default=300, help="number of distinct song titles searched")
+    parser.add_argument("--search-latency", type=float, default=0.05, help="mean seconds a fake search takes")
+    parser.add_argument("--watch-latency", type=float, default=0.2, help="mean seconds a fake extraction takes")
+    parser.add_argument("--request-rate", type=float, default=500.0, help="rate of the YouTube request scheduler")
+    parser.add_argument("--request-concurrency", type=int, default=64)
+    parser.add_argument("--ramp", type=float, default=2.0, help="seconds over which the guilds start")
+    parser.add_argument("--enqueue-spacing", type=float, default=0.2, help="maximum seconds between two -play of a user")
+    parser.add_argument("--timeout", type=float, default=120.0, help="maximum seconds of a run")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="also write the results to this file")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    results = []
+    for guild_count in args.guilds:
+        results.append(asyncio.run(simulate(guild_count, args)))
+    print_report(results)
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import asyncio
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from youtube_dl import YoutubeDL
+from request_scheduler import RequestScheduler, ThrottledError, PRIORITY_INTERACTIVE
+from metrics import METRICS
+from typing import Optional, Tuple
+
+EXTRACT_TIMEOUT = 30  # seconds a single extraction may take
+SOCKET_TIMEOUT = 10  # seconds youtube_dl waits on a stalled connection, below EXTRACT_TIMEOUT
+MAX_JOBS_PER_WORKER = 500  # workers are recycled after this many jobs to bound memory growth (Python 3.11+)
+
+
+class ExtractionError(Exception):
+    """Raised when youtube_dl fails to extract a video."""
+
+
+class ExtractionThrottledError(ExtractionError, ThrottledError):
+    """Raised when YouTube throttles an extraction (HTTP 429) or fails temporarily (5xx)."""
+
+
+def _is_throttled(message: str) -> bool:
+    '''Returns True if a youtube_dl error message is a 429 or 5xx response'''
+    return "HTTP Error 429" in message or "HTTP Error 5" in message
+
+
+# the YoutubeDL instance kept warm inside each worker process
+_worker_ydl: Optional[YoutubeDL] = None
+
+
+def _init_worker(ydl_options: dict) -> None:
+    '''Creates the long lived YoutubeDL instance of a worker process'''
+    global _worker_ydl
+    _worker_ydl = YoutubeDL(ydl_options)
+
+
+def _extract_stream(video_url: str) -> Tuple[str, Optional[str]]:
+    '''Runs youtube_dl in a worker process and returns the direct audio URL and its codec'''
+    try:
+        info = _worker_ydl.extract_info(video_url, download=False)
+    except Exception as e:
+        # youtube_dl errors carry tracebacks that can't be sent back to the bot process
+        if _is_throttled(str(e)):
+            raise ExtractionThrottledError(str(e)) from None
+        raise ExtractionError(str(e)) from None
+    # "url" is the format picked by the "format" option
+    stream = info if info.get("url") else info["formats"][0]
+    return stream["url"], stream.get("acodec")
+
+
+class ExtractionPool:
+    """A pool of worker processes that extract stream URLs with youtube_dl.
+    Extraction is CPU heavy, so it runs outside the bot process where it can't
+    compete with the event loop and can use every core. Extractions go through the
+    request scheduler shared with the YouTube searches since both hit YouTube.
+    """
+
+    def __init__(
+        self,
+        ydl_options: dict,
+        size: Optional[int] = None,
+        timeout: float = EXTRACT_TIMEOUT,
+        scheduler: Optional[RequestScheduler] = None,
+    ):
+        """Initializes an ExtractionPool instance.
+        Args:
+            ydl_options (dict): The options passed to the YoutubeDL of every worker,
+                socket_timeout defaults to SOCKET_TIMEOUT.
+            size (Optional[int]): The number of worker processes, defaults to the number of cores.
+            timeout (float): The number of seconds a single extraction may take.
+            scheduler (Optional[RequestScheduler]): Limits the rate of the extractions, defaults to a
+                scheduler of its own.
+        """
+        # without it youtube_dl waits up to 10 minutes on a stalled connection
+        self.ydl_options = {"socket_timeout": SOCKET_TIMEOUT, **ydl_options}
+        self.size = size or os.cpu_count() or 1
+        self.timeout = timeout
+        self.scheduler = scheduler or RequestScheduler()
+        self._executor = self._create_executor()
+        # jobs are only submitted when a worker is free, so the timeout measures the extraction
+        # and not the time spent queued in the executor
+        self._workers = asyncio.Semaphore(self.size)
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        '''Creates the process pool, the processes themselves start on first use'''
+        options = {}
+        if sys.version_info >= (3, 11):  # older versions keep their workers for ever
+            options["max_tasks_per_child"] = MAX_JOBS_PER_WORKER
+        return ProcessPoolExecutor(
+            max_workers=self.size,
+            initializer=_init_worker,
+            initargs=(self.ydl_options,),
+            **options,
+        )
+
+    def _replace_executor(self, executor: ProcessPoolExecutor) -> None:
+        '''Replaces a broken or stuck process pool with a fresh one and kills its workers
+        The jobs still running in the old pool fail with BrokenProcessPool and are retried
+        in the new one by _extract.
+        '''
+        if executor is not self._executor:
+            return  # already replaced by another extraction
+        self._executor = self._create_executor()
+        processes = list((executor._processes or {}).values())
+        executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            process.kill()
+
+    async def extract(
+        self, video_url: str, priority: int = PRIORITY_INTERACTIVE
+    ) -> Tuple[str, Optional[str]]:
+        '''Returns the direct audio URL of a video and its codec
+        Args:
+            video_url (str): The watch URL of the video
+            priority (int): The priority of the extraction in the scheduler
+        Returns:
+            Tuple[str, Optional[str]]: The direct audio URL and its audio codec (e.g. "opus") if known
+        Raises:
+            ExtractionError: If youtube_dl fails to extract the video,
+                ExtractionThrottledError if YouTube still throttles it after the retries
+            asyncio.TimeoutError: If the extraction takes longer than the pool timeout
+        '''
+        return await self.scheduler.run(lambda: self._timed_extract(video_url), priority)
+
+    async def _timed_extract(self, video_url: str) -> Tuple[str, Optional[str]]:
+        with METRICS.stage("extract"):
+            return await self._extract(video_url)
+
+    async def _extract(self, video_url: str) -> Tuple[str, Optional[str]]:
+        '''Runs an extraction in a worker process, the pool is recreated if it broke or got stuck'''
+        loop = asyncio.get_running_loop()
+        async with self._workers:
+            for attempt in range(2):
+                executor = self._executor
+                try:
+                    return await asyncio.wait_for(
+                        loop.run_in_executor(executor, _extract_stream, video_url),
+                        self.timeout,
+                    )
+                except asyncio.TimeoutError:
+                    # the worker keeps running the job after wait_for gives up on it, and every
+                    # extraction given to it later would time out too
+                    self._replace_executor(executor)
+                    raise
+                except BrokenProcessPool:
+                    # a worker died (e.g. killed by the OS or after a timeout), retry once in a fresh pool
+                    self._replace_executor(executor)
+                    if attempt:
+                        raise
+
+    def shutdown(self) -> None:
+        '''Stops the worker processes'''
+        self._executor.shutdown(wait=False, cancel_futures=True)
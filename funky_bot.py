@@ -1,48 +1,187 @@
 import discord
+from discord import app_commands
 from discord.ext import commands, tasks
-from registry import Registry
-from youtube_dl import YoutubeDL
-from lyricsgenius import Genius
-import time
+from registry import Registry, Song, QUEUE_PAGE_SIZE
+from stream_resolver import StreamResolver
+from song_resolver import SongResolver
+from extraction_pool import ExtractionPool
+from request_scheduler import PRIORITY_PLAYING
+from playback_scheduler import PlaybackScheduler
+from idle_scheduler import IdleScheduler
+from audio_source import AUDIO_MODE_PASSTHROUGH, make_audio_source, probe_codec
+from audio_broker import SharedAudioBroker
+from prebuffer import PrebufferedSource, Prewarmer, PREWARM_LEAD
+from shard_launcher import ShardSupervisor, parse_shard_range
+from snapshot import (
+    SNAPSHOT_INTERVAL,
+    SNAPSHOT_PATH,
+    load_snapshot,
+    registry_to_snapshot,
+    restore_channel,
+    save_snapshot,
+)
+from audio_cache import AudioCache, AUDIO_CACHE_DIR, AUDIO_CACHE_MAX_BYTES
+from lyrics import LyricsService, LYRICS_CACHE_DIR
+from message_queue import MessageQueue, NOW_PLAYING, PLAIN, split_message
+from metrics import METRICS, METRICS_PORT, LoopLagMonitor, MetricsServer
+from title_index import TITLE_INDEX_PATH, TitleIndex, load_title_index, save_title_index
+import argparse
+import asyncio
+import os
+import re
+import signal
 import json
-from youtube_api import YoutubeAPI
+import time
+from typing import Dict, List, Optional
+from youtube_api import YoutubeAPI, NoSearchResultsError, BASE_VIDEO_URL, get_playlist_id
 
 MAX_MESSAGE_LENGTH = 1500
 MAX_INACTIVE_TIME = 3600 # 1 hour
+RESTORE_CONCURRENCY = 10  # voice channels rejoined at the same time after a restart
+KNOWN_VIDEO_PREFIX = "yt:"  # value of the /play autocomplete choices, followed by the video id
+VIDEO_ID_PATTERN = re.compile(r"[\w-]{11}")
+MAX_CHOICE_LENGTH = 100  # Discord rejects longer autocomplete choice names
 
 
 class FunkyBot(commands.Bot):
     """FunkyBot is a Discord bot that plays music in voice channels."""
 
-    def __init__(self, command_prefix: str, genius_token: str):
+    def __init__(
+        self,
+        command_prefix: str,
+        genius_token: str,
+        extraction_workers: Optional[int] = None,
+        audio_mode: str = AUDIO_MODE_PASSTHROUGH,
+        audio_cache_dir: str = AUDIO_CACHE_DIR,
+        audio_cache_bytes: int = AUDIO_CACHE_MAX_BYTES,
+        snapshot_path: Optional[str] = SNAPSHOT_PATH,
+        lyrics_cache_dir: str = LYRICS_CACHE_DIR,
+        metrics_port: Optional[int] = METRICS_PORT,
+        title_index_path: Optional[str] = TITLE_INDEX_PATH,
+        shard_id: Optional[int] = None,
+        shard_count: Optional[int] = None,
+    ):
         """"Initializes a FunkyBot instance.
         Args:
             command_prefix (str): The prefix for the commands.
             genius_token (str): The token for the Genius API used for lyrics extractions.
+            extraction_workers (Optional[int]): The number of youtube_dl worker processes,
+                defaults to the number of cores.
+            audio_mode (str): How audio is sent to voice channels, one of audio_source.AUDIO_MODES.
+            audio_cache_dir (str): The directory frequently played tracks are stored in.
+            audio_cache_bytes (int): The maximum size of the audio cache directory.
+            snapshot_path (Optional[str]): The file the registry is saved to so sessions survive
+                restarts, None disables snapshots.
+            lyrics_cache_dir (str): The directory the lyrics of played songs are cached in.
+            metrics_port (Optional[int]): The local port the Prometheus metrics are served on,
+                None disables the metrics server.
+            title_index_path (Optional[str]): The file the titles suggested by /play are saved to,
+                None keeps them in memory only.
+            shard_id (Optional[int]): The gateway shard run by this process, None to run unsharded.
+            shard_count (Optional[int]): The total number of shards.
         """
         commands.Bot.__init__(
             self,
             command_prefix=command_prefix,
             help_command=None,
             intents=discord.Intents.all(),
+            shard_id=shard_id,
+            shard_count=shard_count,
         )
-        self._registry = Registry()
+        self._registry = Registry(shard_id, shard_count)  # only holds the guilds of this shard
         self._ydl_options = {"format": "bestaudio"}
+        self._extraction_pool = ExtractionPool(
+            self._ydl_options, extraction_workers, scheduler=YoutubeAPI.scheduler
+        )
+        self._song_resolver = SongResolver()
+        self._resolver = StreamResolver(self._extraction_pool, self._song_resolver)
+        self._playlist_tasks: Dict[int, asyncio.Task] = {}  # guild id -> playlist being enqueued
+        self._scheduler = PlaybackScheduler(
+            self._play_next, self._report_playback_error, lambda guild_id: guild_id in self._registry.servers
+        )
+        self._idle = IdleScheduler(MAX_INACTIVE_TIME, self._leave_inactive)
         self._ffmpeg_options = {
             "before_options": "-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5",
             "options": "-vn",
         }
+        self._ffmpeg_file_options = {"options": "-vn"}  # for tracks played from the audio cache
+        self._audio_mode = audio_mode  # passthrough copies Opus streams without transcoding
+        self._audio_cache = AudioCache(
+            audio_cache_dir, audio_cache_bytes, self._ffmpeg_options["before_options"]
+        )
+        self._audio_broker = SharedAudioBroker()
+        self._prewarmer = Prewarmer(self._create_prebuffered_source)
+        self._snapshot_path = snapshot_path
+        self._restored = False
+        self._messages = MessageQueue()
+        self._lyrics = LyricsService(genius_token, MAX_MESSAGE_LENGTH, lyrics_cache_dir)
+        self._loop_lag = LoopLagMonitor()
+        self._metrics_server = MetricsServer(port=metrics_port) if metrics_port else None
+        self._title_index_path = title_index_path
+        self._titles = load_title_index(title_index_path) if title_index_path else TitleIndex()
+        self._titles_saved = self._titles.changes
+        self._register_gauges()
         self.add_commands()
-        self.__genius_token = genius_token
+        self.add_app_commands()
+
+    async def setup_hook(self) -> None:
+        """Starts the metrics, registers the slash commands and makes SIGTERM (sent by deploys)
+        close the bot cleanly so a snapshot is saved
+        """
+        self._loop_lag.start()
+        if self._metrics_server is not None:
+            await self._metrics_server.start()
+        if self.shard_id in (None, 0):  # slash commands are global, one shard registers them
+            try:
+                await self.tree.sync()
+            except discord.HTTPException as e:
+                print(f"Slash commands not registered: {e}")
+        try:
+            asyncio.get_running_loop().add_signal_handler(
+                signal.SIGTERM, lambda: asyncio.create_task(self.close())
+            )
+        except (NotImplementedError, AttributeError):  # not supported on Windows
+            pass
 
     async def on_ready(self) -> None:
         """This function is called when the bot is ready
-        It starts the play_loop and the leave_inactive_chans tasks
+        It resumes the sessions saved before the last restart and starts the inactivity scheduler
+        and the save_snapshots task, songs are started by the playback scheduler
         """
-        self.play_loop.start()
-        self.leave_inactive_chans.start()
+        if not self._restored:  # on_ready is called again after reconnects
+            self._restored = True
+            await self._restore_snapshot()
+        self._idle.start()
+        if (self._snapshot_path or self._title_index_path) and not self.save_snapshots.is_running():
+            self.save_snapshots.start()
         print("bot is ready")
 
+    async def close(self) -> None:
+        """Saves a snapshot and closes the bot, the shared YouTube HTTP session and the extraction workers"""
+        self.save_snapshots.cancel()
+        if self._snapshot_path and self._restored:
+            try:
+                save_snapshot(registry_to_snapshot(self._registry), self._snapshot_path)
+            except OSError as e:
+                print(e)
+        self._save_titles()
+        self._scheduler.stop_all()
+        self._idle.stop()
+        self._prewarmer.discard_all()
+        self._song_resolver.close()
+        self._lyrics.close()
+        self._messages.close()
+        self._loop_lag.stop()
+        if self._metrics_server is not None:
+            await self._metrics_server.stop()
+        for task in self._playlist_tasks.values():
+            task.cancel()
+        self._audio_cache.close()
+        await YoutubeAPI.close_session()
+        YoutubeAPI.scheduler.close()
+        self._extraction_pool.shutdown()
+        await commands.Bot.close(self)
+
     async def _valid_voice_channel(
         self, ctx: discord.ext.commands.context.Context
     ) -> bool:
@@ -70,13 +209,13 @@ class FunkyBot(commands.Bot):
                 return
 
             await ctx.reply("See you later ;(")
-            self._registry.leave_channel(ctx.guild.id)
+            self._leave_channel(ctx.guild.id)
             await ctx.guild.voice_client.disconnect()
 
         @self.command()
         async def lyrics(ctx: discord.ext.commands.context.Context) -> None:
             """This command displays the lyrics of the current song
-                The function uses the genius API to get the lyrics of the song by searching for the title of the song
+                The lyrics are searched on Genius by the title of the song, or taken from the lyrics cache
                 The function sends the lyrics in multiple messages with each of maximum lentgh of 1500 characters
             Args:
                 ctx (discord.ext.commands.Context): The context of the message
@@ -90,39 +229,14 @@ class FunkyBot(commands.Bot):
             title = self._registry.get_current_song_title(voice_instance, ctx.guild.id)
 
             if title != "":
-                genius = Genius(self.__genius_token)
-                song = genius.search_song(title)
-                if not song:
-                    await ctx.send("I can't find lyrics :(")
+                video_id = self._registry.servers[ctx.guild.id].channel.current.video_id
+                pages = await self._lyrics.get_pages(title, video_id)
+                if not pages:
+                    self._messages.send(ctx.channel, "I can't find lyrics :(")
                     return
 
-                if not song.lyrics:
-                    await ctx.send("I can't find lyrics :(")
-                    return
-
-                lyrics = song.lyrics.split("\n")
-                paragraph = []
-                paragraph_length = 0
-                for line in lyrics:
-                    # sending the lyrics in multiple messages with each of maximum lentgh of 1500 characters
-                    if line == "":  # in order to send empty lines
-                        line = "** **"
-
-                    if paragraph_length + len(line) < MAX_MESSAGE_LENGTH:
-                        paragraph.append(line)
-                        paragraph_length += len(line)
-                    else:
-                        message = "\n".join(paragraph)
-                        await ctx.send(message)
-                        paragraph = []
-                        paragraph_length = 0
-
-                        paragraph.append(line)
-                        paragraph_length += len(line)
-
-                    if line == lyrics[-1]:  # checks if it is the last line in lyrics
-                        message = "\n".join(paragraph)
-                        await ctx.send(message)
+                for page in pages:
+                    self._messages.send(ctx.channel, page, PLAIN)
 
         @self.command()
         async def pause(ctx: discord.ext.commands.context.Context) -> None:
@@ -137,6 +251,8 @@ class FunkyBot(commands.Bot):
             voice_client = ctx.message.guild.voice_client
             if voice_client.is_playing():
                 voice_client.pause()
+                self._idle.touch(ctx.guild.id)  # a paused guild becomes inactive
+                self._prewarmer.pause(ctx.guild.id)  # the next song isn't needed before the resume
                 await ctx.send("paused")
 
         @self.command()
@@ -157,6 +273,9 @@ class FunkyBot(commands.Bot):
                     + self._registry.get_current_song_title(voice_instance, ctx.guild.id)
                 )
                 voice_client.resume()
+                if voice_client.is_playing():
+                    self._idle.suspend(ctx.guild.id)
+                    self._prewarmer.resume(ctx.guild.id)
 
         @self.command()
         async def skip(ctx: discord.ext.commands.context.Context):
@@ -184,36 +303,29 @@ class FunkyBot(commands.Bot):
                 await ctx.reply("Connect to a voice channel before calling me.")
                 return
 
-            elif (
-                ctx.guild.id in self._registry.servers
-                and not self._registry.channel_exists(
-                    ctx.guild.id, ctx.author.voice.channel.id
-                )
-            ):  
-                # checks if the user is in the same server but in a different channel than the bot is in
-                # disconnect from current channel and go to the other channel the user is in and deafen the bot
-                voice_client = self._registry.servers[ctx.guild.id].guild.voice_client
-                self._registry.leave_channel(ctx.guild.id)
-                await voice_client.disconnect()
-                await ctx.author.voice.channel.connect()
-                await ctx.guild.change_voice_state(hannel=ctx.author.voice.channel, self_mute=False, self_deaf=True)  
-                self._registry.add_channel(ctx.guild, ctx.author.voice.channel, ctx.message.channel)
-
-            elif not self._registry.channel_exists(
-                ctx.guild.id, ctx.author.voice.channel.id
-            ):
-                await ctx.reply("Glad you called me up !! \U0001F642 \n** **")
-                # connect to the server the user in and deafen the bot
-                await ctx.author.voice.channel.connect()
-                await ctx.guild.change_voice_state(channel=ctx.author.voice.channel, self_mute=False, self_deaf=True)  
-                self._registry.add_channel(ctx.guild, ctx.author.voice.channel, ctx.message.channel)
+            if not self._registry.channel_exists(ctx.guild.id, ctx.author.voice.channel.id):
+                if ctx.guild.id not in self._registry.servers:
+                    await ctx.reply("Glad you called me up !! \U0001F642 \n** **")
+                await self._join_voice_channel(ctx.guild, ctx.author.voice.channel, ctx.message.channel)
 
             if title == "":
                 await ctx.send('Type the name of the song after "-play"')
                 return
 
-            self._registry.servers[ctx.guild.id].channel.add_to_queue(title)
-            await ctx.send(f'"{YoutubeAPI().get_first_title(title)}" added to queue')
+            playlist_id = get_playlist_id(title)
+            if playlist_id:
+                self._start_playlist_enqueue(ctx.guild.id, playlist_id, ctx.message.channel)
+                self._messages.send(ctx.channel, "Adding the songs of the playlist to the queue")
+                return
+
+            if self._registry.servers[ctx.guild.id].channel.is_full:
+                await ctx.send("The queue is full :(")
+                return
+
+            # the song is searched in the background so the command returns right away
+            self._enqueue_song(ctx.guild.id, Song(title))
+            # messages of quick successive enqueues are merged into one
+            self._messages.send(ctx.channel, f'"{title}" added to queue')
 
         @self.command()
         async def previous(ctx: discord.ext.commands.context.Context):
@@ -226,12 +338,103 @@ class FunkyBot(commands.Bot):
                 return
 
             if self._registry.play_previous(ctx.guild.id):
+                self._prewarmer.discard(ctx.guild.id)  # the prepared next song isn't played now
                 voice_client = ctx.message.guild.voice_client
                 if voice_client.is_playing():
                     voice_client.stop()  # stop if there is a current song playing
+                self._scheduler.notify(ctx.guild.id)
             else:
                 await ctx.send("There is no previous song :(")
 
+        @self.command()
+        @commands.is_owner()
+        async def stats(ctx: discord.ext.commands.context.Context):
+            '''This command shows the latency of each stage of playback and the state of the bot, only for the bot owner'''
+            report = "\n".join(METRICS.summary())
+            for page in split_message(report, MAX_MESSAGE_LENGTH):
+                await ctx.send(f"```\n{page}\n```")
+
+        @self.command(name="queue")
+        async def show_queue(ctx: discord.ext.commands.context.Context, page: int = 1):
+            '''This command shows a page of the songs waiting in the queue
+            Args:
+                ctx (discord.ext.commands.Context): The context of the message
+                page (int): The page of the queue to show, starting at 1
+            '''
+            voice_channel_is_valid = await self._valid_voice_channel(ctx)
+            if not voice_channel_is_valid:
+                return
+
+            channel = self._registry.servers[ctx.guild.id].channel
+            songs = channel.queue_page(page - 1) if page >= 1 else []
+            if not songs:
+                await ctx.send("There are no songs on this page of the queue")
+                return
+            first_position = (page - 1) * QUEUE_PAGE_SIZE + 1
+            lines = [
+                f"{position}. {song.title}"
+                for position, song in enumerate(songs, start=first_position)
+            ]
+            pages = (len(channel.queue) + QUEUE_PAGE_SIZE - 1) // QUEUE_PAGE_SIZE
+            await ctx.send("\n".join(lines) + f"\n** **\nPage {page}/{pages}")
+
+        @self.command()
+        async def remove(ctx: discord.ext.commands.context.Context, position: int):
+            '''This command removes a song from the queue
+            Args:
+                ctx (discord.ext.commands.Context): The context of the message
+                position (int): The position of the song in the queue, starting at 1
+            '''
+            voice_channel_is_valid = await self._valid_voice_channel(ctx)
+            if not voice_channel_is_valid:
+                return
+
+            channel = self._registry.servers[ctx.guild.id].channel
+            if not 1 <= position <= len(channel.queue):
+                await ctx.send("There is no song at this position")
+                return
+            song = channel.remove_from_queue(position - 1)
+            self._prewarmer.reschedule(ctx.guild.id)  # the next song may have changed
+            await ctx.send(f'Removed "{song.title}"')
+
+        @self.command()
+        async def move(
+            ctx: discord.ext.commands.context.Context, source: int, destination: int
+        ):
+            '''This command moves a song to another position in the queue
+            Args:
+                ctx (discord.ext.commands.Context): The context of the message
+                source (int): The current position of the song, starting at 1
+                destination (int): The new position of the song, starting at 1
+            '''
+            voice_channel_is_valid = await self._valid_voice_channel(ctx)
+            if not voice_channel_is_valid:
+                return
+
+            channel = self._registry.servers[ctx.guild.id].channel
+            length = len(channel.queue)
+            if not (1 <= source <= length and 1 <= destination <= length):
+                await ctx.send("There is no song at this position")
+                return
+            song = channel.move_in_queue(source - 1, destination - 1)
+            self._prewarmer.reschedule(ctx.guild.id)  # the next song may have changed
+            await ctx.send(f'Moved "{song.title}" to position {destination}')
+
+        @self.command()
+        async def shuffle(ctx: discord.ext.commands.context.Context):
+            '''This command shuffles the songs of the queue
+            Args:
+                ctx (discord.ext.commands.Context): The context of the message
+            '''
+            voice_channel_is_valid = await self._valid_voice_channel(ctx)
+            if not voice_channel_is_valid:
+                return
+
+            self._registry.servers[ctx.guild.id].channel.shuffle_queue()
+            self._prewarmer.reschedule(ctx.guild.id)  # the next song has changed
+            self._resolver.prefetch(self._registry.servers[ctx.guild.id].channel)
+            await ctx.send("Shuffled the queue")
+
         @self.command()
         async def help(ctx: discord.ext.commands.context.Context):
             """This command sends in chat the commands of the bot
@@ -243,7 +446,12 @@ class FunkyBot(commands.Bot):
             )
             embed.add_field(
                 name="**-play**",
-                value="Play the song title written after it",
+                value="Play the song title or YouTube playlist link written after it",
+                inline=False,
+            )
+            embed.add_field(
+                name="**/play**",
+                value="Like -play, with suggestions of the songs played before",
                 inline=False,
             )
             embed.add_field(
@@ -264,6 +472,26 @@ class FunkyBot(commands.Bot):
                 value="Display the lyrics of the currently song",
                 inline=False,
             )
+            embed.add_field(
+                name="**-queue**",
+                value="Show the songs in the queue, add a page number to see more",
+                inline=False,
+            )
+            embed.add_field(
+                name="**-remove**",
+                value="Remove the song at the given position from the queue",
+                inline=False,
+            )
+            embed.add_field(
+                name="**-move**",
+                value="Move a song of the queue to another position",
+                inline=False,
+            )
+            embed.add_field(
+                name="**-shuffle**",
+                value="Shuffle the songs in the queue",
+                inline=False,
+            )
             embed.add_field(
                 name="**-leave**",
                 value="Make Funkey Monkey leave your voice channel",
@@ -272,61 +500,440 @@ class FunkyBot(commands.Bot):
             embed.set_footer(text="Created by Ahmed Mahmoud")
             await ctx.send(embed=embed)
 
-    @tasks.loop(seconds=1)
-    async def play_loop(self) -> None:
-        '''This function play songs from the queue
-        The function is called every second to check for every voice channel the bot is in 
-        and checks if the bot is idle and there is a song in the queue and then play it
+    def add_app_commands(self):
+        @self.tree.command(name="play", description="Play a song, pick one of the suggestions to skip the search")
+        @app_commands.describe(title="The title of the song or a YouTube playlist link")
+        async def play_slash(interaction: discord.Interaction, title: str) -> None:
+            '''This slash command adds a song to the queue
+            The choices of the autocomplete carry the video id of an indexed title, such a
+            song is queued as it is without searching YouTube.
+            Args:
+                interaction (discord.Interaction): The interaction of the command
+                title (str): The typed title, or the value of the picked choice
+            '''
+            if interaction.guild is None:
+                await interaction.response.send_message("I can only play music in a server.")
+                return
+            voice = getattr(interaction.user, "voice", None)
+            if not voice or voice.channel is None:
+                await interaction.response.send_message("Connect to a voice channel before calling me.")
+                return
+            guild = interaction.guild
+            # joining a voice channel can take longer than the 3 seconds Discord waits for an answer
+            await interaction.response.defer()
+            if not self._registry.channel_exists(guild.id, voice.channel.id):
+                try:
+                    await self._join_voice_channel(guild, voice.channel, interaction.channel)
+                except (discord.DiscordException, asyncio.TimeoutError) as e:
+                    print(e)
+                    if guild.id not in self._registry.servers and guild.voice_client is not None:
+                        await guild.voice_client.disconnect(force=True)  # connected but not registered
+                    await interaction.followup.send("I couldn't join your voice channel :(")
+                    return
+
+            playlist_id = get_playlist_id(title)
+            if playlist_id:
+                self._start_playlist_enqueue(guild.id, playlist_id, interaction.channel)
+                await interaction.followup.send("Adding the songs of the playlist to the queue")
+                return
+
+            if self._registry.servers[guild.id].channel.is_full:
+                await interaction.followup.send("The queue is full :(")
+                return
+
+            video_id = title[len(KNOWN_VIDEO_PREFIX):] if title.startswith(KNOWN_VIDEO_PREFIX) else None
+            entry = self._titles.get(video_id) if video_id else None
+            if entry is not None:
+                song = Song(entry.title, entry.video_id, entry.title, entry.duration)
+            elif video_id and VIDEO_ID_PATTERN.fullmatch(video_id):
+                # the title was evicted from the index since it was suggested, the video is still known
+                song = Song(BASE_VIDEO_URL + video_id, video_id)
+            else:
+                song = Song(title)
+            self._enqueue_song(guild.id, song)
+            await interaction.followup.send(f'"{song.title}" added to queue')
+
+        @play_slash.autocomplete("title")
+        async def play_autocomplete(
+            interaction: discord.Interaction, current: str
+        ) -> List[app_commands.Choice[str]]:
+            '''Suggests the indexed titles matching what the user typed, no request is made'''
+            with METRICS.stage("autocomplete"):
+                return [
+                    app_commands.Choice(
+                        name=entry.title[:MAX_CHOICE_LENGTH],
+                        value=KNOWN_VIDEO_PREFIX + entry.video_id,
+                    )
+                    for entry in self._titles.suggest(interaction.guild_id, current)
+                ]
+
+    async def _play_next(self, guild_id: int) -> None:
+        '''Plays the next song from the queue of a guild if the bot is idle there
+        The function is called by the playback scheduler whenever a song is enqueued,
+        skipped or finished, so a new song starts right after the previous one ends
         '''
-        for guild_id in self._registry.servers:
+        server = self._registry.servers.get(guild_id)
+        if server is None:
+            return
+        voice_instance = server.guild.voice_client
+        if voice_instance is None:
+            # disconnected without leaving the registry, the guild expires like an idle one
+            self._idle.touch(guild_id)
+            return
+        idle = not (voice_instance.is_playing() or voice_instance.is_paused())
+        if not idle:
+            return
+        self._idle.touch(guild_id)  # the inactivity countdown runs until a song starts
+
+        next_song = self._registry.get_next_song(guild_id)
+        if next_song:
+            started = time.perf_counter()
+            text_channel = server.channel.text
             try:
-                server = self._registry.servers[guild_id]
-                voice_instance = server.guild.voice_client
-                idle = not (voice_instance.is_playing() or voice_instance.is_paused())
-                if idle:
-                    next_song = self._registry.get_next_song(guild_id)
-                    if next_song:
-                        song_url = next_song.urls[0]
-                        text_channel = server.channel.text
-                        await text_channel.send("Playing: \n" + song_url)
-                        with YoutubeDL(self._ydl_options) as ydl:
-                            info = ydl.extract_info(song_url, download=False)
-                        url = info["formats"][0]["url"]
-                        voice_instance.play(
-                            discord.FFmpegPCMAudio(url, **self._ffmpeg_options)
-                        )
-
-                if voice_instance.is_playing():
-                    server.channel.last_active = time.time()  # resets the last active time
-            except Exception as e:
-                print(e)
+                with METRICS.stage("resolve"):
+                    await self._song_resolver.resolve(next_song, PRIORITY_PLAYING)
+            except NoSearchResultsError:
+                self._messages.send(text_channel, f'I can\'t find "{next_song.query}" :(')
+                self._scheduler.notify(guild_id)  # go on with the next song
+                return
+            song_url = next_song.url
+            if next_song.video_id:
+                self._titles.add(guild_id, next_song.video_id, next_song.title, next_song.duration)
+            self._messages.send(text_channel, "Playing: \n" + song_url, NOW_PLAYING)
+            with METRICS.stage("source"):
+                source = await self._prewarmer.take(guild_id, next_song)
+                if source is None:
+                    source = await self._create_source(next_song)
+            voice_instance.play(
+                source,
+                after=lambda error: self._scheduler.notify_threadsafe(guild_id),
+            )
+            # from the end of the previous song to the start of this one
+            METRICS.observe("track_start", time.perf_counter() - started)
+            if next_song.stream_url:
+                # only sources that start playing count, not the prewarmed ones thrown away
+                self._audio_cache.record_play(next_song.video_id, next_song.stream_url, next_song.stream_codec)
+            self._idle.suspend(guild_id)  # a playing guild is never inactive
+            self._resolver.prefetch(server.channel)
+            self._lyrics.prefetch(next_song.title, next_song.video_id)  # ready for -lyrics
+            if next_song.duration:
+                # get the next song ready a few seconds before this one ends
+                self._prewarmer.schedule(
+                    guild_id,
+                    next_song.duration - PREWARM_LEAD,
+                    lambda: self._registry.peek_next_song(guild_id)
+                    if guild_id in self._registry.servers else None,
+                )
+
+    async def _join_voice_channel(
+        self,
+        guild: discord.Guild,
+        voice_channel: discord.VoiceChannel,
+        text_channel: discord.abc.Messageable,
+    ) -> None:
+        '''Connects to a voice channel, leaving the other voice channel of the guild the bot is in
+        Args:
+            guild: The guild of the voice channel
+            voice_channel: The voice channel of the user
+            text_channel: The text channel the bot answers in
+        '''
+        if guild.id in self._registry.servers:
+            # the user is in the same server but in a different channel than the bot is in
+            voice_client = self._registry.servers[guild.id].guild.voice_client
+            self._leave_channel(guild.id)
+            if voice_client is not None:
+                await voice_client.disconnect()
+        # connect to the channel the user is in and deafen the bot
+        with METRICS.stage("voice_connect"):
+            await voice_channel.connect()
+            await guild.change_voice_state(channel=voice_channel, self_mute=False, self_deaf=True)
+        self._registry.add_channel(guild, voice_channel, text_channel)
+        self._idle.touch(guild.id)
+
+    def _enqueue_song(self, guild_id: int, song: Song) -> None:
+        '''Adds a song to the queue of a guild, it is searched in the background if it isn't resolved'''
+        with METRICS.stage("enqueue"):
+            self._registry.add_song(guild_id, song)
+            self._song_resolver.schedule(song)
+            self._resolver.prefetch(self._registry.servers[guild_id].channel)
+            self._scheduler.notify(guild_id)
+
+    def _register_gauges(self) -> None:
+        '''Exposes the state of the bot as gauges, they are read when the metrics are exported'''
+        def queues():
+            return [len(server.channel.queue) for server in self._registry.servers.values() if server.channel]
+
+        gauges = [
+            ("funky_voice_sessions", "Voice channels the bot is in.", lambda: len(self._registry.servers)),
+            ("funky_queued_songs", "Songs waiting in all the queues.", lambda: sum(queues())),
+            ("funky_max_queue_depth", "Songs waiting in the longest queue.", lambda: max(queues(), default=0)),
+            ("funky_unresolved_songs", "Songs waiting to be searched in the background.",
+             lambda: self._song_resolver.pending_count),
+            ("funky_youtube_requests_waiting", "YouTube requests waiting in the scheduler.",
+             lambda: YoutubeAPI.scheduler.waiting_count),
+            ("funky_youtube_requests_running", "YouTube requests running.", lambda: YoutubeAPI.scheduler.active_count),
+            ("funky_youtube_request_rate", "Current YouTube request rate limit per second.",
+             lambda: YoutubeAPI.scheduler.rate),
+            ("funky_search_cache_hit_ratio", "Share of searches answered by the cache.",
+             lambda: YoutubeAPI.search_cache.hit_rate),
+            ("funky_title_cache_hit_ratio", "Share of title lookups answered by the cache.",
+             lambda: YoutubeAPI.title_cache.hit_rate),
+            ("funky_lyrics_cache_hit_ratio", "Share of lyrics requests answered from memory.",
+             lambda: self._lyrics.hit_rate),
+            ("funky_audio_cache_bytes", "Size of the audio cache directory.", lambda: self._audio_cache.total_bytes),
+            ("funky_shared_decodes", "Tracks being decoded for one or more guilds.",
+             lambda: self._audio_broker.stream_count),
+            ("funky_outgoing_messages", "Messages waiting to be sent to Discord.", lambda: self._messages.pending_count),
+            ("funky_indexed_titles", "Titles suggested by the /play autocomplete.", lambda: len(self._titles)),
+        ]
+        for name, help_text, read in gauges:
+            METRICS.gauge(name, help_text, read)
+
+    async def _create_source(self, song: Song) -> discord.AudioSource:
+        '''Creates the audio source of a song
+        The song is played from the audio cache if it is stored there, otherwise from its stream URL.
+        Guilds starting the same song at about the same time share one decode.
+        '''
+        cached_path = self._audio_cache.get(song.video_id)
+        if cached_path:
+            location, ffmpeg_options, codec = cached_path, self._ffmpeg_file_options, "opus"
+        else:
+            url = await self._resolver.resolve(song)
+            location, ffmpeg_options = url, self._ffmpeg_options
+            codec = song.stream_codec = await probe_codec(url, self._audio_mode, song.stream_codec)
+
+        def start_ffmpeg(offset: float) -> discord.AudioSource:
+            with METRICS.stage("ffmpeg_start"):
+                return make_audio_source(location, self._audio_mode, ffmpeg_options, codec, offset)
+
+        return self._audio_broker.subscribe(song.video_id, start_ffmpeg)
+
+    async def _create_prebuffered_source(self, song: Song) -> discord.AudioSource:
+        '''Creates the audio source of a song and starts buffering its beginning'''
+        return PrebufferedSource(await self._create_source(song))
+
+    async def _report_playback_error(self, guild_id: int, error: Exception) -> None:
+        '''Tells a guild that its song couldn't be played'''
+        print(error)
+        if guild_id in self._registry.servers:
+            self._messages.send(self._registry.servers[guild_id].channel.text, "Unexpected error happened")
+
+    def _start_playlist_enqueue(
+        self, guild_id: int, playlist_id: str, text_channel: discord.TextChannel
+    ) -> None:
+        '''Starts adding the songs of a playlist to the queue of a guild in the background'''
+        previous_task = self._playlist_tasks.get(guild_id)
+        if previous_task is not None:
+            previous_task.cancel()
+        task = asyncio.create_task(
+            self._enqueue_playlist(guild_id, playlist_id, text_channel)
+        )
+        self._playlist_tasks[guild_id] = task
+        task.add_done_callback(
+            lambda _: self._playlist_tasks.pop(guild_id, None)
+            if self._playlist_tasks.get(guild_id) is task else None
+        )
+
+    async def _enqueue_playlist(
+        self, guild_id: int, playlist_id: str, text_channel: discord.TextChannel
+    ) -> None:
+        '''Adds the songs of a playlist to the queue of a guild as its pages are fetched
+        Playlist entries already have their video id and title so they aren't searched.
+        '''
+        count = 0
+        try:
+            async for result in YoutubeAPI().iter_playlist(playlist_id):
+                if guild_id not in self._registry.servers:
+                    return
+                if not result.is_playable():
+                    continue
+                if self._registry.servers[guild_id].channel.is_full:
+                    self._messages.send(text_channel, "The queue is full :(")
+                    break
+                song = self._registry.add_song(guild_id, Song.from_search_result(result))
+                self._titles.add(guild_id, song.video_id, song.title, song.duration, played=False)
+                count += 1
+                self._scheduler.notify(guild_id)  # starts playing with the first entry
+            if guild_id in self._registry.servers:
+                self._resolver.prefetch(self._registry.servers[guild_id].channel)
+        except Exception as e:
+            print(e)
+            self._messages.send(text_channel, "I couldn't read the whole playlist :(")
+        self._messages.send(text_channel, f"Added {count} songs from the playlist")
+
+    def _leave_channel(self, guild_id: int) -> None:
+        '''Removes a guild from the registry and stops its playback task'''
+        server = self._registry.servers.get(guild_id)
+        if server is not None and server.channel is not None:
+            self._messages.forget_now_playing(server.channel.text.id)
+        self._registry.leave_channel(guild_id)
+        self._scheduler.stop(guild_id)
+        self._idle.remove(guild_id)
+        self._prewarmer.discard(guild_id)
+        playlist_task = self._playlist_tasks.pop(guild_id, None)
+        if playlist_task is not None:
+            playlist_task.cancel()
+
+    async def _restore_snapshot(self) -> None:
+        '''Rejoins the voice channels saved in the snapshot and restores their queues'''
+        snapshot = load_snapshot(self._snapshot_path) if self._snapshot_path else None
+        if snapshot is None:
+            return
+        restores = asyncio.Semaphore(RESTORE_CONCURRENCY)
+
+        async def restore_guild(guild_snapshot: dict) -> None:
+            async with restores:
                 try:
-                    await self._registry.servers[guild_id].channel.text.send(
-                        "Unexpected error happened"
-                    )
+                    if not self._registry.owns(guild_snapshot["guild"]):
+                        return
+                    guild = self.get_guild(guild_snapshot["guild"])
+                    if guild is None:
+                        return
+                    voice_channel = guild.get_channel(guild_snapshot["voice"])
+                    text_channel = guild.get_channel(guild_snapshot["text"])
+                    if voice_channel is None or text_channel is None:
+                        return
+                    if guild.voice_client is None:
+                        await voice_channel.connect()
+                    await guild.change_voice_state(channel=voice_channel, self_mute=False, self_deaf=True)
+                    self._registry.add_channel(guild, voice_channel, text_channel)
+                    self._idle.touch(guild.id)
+                    channel = self._registry.servers[guild.id].channel
+                    restore_channel(channel, guild_snapshot)
+                    for song in channel.queue:
+                        self._song_resolver.schedule(song)  # only songs that weren't resolved yet
+                    self._resolver.prefetch(channel)
+                    self._scheduler.notify(guild.id)
                 except Exception as e:
                     print(e)
-                    return
 
-    @tasks.loop(seconds=20)
-    async def leave_inactive_chans(self) -> None:
-        '''This function checks for inactive voice channels and leave them'''
-        servers = self._registry.servers.copy()
-        # copy the servers to avoide change in the dict while itterating over it
-        for guild_id in servers:
-            if time.time() - servers[guild_id].channel.last_active > MAX_INACTIVE_TIME:
-                voice_client = servers[guild_id].guild.voice_client
-                text_channel = servers[guild_id].channel.text
-                self._registry.leave_channel(guild_id)
-                await voice_client.disconnect()
-                await text_channel.send("I left due to inactivity")
+        await asyncio.gather(*(restore_guild(guild) for guild in snapshot["guilds"]))
+        print(f"restored {len(self._registry.servers)} sessions")
 
+    @tasks.loop(seconds=SNAPSHOT_INTERVAL)
+    async def save_snapshots(self) -> None:
+        '''This function saves the registry and the title index periodically so a crash loses at most a few seconds'''
+        if self._snapshot_path:
+            snapshot = registry_to_snapshot(self._registry)
+            try:
+                await asyncio.to_thread(save_snapshot, snapshot, self._snapshot_path)
+            except OSError as e:
+                print(e)
+        if self._title_index_path and self._titles.changes != self._titles_saved:
+            changes = self._titles.changes
+            records = self._titles.to_records()  # copied on the event loop, written in a thread
+            try:
+                await asyncio.to_thread(save_title_index, records, self._title_index_path)
+                self._titles_saved = changes
+            except OSError as e:
+                print(e)
 
-def main():
+    def _save_titles(self) -> None:
+        '''Saves the title index if it changed since it was last saved'''
+        if not self._title_index_path or self._titles.changes == self._titles_saved:
+            return
+        try:
+            save_title_index(self._titles.to_records(), self._title_index_path)
+            self._titles_saved = self._titles.changes
+        except OSError as e:
+            print(e)
+
+    async def _leave_inactive(self, guild_id: int) -> None:
+        '''Leaves the voice channel of a guild that was inactive for MAX_INACTIVE_TIME'''
+        server = self._registry.servers.get(guild_id)
+        if server is None:
+            return
+        voice_client = server.guild.voice_client
+        if voice_client is not None and voice_client.is_playing():
+            return  # the song started without the deadline being suspended, it is touched when it ends
+        text_channel = server.channel.text
+        self._leave_channel(guild_id)
+        if voice_client is not None:
+            await voice_client.disconnect()
+        self._messages.send(text_channel, "I left due to inactivity")
+
+
+def load_secrets() -> dict:
     with open("secrets.json", "r") as secrets_file:
-        secrets = json.load(secrets_file)
-    funky_bot = FunkyBot(command_prefix="-", genius_token=secrets["genius_token"])
+        return json.load(secrets_file)
+
+
+def create_bot(secrets: dict, **options) -> FunkyBot:
+    """Creates a FunkyBot configured from secrets.json, options override the configuration"""
+    settings = dict(
+        command_prefix="-",
+        genius_token=secrets["genius_token"],
+        extraction_workers=secrets.get("extraction_workers"),
+        audio_mode=secrets.get("audio_mode", AUDIO_MODE_PASSTHROUGH),
+        audio_cache_dir=secrets.get("audio_cache_dir", AUDIO_CACHE_DIR),
+        audio_cache_bytes=secrets.get("audio_cache_bytes", AUDIO_CACHE_MAX_BYTES),
+        snapshot_path=secrets.get("snapshot_path", SNAPSHOT_PATH),
+        lyrics_cache_dir=secrets.get("lyrics_cache_dir", LYRICS_CACHE_DIR),
+        metrics_port=secrets.get("metrics_port", METRICS_PORT),
+        title_index_path=secrets.get("title_index_path", TITLE_INDEX_PATH),
+    )
+    settings.update(options)
+    return FunkyBot(**settings)
+
+
+def main():
+    secrets = load_secrets()
+    funky_bot = create_bot(secrets)
+    funky_bot.run(secrets["discord_token"])
+
+
+def run_shard(shard_id: int, shard_count: int) -> None:
+    """Runs one gateway shard, this is the entry point of every process started by main_sharded"""
+    secrets = load_secrets()
+    processes = secrets.get("shard_processes") or shard_count
+    snapshot_path = secrets.get("snapshot_path", SNAPSHOT_PATH)
+    metrics_port = secrets.get("metrics_port", METRICS_PORT)
+    title_index_path = secrets.get("title_index_path", TITLE_INDEX_PATH)
+    audio_cache_dir = secrets.get("audio_cache_dir", AUDIO_CACHE_DIR)
+    lyrics_cache_dir = secrets.get("lyrics_cache_dir", LYRICS_CACHE_DIR)
+    funky_bot = create_bot(
+        secrets,
+        shard_id=shard_id,
+        shard_count=shard_count,
+        # the cores of the host are split between the shards running on it
+        extraction_workers=secrets.get("extraction_workers")
+        or max(1, (os.cpu_count() or 1) // processes),
+        # every shard saves the sessions and the titles of its own guilds
+        snapshot_path=f"{snapshot_path}.shard{shard_id}" if snapshot_path else None,
+        title_index_path=f"{title_index_path}.shard{shard_id}" if title_index_path else None,
+        # and caches in its own directories, a cache doesn't see the files of the other shards
+        # so the disk budget of the host is split between its shards too
+        audio_cache_dir=os.path.join(audio_cache_dir, f"shard{shard_id}"),
+        audio_cache_bytes=secrets.get("audio_cache_bytes", AUDIO_CACHE_MAX_BYTES) // processes,
+        lyrics_cache_dir=os.path.join(lyrics_cache_dir, f"shard{shard_id}"),
+        # and serves its metrics on its own port
+        metrics_port=metrics_port + shard_id if metrics_port else None,
+    )
     funky_bot.run(secrets["discord_token"])
 
+
+def main_sharded(shard_count: int, shards: str = "") -> None:
+    """Runs the bot as one process per gateway shard and restarts the shards that crash
+    Args:
+        shard_count (int): The total number of shards of the bot, across every host
+        shards (str): The shards run on this host, e.g. "0-3", every shard if empty
+    """
+    shard_ids = parse_shard_range(shards, shard_count)
+    ShardSupervisor(run_shard, shard_ids, shard_count).run()
+
+
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Funky Bot")
+    parser.add_argument(
+        "--shard-count", type=int, default=0,
+        help="run sharded with this many shards in total, one process per shard",
+    )
+    parser.add_argument(
+        "--shards", default="",
+        help='the shards run on this host, e.g. "0-3" (default: all of them)',
+    )
+    args = parser.parse_args()
+    if args.shard_count > 0:
+        main_sharded(args.shard_count, args.shards)
+    else:
+        main()
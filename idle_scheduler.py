@@ -0,0 +1,92 @@
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+
+class IdleScheduler:
+    """Calls a function for guilds that stayed inactive for a given time.
+    Deadlines are kept in a min-heap, so only the guilds that are due are woken up
+    and marking a guild as active is cheap no matter how many guilds are connected.
+    A guild that is touched again keeps its heap entry, it is pushed back with the
+    new deadline when the old one comes up.
+    """
+
+    def __init__(self, timeout: float, on_idle: Callable[[int], Awaitable[None]]):
+        """Initializes an IdleScheduler instance.
+        Args:
+            timeout (float): The number of seconds without activity before a guild is idle.
+            on_idle: A coroutine function called with the id of a guild that became idle.
+        """
+        self.timeout = timeout
+        self._on_idle = on_idle
+        self._heap: List[Tuple[float, int, int]] = []  # (deadline, token, guild id)
+        self._deadlines: Dict[int, Tuple[float, int]] = {}  # guild id -> (deadline, token of its heap entry)
+        self._tokens = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def touch(self, guild_id: int) -> None:
+        '''Marks a guild as active now, it becomes idle after the timeout unless touched again'''
+        deadline = time.monotonic() + self.timeout
+        entry = self._deadlines.get(guild_id)
+        if entry is not None:
+            self._deadlines[guild_id] = (deadline, entry[1])
+            return
+        token = next(self._tokens)
+        self._deadlines[guild_id] = (deadline, token)
+        heapq.heappush(self._heap, (deadline, token, guild_id))
+        if self._heap[0][2] == guild_id:
+            self._wakeup.set()  # the earliest deadline changed
+
+    def suspend(self, guild_id: int) -> None:
+        '''Stops the countdown of a guild, e.g. while it is playing, until it is touched again'''
+        self._deadlines.pop(guild_id, None)
+
+    def remove(self, guild_id: int) -> None:
+        '''Forgets a guild, e.g. after the bot left it'''
+        self._deadlines.pop(guild_id, None)
+
+    def start(self) -> None:
+        '''Starts the task waiting for the deadlines'''
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        '''Stops the task waiting for the deadlines'''
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        '''Sleeps until the earliest deadline and calls on_idle for the guilds that are due'''
+        while True:
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            delay = self._heap[0][0] - time.monotonic()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            deadline, token, guild_id = heapq.heappop(self._heap)
+            entry = self._deadlines.get(guild_id)
+            if entry is None or entry[1] != token:
+                continue  # suspended or removed since the entry was pushed
+            if entry[0] > deadline:
+                heapq.heappush(self._heap, (entry[0], token, guild_id))  # touched since
+                continue
+            del self._deadlines[guild_id]
+            try:
+                await self._on_idle(guild_id)
+            except Exception as e:
+                print(e)
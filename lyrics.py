@@ -0,0 +1,194 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from lyricsgenius import Genius
+from youtube_api import TTLCache, normalize_query
+from message_queue import split_message
+from metrics import METRICS
+from typing import List, Optional, Set
+
+LYRICS_CACHE_DIR = "lyrics_cache"
+LYRICS_TTL = 30 * 24 * 3600  # 30 days
+MISSING_LYRICS_TTL = 24 * 3600  # songs without lyrics are searched again after a day
+MEMORY_CACHE_SIZE = 1000
+MAX_DISK_ENTRIES = 20000  # lyrics files kept on disk, the oldest are removed first
+PRUNE_INTERVAL = 500  # lyrics written to disk between two prunings of the cache directory
+GENIUS_CONCURRENCY = 2  # Genius searches of -lyrics running at the same time
+MAX_PENDING_PREFETCHES = 100  # prefetches waiting for their turn, more are dropped
+EMPTY_LINE = "** **"  # Discord drops empty lines, this renders as one
+
+
+def paginate_lyrics(lyrics: str, max_length: int) -> List[str]:
+    """Splits lyrics into messages of at most max_length characters, keeping empty lines.
+    Args:
+        lyrics (str): The lyrics.
+        max_length (int): The maximum length of a message.
+    Returns:
+        List[str]: The messages in order.
+    """
+    lines = (line or EMPTY_LINE for line in lyrics.split("\n"))
+    return split_message("\n".join(lines), max_length)
+
+
+class LyricsService:
+    """Finds the lyrics of songs on Genius and caches them as ready to send messages.
+    The cache is kept in memory and on disk, keyed by video id (or by the normalized
+    title when there is no video), so repeated requests don't call Genius.
+    Prefetches of playing songs search one at a time with a bounded backlog, -lyrics
+    requests have slots of their own so they never wait behind them.
+    """
+
+    def __init__(
+        self,
+        genius_token: str,
+        max_message_length: int,
+        cache_dir: str = LYRICS_CACHE_DIR,
+        ttl: float = LYRICS_TTL,
+    ):
+        """Initializes a LyricsService instance.
+        Args:
+            genius_token (str): The token for the Genius API.
+            max_message_length (int): The maximum length of a lyrics message.
+            cache_dir (str): The directory the lyrics are cached in.
+            ttl (float): The number of seconds cached lyrics are used for.
+        """
+        self._genius = Genius(genius_token, verbose=False)
+        self.max_message_length = max_message_length
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        os.makedirs(cache_dir, exist_ok=True)
+        # the disk entries have their own expiry, the memory cache only bounds the size
+        self._memory = TTLCache(MEMORY_CACHE_SIZE, MISSING_LYRICS_TTL)
+        self._searches = asyncio.Semaphore(GENIUS_CONCURRENCY)
+        self._prefetches = asyncio.Semaphore(1)
+        self._background: Set[asyncio.Task] = set()
+        self._writes = 0
+
+    @property
+    def hit_rate(self) -> float:
+        '''The share of lyrics requests answered from memory'''
+        return self._memory.hit_rate
+
+    @staticmethod
+    def cache_key(title: str, video_id: Optional[str] = None) -> str:
+        '''Returns the cache key of a song'''
+        if video_id:
+            return "video:" + video_id
+        return "title:" + normalize_query(title)
+
+    def _path(self, key: str) -> str:
+        '''Returns the path of the cache file of a key'''
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode()).hexdigest() + ".json")
+
+    def _read_disk(self, key: str) -> Optional[List[str]]:
+        '''Returns the cached pages of a key from disk, None if missing or expired'''
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as cache_file:
+                entry = json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+        ttl = self.ttl if entry["pages"] else MISSING_LYRICS_TTL
+        if time.time() - entry["saved_at"] > ttl:
+            return None
+        return entry["pages"]
+
+    def _write_disk(self, key: str, pages: List[str]) -> None:
+        '''Stores the pages of a key on disk'''
+        path = self._path(key)
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as cache_file:
+            json.dump({"key": key, "saved_at": time.time(), "pages": pages}, cache_file)
+        os.replace(temporary_path, path)
+
+    def _prune_disk(self) -> None:
+        '''Removes the expired lyrics files, and the oldest ones above MAX_DISK_ENTRIES'''
+        entries = []
+        with os.scandir(self.cache_dir) as files:
+            for entry in files:
+                try:
+                    entries.append((entry.stat().st_mtime, entry.path))
+                except OSError:
+                    pass
+        entries.sort()
+        expired_before = time.time() - self.ttl
+        excess = len(entries) - MAX_DISK_ENTRIES
+        for index, (modified, path) in enumerate(entries):
+            if index >= excess and modified >= expired_before:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _search(self, title: str) -> List[str]:
+        '''Searches the lyrics of a title on Genius and paginates them (blocking)'''
+        song = self._genius.search_song(title)
+        if not song or not song.lyrics:
+            return []
+        return paginate_lyrics(song.lyrics, self.max_message_length)
+
+    async def _timed_search(self, title: str) -> List[str]:
+        with METRICS.stage("lyrics"):
+            return await asyncio.to_thread(self._search, title)
+
+    async def _load(self, key: str, title: str, searches: Optional[asyncio.Semaphore]) -> List[str]:
+        '''Returns the pages of a song from disk or from Genius
+        Args:
+            key: The cache key of the song
+            title: The title searched on Genius
+            searches: Limits the Genius searches, None when the caller already holds a slot
+        '''
+        pages = await asyncio.to_thread(self._read_disk, key)
+        if pages is not None:
+            return pages
+        if searches is None:
+            pages = await self._timed_search(title)
+        else:
+            async with searches:
+                pages = await self._timed_search(title)
+        try:
+            await asyncio.to_thread(self._write_disk, key, pages)
+            self._writes += 1
+            if self._writes % PRUNE_INTERVAL == 1:
+                await asyncio.to_thread(self._prune_disk)
+        except OSError as e:
+            print(e)
+        return pages
+
+    async def get_pages(self, title: str, video_id: Optional[str] = None) -> List[str]:
+        '''Returns the lyrics of a song as messages ready to send
+        Args:
+            title: The title of the song, it is searched on Genius
+            video_id: The id of the video of the song, used as the cache key when known
+        Returns:
+            List[str]: The messages, an empty list if there are no lyrics
+        '''
+        key = self.cache_key(title, video_id)
+        return await self._memory.get_or_fetch(key, lambda: self._load(key, title, self._searches))
+
+    def prefetch(self, title: str, video_id: Optional[str] = None) -> None:
+        '''Loads the lyrics of a song in the background, e.g. when it starts playing
+        The prefetch is dropped when too many are waiting already.
+        '''
+        if len(self._background) >= MAX_PENDING_PREFETCHES:
+            return
+        task = asyncio.create_task(self._prefetch(title, video_id))
+        self._background.add(task)  # keep a reference until it is done
+        task.add_done_callback(self._background.discard)
+
+    async def _prefetch(self, title: str, video_id: Optional[str]) -> None:
+        key = self.cache_key(title, video_id)
+        try:
+            # the slot is taken before the fetch is shared, so a -lyrics request joining
+            # it never waits for the prefetches queued before this one
+            async with self._prefetches:
+                await self._memory.get_or_fetch(key, lambda: self._load(key, title, None))
+        except Exception as e:
+            print(e)
+
+    def close(self) -> None:
+        '''Cancels the running prefetches'''
+        for task in list(self._background):
+            task.cancel()
@@ -0,0 +1,174 @@
+import asyncio
+from collections import deque
+import discord
+from request_scheduler import TokenBucket
+from metrics import METRICS
+from typing import Deque, Dict, List, Optional
+
+CHANNEL_MESSAGE_RATE = 1.0  # messages per second in a text channel, Discord allows 5 every 5 seconds
+CHANNEL_MESSAGE_BURST = 5
+GLOBAL_MESSAGE_RATE = 40.0  # messages per second for the whole bot, below Discord's global limit of 50
+GLOBAL_MESSAGE_BURST = 40
+DISCORD_MAX_MESSAGE_LENGTH = 2000
+
+STATUS = "status"  # short notices, adjacent ones are merged into one message
+NOW_PLAYING = "now_playing"  # the "Playing:" notice, edited in place when possible
+PLAIN = "plain"  # sent as is, e.g. the pages of the lyrics
+
+
+def split_message(text: str, max_length: int) -> List[str]:
+    """Splits a long text into messages of at most max_length characters, cutting between lines.
+    Args:
+        text (str): The text.
+        max_length (int): The maximum length of a message.
+    Returns:
+        List[str]: The messages in order.
+    """
+    pages = []
+    paragraph: List[str] = []
+    paragraph_length = 0
+    for line in text.split("\n"):
+        if len(line) > max_length:  # a line that doesn't fit in a message on its own
+            if paragraph:  # the lines before it come first
+                pages.append("\n".join(paragraph))
+                paragraph = []
+                paragraph_length = 0
+            while len(line) > max_length:
+                pages.append(line[:max_length])
+                line = line[max_length:]
+        # every line but the first of a message adds a newline
+        added_length = len(line) + (1 if paragraph else 0)
+        if paragraph and paragraph_length + added_length > max_length:
+            pages.append("\n".join(paragraph))
+            paragraph = []
+            paragraph_length = 0
+            added_length = len(line)
+        paragraph.append(line)
+        paragraph_length += added_length
+    if paragraph:
+        pages.append("\n".join(paragraph))
+    return pages
+
+
+class OutgoingMessage:
+    """A message waiting in the outbox of a text channel."""
+
+    __slots__ = ("kind", "content")
+
+    def __init__(self, kind: str, content: str):
+        self.kind = kind
+        self.content = content
+
+
+class ChannelOutbox:
+    """The messages waiting to be sent to one text channel."""
+
+    def __init__(self, channel: discord.abc.Messageable):
+        self.channel = channel
+        self.pending: Deque[OutgoingMessage] = deque()
+        self.bucket = TokenBucket(CHANNEL_MESSAGE_RATE, CHANNEL_MESSAGE_BURST)
+        self.now_playing: Optional[discord.Message] = None  # the last "Playing:" message sent
+        self.task: Optional[asyncio.Task] = None
+
+
+class MessageQueue:
+    """Sends the messages of the bot through one outbox per text channel.
+    Messages are sent in order within the rate limits of Discord instead of running
+    into 429 responses: adjacent status messages waiting in an outbox are merged
+    into one, and the "Playing:" message is edited instead of posting a new one as
+    long as nothing was written in the channel after it.
+    """
+
+    def __init__(self, max_length: int = DISCORD_MAX_MESSAGE_LENGTH):
+        """Initializes a MessageQueue instance.
+        Args:
+            max_length (int): The maximum length of a merged message.
+        """
+        self.max_length = max_length
+        self._outboxes: Dict[int, ChannelOutbox] = {}  # text channel id -> outbox
+        self._global_bucket = TokenBucket(GLOBAL_MESSAGE_RATE, GLOBAL_MESSAGE_BURST)
+
+    @property
+    def pending_count(self) -> int:
+        '''The number of messages waiting to be sent'''
+        return sum(len(outbox.pending) for outbox in self._outboxes.values())
+
+    def send(self, channel: discord.abc.Messageable, content: str, kind: str = STATUS) -> None:
+        '''Queues a message for a text channel
+        Args:
+            channel: The text channel
+            content: The text of the message
+            kind: STATUS, NOW_PLAYING or PLAIN
+        '''
+        outbox = self._outboxes.get(channel.id)
+        if outbox is None:
+            outbox = self._outboxes[channel.id] = ChannelOutbox(channel)
+
+        if not self._merge(outbox, kind, content):
+            outbox.pending.append(OutgoingMessage(kind, content))
+
+        if outbox.task is None or outbox.task.done():
+            outbox.task = asyncio.create_task(self._drain(outbox))
+
+    def _merge(self, outbox: ChannelOutbox, kind: str, content: str) -> bool:
+        '''Merges a message into the last pending message of an outbox, returns False if it can't'''
+        if not outbox.pending or outbox.pending[-1].kind != kind:
+            return False
+        last = outbox.pending[-1]
+        if kind == NOW_PLAYING:
+            last.content = content  # the previous song was never announced, only the latest matters
+            return True
+        if kind == STATUS and len(last.content) + 1 + len(content) <= self.max_length:
+            last.content += "\n" + content
+            return True
+        return False
+
+    def forget_now_playing(self, channel_id: int) -> None:
+        '''Forgets the "Playing:" message of a text channel, e.g. after the bot left its guild
+        The messages still waiting in the outbox are sent.
+        '''
+        outbox = self._outboxes.get(channel_id)
+        if outbox is None:
+            return
+        outbox.now_playing = None
+        if not outbox.pending:
+            del self._outboxes[channel_id]
+
+    async def _drain(self, outbox: ChannelOutbox) -> None:
+        '''Sends the messages of an outbox, waiting for the rate limits before each one'''
+        while outbox.pending:
+            # messages queued while waiting are merged into the pending ones
+            await outbox.bucket.acquire()
+            await self._global_bucket.acquire()
+            message = outbox.pending.popleft()
+            try:
+                await self._deliver(outbox, message)
+            except discord.HTTPException as e:
+                print(e)
+        if outbox.now_playing is None and self._outboxes.get(outbox.channel.id) is outbox:
+            del self._outboxes[outbox.channel.id]  # nothing to remember about this channel
+
+    async def _deliver(self, outbox: ChannelOutbox, message: OutgoingMessage) -> None:
+        '''Sends one message, or edits the "Playing:" message'''
+        channel = outbox.channel
+        if message.kind == NOW_PLAYING:
+            previous = outbox.now_playing
+            if previous is not None and getattr(channel, "last_message_id", None) == previous.id:
+                try:
+                    with METRICS.stage("discord_edit"):
+                        outbox.now_playing = await previous.edit(content=message.content)
+                    return
+                except discord.NotFound:  # deleted by someone
+                    pass
+            with METRICS.stage("discord_send"):
+                outbox.now_playing = await channel.send(message.content)
+            return
+        with METRICS.stage("discord_send"):
+            await channel.send(message.content)
+
+    def close(self) -> None:
+        '''Stops sending the queued messages'''
+        for outbox in self._outboxes.values():
+            if outbox.task is not None:
+                outbox.task.cancel()
+        self._outboxes.clear()
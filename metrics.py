@@ -0,0 +1,206 @@
+import asyncio
+import bisect
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from aiohttp import web
+from typing import Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)  # seconds
+RECENT_SAMPLES = 1000  # samples kept per stage for the percentiles of the stats command
+LOOP_LAG_INTERVAL = 0.5  # seconds between two event loop lag measurements
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9464
+
+
+class StageHistogram:
+    """The durations of one stage, as Prometheus buckets and as recent samples."""
+
+    def __init__(self, buckets: Tuple[float, ...] = STAGE_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.total = 0.0
+        self.count = 0
+        self.errors = 0
+        self.recent: Deque[float] = deque(maxlen=RECENT_SAMPLES)
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+        self.recent.append(seconds)
+
+    def percentile(self, point: float) -> Optional[float]:
+        '''Returns a percentile of the recent samples, None if there are none'''
+        if not self.recent:
+            return None
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(point / 100 * len(ordered)))]
+
+
+class Metrics:
+    """Timings of the stages of the play path and gauges of the state of the bot.
+    Stages are timed with the stage() context manager, which can be used from any
+    thread. Gauges are functions read when the metrics are exported, so keeping
+    them costs nothing on the hot path.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages: Dict[str, StageHistogram] = {}
+        self._gauges: Dict[str, Tuple[str, Callable[[], float]]] = {}  # name -> (help, read)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        '''Times the body as one run of a stage, failures are counted as errors of the stage'''
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:  # a cancelled stage isn't recorded
+            self.observe(name, time.perf_counter() - start, error=True)
+            raise
+        self.observe(name, time.perf_counter() - start)
+
+    def observe(self, name: str, seconds: float, error: bool = False) -> None:
+        '''Records one run of a stage that took seconds'''
+        with self._lock:
+            histogram = self._stages.get(name)
+            if histogram is None:
+                histogram = self._stages[name] = StageHistogram()
+            histogram.observe(seconds)
+            if error:
+                histogram.errors += 1
+
+    def gauge(self, name: str, help_text: str, read: Callable[[], float]) -> None:
+        '''Registers a gauge, read is called when the metrics are exported'''
+        self._gauges[name] = (help_text, read)
+
+    def _read_gauges(self) -> List[Tuple[str, str, Optional[float]]]:
+        values = []
+        for name, (help_text, read) in sorted(self._gauges.items()):
+            try:
+                value = float(read())
+            except Exception as e:  # a gauge must never break the export
+                print(e)
+                value = None
+            values.append((name, help_text, value))
+        return values
+
+    def render(self) -> str:
+        '''Returns the metrics in the Prometheus text exposition format'''
+        lines = [
+            "# HELP funky_stage_seconds Duration of the stages of the play path.",
+            "# TYPE funky_stage_seconds histogram",
+        ]
+        with self._lock:
+            stages = [
+                (name, list(histogram.counts), histogram.total, histogram.count, histogram.errors)
+                for name, histogram in sorted(self._stages.items())
+            ]
+        for name, counts, total, count, _ in stages:
+            cumulative = 0
+            for bound, bucket_count in zip(STAGE_BUCKETS + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'funky_stage_seconds_bucket{{stage="{name}",le="{le}"}} {cumulative}')
+            lines.append(f'funky_stage_seconds_sum{{stage="{name}"}} {total}')
+            lines.append(f'funky_stage_seconds_count{{stage="{name}"}} {count}')
+        lines.append("# HELP funky_stage_errors_total Runs of a stage that raised.")
+        lines.append("# TYPE funky_stage_errors_total counter")
+        for name, _, _, _, errors in stages:
+            lines.append(f'funky_stage_errors_total{{stage="{name}"}} {errors}')
+
+        for name, help_text, value in self._read_gauges():
+            if value is None:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> List[str]:
+        '''Returns the stages with their recent percentiles and the gauges, one line each'''
+        lines = [f"{'stage':<16}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"]
+        with self._lock:
+            for name, histogram in sorted(self._stages.items()):
+                percentiles = [histogram.percentile(point) for point in (50, 95, 99)]
+                lines.append(
+                    f"{name:<16}{histogram.count:>8}{histogram.errors:>8}"
+                    + "".join(f"{'-' if p is None else f'{p * 1000:.1f}':>10}" for p in percentiles)
+                )
+        lines.append("-" * 52)
+        for name, _, value in self._read_gauges():
+            lines.append(f"{name:<40}{'-' if value is None else f'{value:g}':>12}")
+        return lines
+
+
+# shared by every module, like the caches of YoutubeAPI
+METRICS = Metrics()
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up a task, a busy loop delays every guild."""
+
+    def __init__(self, metrics: Metrics = METRICS, interval: float = LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self.lag = 0.0  # seconds, the last measurement
+        self._task: Optional[asyncio.Task] = None
+        metrics.gauge("funky_event_loop_lag_seconds", "Delay of the event loop in the last measurement.", lambda: self.lag)
+        self._metrics = metrics
+
+    async def _run(self) -> None:
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lag = max(0.0, time.perf_counter() - start - self.interval)
+            self._metrics.observe("loop_lag", self.lag)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+class MetricsServer:
+    """Serves the metrics in the Prometheus text format on /metrics."""
+
+    def __init__(self, metrics: Metrics = METRICS, host: str = METRICS_HOST, port: int = METRICS_PORT):
+        """Initializes a MetricsServer instance.
+        Args:
+            metrics (Metrics): The metrics to serve.
+            host (str): The address to listen on, local only by default.
+            port (int): The port to listen on.
+        """
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self._runner: Optional[web.AppRunner] = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.metrics.render(), content_type="text/plain", charset="utf-8")
+
+    async def start(self) -> None:
+        '''Starts listening, a port already in use is reported instead of stopping the bot'''
+        if self._runner is not None:
+            return
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, self.host, self.port).start()
+        except OSError as e:
+            print(f"Metrics server not started: {e}")
+            await runner.cleanup()
+            return
+        self._runner = runner
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
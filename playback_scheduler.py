@@ -0,0 +1,99 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Optional
+
+MAX_CONSECUTIVE_ERRORS = 3  # failed songs in a row before a guild waits for the next event
+
+
+class GuildPlayback:
+    """The playback task of one guild and the event that wakes it up."""
+
+    def __init__(self, guild_id: int):
+        """Initializes a GuildPlayback instance.
+        Args:
+            guild_id (int): The id of the guild.
+        """
+        self.guild_id = guild_id
+        self.wake = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+
+class PlaybackScheduler:
+    """Starts the next song of a guild when something happens instead of polling.
+    Every guild gets its own task that sleeps until it is notified, which happens
+    when a song is enqueued, skipped or finishes playing. A failure in one guild
+    only affects that guild's task.
+    """
+
+    def __init__(
+        self,
+        play_next: Callable[[int], Awaitable[None]],
+        on_error: Callable[[int, Exception], Awaitable[None]],
+        is_active: Optional[Callable[[int], bool]] = None,
+    ):
+        """Initializes a PlaybackScheduler instance.
+        Args:
+            play_next: A coroutine function that starts the next song of a guild if it is idle.
+            on_error: A coroutine function called when play_next raises for a guild.
+            is_active: Returns False for a guild the bot left, its notifications are ignored.
+        """
+        self._play_next = play_next
+        self._on_error = on_error
+        self._is_active = is_active
+        self._guilds: Dict[int, GuildPlayback] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def notify(self, guild_id: int) -> None:
+        '''Wakes up the playback task of a guild, starting it if needed
+        Must be called from the event loop thread.
+        '''
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        playback = self._guilds.get(guild_id)
+        if playback is None:
+            if self._is_active is not None and not self._is_active(guild_id):
+                # e.g. the after callback of the song stopped by disconnecting from the guild
+                return
+            playback = GuildPlayback(guild_id)
+            playback.task = asyncio.create_task(self._run(playback))
+            self._guilds[guild_id] = playback
+        playback.wake.set()
+
+    def notify_threadsafe(self, guild_id: int) -> None:
+        '''Same as notify but safe to call from other threads, like the voice client's after callback'''
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self.notify, guild_id)
+
+    def stop(self, guild_id: int) -> None:
+        '''Cancels the playback task of a guild'''
+        playback = self._guilds.pop(guild_id, None)
+        if playback is not None and playback.task is not None:
+            playback.task.cancel()
+
+    def stop_all(self) -> None:
+        '''Cancels the playback tasks of every guild'''
+        for guild_id in list(self._guilds):
+            self.stop(guild_id)
+
+    async def _run(self, playback: GuildPlayback) -> None:
+        '''The playback task of a guild, it plays the next song every time it is woken up'''
+        consecutive_errors = 0
+        while True:
+            await playback.wake.wait()
+            playback.wake.clear()
+            try:
+                await self._play_next(playback.guild_id)
+                consecutive_errors = 0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                consecutive_errors += 1
+                if consecutive_errors < MAX_CONSECUTIVE_ERRORS:
+                    # move on to the next song of the queue instead of getting stuck
+                    playback.wake.set()
+                else:
+                    consecutive_errors = 0
+                await asyncio.sleep(0)  # let other guilds run
+                try:
+                    await self._on_error(playback.guild_id, e)
+                except Exception as e:
+                    print(e)
@@ -0,0 +1,199 @@
+import asyncio
+import threading
+from collections import deque
+import discord
+from typing import Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+PREBUFFER_FRAMES = 250  # 5 seconds of audio buffered before the track starts
+PREWARM_LEAD = 8.0  # seconds before the end of the current song the next one is prepared
+
+
+class PrebufferedSource(discord.AudioSource):
+    """Wraps an audio source and reads its first frames in a background thread.
+    By the time the voice client starts playing it, FFmpeg is already running and
+    the beginning of the track is in memory, so the first frame is served at once.
+    """
+
+    def __init__(self, source: discord.AudioSource, max_frames: int = PREBUFFER_FRAMES):
+        """Initializes a PrebufferedSource instance and starts filling its buffer.
+        Args:
+            source (discord.AudioSource): The source to buffer.
+            max_frames (int): The number of frames read ahead.
+        """
+        self._source = source
+        self._max_frames = max_frames
+        self._frames: Deque[bytes] = deque()
+        self._filled = False  # set once the filler thread is done
+        self._stopped = False
+        self._condition = threading.Condition()
+        self._filler = threading.Thread(target=self._fill, daemon=True)
+        self._filler.start()
+
+    def _fill(self) -> None:
+        '''Reads the first frames of the source into the buffer'''
+        try:
+            for _ in range(self._max_frames):
+                if self._stopped:
+                    break
+                frame = self._source.read()
+                with self._condition:
+                    self._frames.append(frame)
+                    self._condition.notify_all()
+                if not frame:
+                    break
+        except Exception as e:  # the source was cleaned up while reading
+            print(e)
+        finally:
+            with self._condition:
+                self._filled = True
+                self._condition.notify_all()
+
+    def read(self) -> bytes:
+        with self._condition:
+            while not self._frames and not self._filled:
+                self._condition.wait()
+            if self._frames:
+                return self._frames.popleft()
+        # the buffer is drained and the filler is done, read directly
+        return self._source.read()
+
+    def is_opus(self) -> bool:
+        return self._source.is_opus()
+
+    def cleanup(self) -> None:
+        self._stopped = True
+        self._source.cleanup()
+
+
+class PrewarmedSong:
+    """The source being prepared for the song a guild plays next."""
+
+    def __init__(self, song, task: asyncio.Task):
+        """Initializes a PrewarmedSong instance.
+        Args:
+            song (Song): The song the source plays.
+            task (asyncio.Task): The task creating the source.
+        """
+        self.song = song
+        self.task = task
+
+    def discard(self) -> None:
+        '''Stops preparing the source, or cleans it up if it is ready'''
+        if not self.task.done():
+            self.task.cancel()
+        elif not self.task.cancelled() and self.task.exception() is None:
+            self.task.result().cleanup()
+
+
+class Prewarmer:
+    """Prepares the next song of each guild shortly before the current one ends.
+    The countdown stops while the current song is paused, and it is restarted for
+    the new next song when the queue changes.
+    """
+
+    def __init__(self, prepare: Callable[[object], Awaitable[discord.AudioSource]]):
+        """Initializes a Prewarmer instance.
+        Args:
+            prepare: A coroutine function creating the audio source of a song.
+        """
+        self._prepare = prepare
+        self._timers: Dict[int, asyncio.TimerHandle] = {}
+        self._prewarmed: Dict[int, PrewarmedSong] = {}
+        self._deadlines: Dict[int, Tuple[float, Callable[[], object]]] = {}  # guild id -> (loop time, next_song)
+        self._paused: Dict[int, Tuple[float, Callable[[], object]]] = {}  # guild id -> (seconds left, next_song)
+
+    def schedule(self, guild_id: int, delay: float, next_song: Callable[[], object]) -> None:
+        '''Prepares the next song of a guild after a delay
+        Args:
+            guild_id: The id of the guild
+            delay: The number of seconds to wait before preparing
+            next_song: Returns the song that will play next, it is called when the delay is over
+        '''
+        self.discard(guild_id)
+        loop = asyncio.get_running_loop()
+        self._deadlines[guild_id] = (loop.time() + delay, next_song)
+        self._timers[guild_id] = loop.call_later(max(0.0, delay), self._start, guild_id, next_song)
+
+    def pause(self, guild_id: int) -> None:
+        '''Stops the countdown of a guild whose song is paused, a prepared source is cleaned up
+        so FFmpeg doesn't run for as long as the pause lasts
+        '''
+        deadline = self._deadlines.get(guild_id)
+        if deadline is None:
+            return
+        when, next_song = deadline
+        self.discard(guild_id)
+        self._paused[guild_id] = (when - asyncio.get_running_loop().time(), next_song)
+
+    def resume(self, guild_id: int) -> None:
+        '''Restarts the countdown of a guild whose song is resumed'''
+        paused = self._paused.pop(guild_id, None)
+        if paused is not None:
+            self.schedule(guild_id, *paused)
+
+    def reschedule(self, guild_id: int) -> None:
+        '''Prepares the new next song of a guild after its queue changed, at the time planned for the old one'''
+        if guild_id in self._paused:
+            return  # the next song is looked up when the countdown resumes
+        deadline = self._deadlines.get(guild_id)
+        if deadline is None:
+            self.discard(guild_id)
+            return
+        when, next_song = deadline
+        self.schedule(guild_id, when - asyncio.get_running_loop().time(), next_song)
+
+    def _start(self, guild_id: int, next_song: Callable[[], object]) -> None:
+        '''Starts preparing the next song of a guild'''
+        self._timers.pop(guild_id, None)
+        song = next_song()
+        if song is not None:
+            task = asyncio.create_task(self._prepare(song))
+            task.add_done_callback(_log_task_error)
+            self._prewarmed[guild_id] = PrewarmedSong(song, task)
+
+    async def take(self, guild_id: int, song) -> Optional[discord.AudioSource]:
+        '''Returns the prepared source of a song, waiting for it if it is still being prepared
+        Returns:
+            Optional[discord.AudioSource]: The source, None if this song wasn't prepared
+        '''
+        timer = self._timers.pop(guild_id, None)
+        if timer is not None:
+            timer.cancel()
+        self._deadlines.pop(guild_id, None)
+        self._paused.pop(guild_id, None)
+        prewarmed = self._prewarmed.pop(guild_id, None)
+        if prewarmed is None:
+            return None
+        if prewarmed.song is not song:
+            prewarmed.discard()
+            return None
+        try:
+            # shielded so that cancelling the caller doesn't leave the task half cancelled
+            return await asyncio.shield(prewarmed.task)
+        except asyncio.CancelledError:
+            prewarmed.task.add_done_callback(lambda _: prewarmed.discard())
+            raise
+        except Exception:
+            return None
+
+    def discard(self, guild_id: int) -> None:
+        '''Cancels the pending preparation of a guild and cleans up its prepared source'''
+        timer = self._timers.pop(guild_id, None)
+        if timer is not None:
+            timer.cancel()
+        self._deadlines.pop(guild_id, None)
+        self._paused.pop(guild_id, None)
+        prewarmed = self._prewarmed.pop(guild_id, None)
+        if prewarmed is not None:
+            prewarmed.discard()
+
+    def discard_all(self) -> None:
+        '''Discards the prepared sources of every guild'''
+        for guild_id in set(self._timers) | set(self._prewarmed) | set(self._paused):
+            self.discard(guild_id)
+
+
+def _log_task_error(task: asyncio.Task) -> None:
+    '''Prints the error of a failed preparation, the song is prepared again when it plays'''
+    if not task.cancelled() and task.exception() is not None:
+        print(task.exception())
@@ -1,26 +1,96 @@
-from youtube_api import YoutubeAPI
-import time
+from youtube_api import YoutubeAPI, SearchResult, BASE_VIDEO_URL
+from request_scheduler import PRIORITY_INTERACTIVE
+import random
 import discord
-from typing import List, Dict
+from collections import deque
+from itertools import islice
+from typing import Deque, List, Dict, Optional
+
+MAX_QUEUE_LENGTH = 1000  # songs waiting to be played in a channel
+MAX_HISTORY_LENGTH = 50  # played songs kept for the previous command
+QUEUE_PAGE_SIZE = 10
 
 
 class Song:
-    """Represents a song with its YouTube URLs and title."""
-    
-    def __init__(self, search_title: str):
+    """Represents a song with its YouTube video id and title.
+    A song added by title is searched on YouTube lazily, the first time it is resolved.
+    Songs only keep the chosen video, so a long queue stays small in memory.
+    """
+
+    __slots__ = (
+        "query", "video_id", "title", "duration",
+        "stream_url", "stream_codec", "stream_expiry",
+    )
+
+    def __init__(
+        self,
+        query: str = "",
+        video_id: Optional[str] = None,
+        title: Optional[str] = None,
+        duration: Optional[int] = None,
+    ):
         """
         Initializes a Song instance.
 
         Args:
-            search_title (str): The title of the song to search on YouTube.
+            query (str): The title the user searched for.
+            video_id (Optional[str]): The id of the YouTube video of the song, None until it is resolved.
+            title (Optional[str]): The title of the song, the query is shown until it is resolved.
+            duration (Optional[int]): The length of the song in seconds if known.
+        """
+        self.query = query
+        self.video_id = video_id
+        self.title = title or query
+        self.duration = duration
+        # direct audio URL filled in by the StreamResolver ahead of playback
+        self.stream_url: Optional[str] = None
+        self.stream_codec: Optional[str] = None
+        self.stream_expiry = 0.0
+
+    @classmethod
+    def from_search_result(cls, result: SearchResult) -> "Song":
+        """
+        Creates an already resolved Song from a video found on YouTube (e.g. a playlist entry).
+
+        Args:
+            result (SearchResult): The video.
         """
-        # get URLs of top matches based on the given title
-        self.urls = YoutubeAPI().get_top_search_results(search_title)  
-        self.title = YoutubeAPI().get_first_title(search_title)
+        return cls(result.title, result.video_id, result.title, result.duration)
+
+    @property
+    def resolved(self) -> bool:
+        """True once the video of the song is known."""
+        return self.video_id is not None
+
+    @property
+    def url(self) -> str:
+        """The YouTube URL of the song's video."""
+        return BASE_VIDEO_URL + self.video_id
+
+    async def resolve(self, priority: int = PRIORITY_INTERACTIVE) -> None:
+        """
+        Searches the query of the song on YouTube and fills in its video id, title and duration.
+
+        Args:
+            priority (int): The priority of the search in the YouTube request scheduler.
+
+        Raises:
+            NoSearchResultsError: If the search has no playable result,
+                livestreams and overly long videos are skipped.
+        """
+        if self.resolved:
+            return
+        first = await YoutubeAPI().get_first_playable(self.query, priority=priority)
+        self.video_id = first.video_id
+        self.title = first.title
+        self.duration = first.duration
 
 
 class Channel:
-    """Represents a voice and text channel in a Discord server."""
+    """Represents a voice and text channel in a Discord server.
+    Played songs move to a bounded history, so the memory used by a channel
+    doesn't grow with the number of songs it played.
+    """
 
     def __init__(
         self, 
@@ -36,21 +106,94 @@ class Channel:
         """
         self.voice = voice_channel
         self.text = text_channel
-        self.queue: List[Song] = []
+        self.queue: Deque[Song] = deque()  # the songs after the current one
+        self.history: Deque[Song] = deque(maxlen=MAX_HISTORY_LENGTH)  # played songs, most recent last
+        self.current: Optional[Song] = None
         self.previous = False
-        self.cur_song_idx = None
-        self.last_active = time.time()
 
-    def add_to_queue(self, title: str) -> None:
-        '''Adds a Song object to the queue'''
-        self.queue.append(Song(title))
+    @property
+    def is_full(self) -> bool:
+        '''True if no more songs can be added to the queue'''
+        return len(self.queue) >= MAX_QUEUE_LENGTH
+
+    def add_song(self, song: Song) -> Song:
+        '''Adds a Song object to the queue and returns it'''
+        self.queue.append(song)
+        return song
+
+    def upcoming_songs(self, count: int) -> List[Song]:
+        '''Returns up to count songs that will be played after the current one'''
+        return list(islice(self.queue, count))
+
+    def queue_page(self, page: int, page_size: int = QUEUE_PAGE_SIZE) -> List[Song]:
+        '''Returns the songs of a page of the queue
+        Args:
+            page: The index of the page, starting at 0
+            page_size: The number of songs in a page
+        '''
+        start = page * page_size
+        return list(islice(self.queue, start, start + page_size))
+
+    def remove_from_queue(self, index: int) -> Song:
+        '''Removes the song at index from the queue and returns it
+        Raises:
+            IndexError: If there is no song at index
+        '''
+        song = self.queue[index]
+        del self.queue[index]
+        return song
+
+    def move_in_queue(self, source: int, destination: int) -> Song:
+        '''Moves the song at index source to index destination and returns it
+        Raises:
+            IndexError: If there is no song at source or destination
+        '''
+        if not 0 <= destination < len(self.queue):
+            raise IndexError("destination out of range")
+        song = self.remove_from_queue(source)
+        self.queue.insert(destination, song)
+        return song
+
+    def shuffle_queue(self) -> None:
+        '''Shuffles the songs of the queue'''
+        songs = list(self.queue)  # indexing a deque isn't constant time, shuffle a list instead
+        random.shuffle(songs)
+        self.queue = deque(songs)
+
+    def next_song(self) -> Optional[Song]:
+        '''Moves to the next song and returns it
+        Returns:
+            Optional[Song]: if previous flag is true it returns the previous song,
+            other wise next song in queue or None if the queue is empty
+        '''
+        # if previous flag is true play the previous song
+        if self.previous:
+            self.previous = False
+            self.queue.appendleft(self.current)
+            self.current = self.history.pop()
+            return self.current
+
+        # if it is the last song in the queue so no next song
+        if not self.queue:
+            return None
+
+        if self.current is not None:
+            self.history.append(self.current)
+        self.current = self.queue.popleft()
+        return self.current
+
+    def peek_next_song(self) -> Optional[Song]:
+        '''Returns the song next_song would return, without moving to it'''
+        if self.previous:
+            return self.history[-1]
+        return self.queue[0] if self.queue else None
 
     def play_previous(self) -> bool:
         '''Plays the previous song in the queue
         The function is used to turn the flag of previous to true if it 
         can play the previous song, and return True otherwise return False.
         '''
-        if self.cur_song_idx is not None and self.cur_song_idx > 0:
+        if self.current is not None and self.history:
             self.previous = True
             return True
         else:
@@ -74,9 +217,24 @@ class Server:
 class Registry:
     """Manages the servers and their associated channels."""
 
-    def __init__(self):
-        """Initializes a Registry instance."""
+    def __init__(self, shard_id: Optional[int] = None, shard_count: Optional[int] = None):
+        """Initializes a Registry instance.
+
+        Args:
+            shard_id (Optional[int]): The shard of the process, None when the bot isn't sharded.
+            shard_count (Optional[int]): The total number of shards.
+        """
         self.servers: Dict[int, Server] = {}  # Mapping from a server id to a Server instance
+        self.shard_id = shard_id
+        self.shard_count = shard_count
+
+    def owns(self, server_id: int) -> bool:
+        '''Checks if a server belongs to the shard of this registry
+        Discord assigns a guild to shard (guild_id >> 22) % shard_count.
+        '''
+        if self.shard_id is None or not self.shard_count:
+            return True
+        return (server_id >> 22) % self.shard_count == self.shard_id
 
     def add_channel(
         self,
@@ -129,40 +287,36 @@ class Registry:
         '''
         chan = self.servers[server_id].channel
         idle = not (voice_client.is_playing() or voice_client.is_paused())
-        if idle:
+        if idle or chan.current is None:
             return ""
-        return self.servers[server_id].channel.queue[chan.cur_song_idx].title
+        return chan.current.title
 
-    def get_next_song(self, server_id: int) -> Song:
+    def get_next_song(self, server_id: int) -> Optional[Song]:
         '''Returns the next song to be played
-        The function is used to get the next song to be played, and update the current song index.
+        The function is used to get the next song to be played, and update the current song.
         Args:
             server_id: The id of the server
         Returns:
             Song: if previous flag is true it returns the previous song, other wise next song in queue
         '''
-        chan = self.servers[server_id].channel
-        
-        # if previous flag is true play the previous song
-        if chan.previous:
-            chan.previous = False
-            chan.cur_song_idx -= 1
-            return chan.queue[chan.cur_song_idx]
-
-        # if it is the first song to be added in the queue
-        if chan.cur_song_idx is None:
-            if len(chan.queue) > 0:
-                chan.cur_song_idx = 0
-                return chan.queue[0]
-            else:
-                return None
+        return self.servers[server_id].channel.next_song()
 
-        # if it is the last song in the queue so no next song
-        if chan.cur_song_idx >= len(chan.queue) - 1:
-            return None
+    def peek_next_song(self, server_id: int) -> Optional[Song]:
+        '''Returns the song get_next_song would return, without updating the current song
+        Args:
+            server_id: The id of the server
+        '''
+        return self.servers[server_id].channel.peek_next_song()
 
-        chan.cur_song_idx += 1
-        return chan.queue[chan.cur_song_idx]
+    def add_song(self, server_id: int, song: Song) -> Song:
+        '''Adds an already created song to the queue of the server
+        Args:
+            server_id: The id of the server
+            song: The song to add
+        Returns:
+            Song: The song that was added to the queue
+        '''
+        return self.servers[server_id].channel.add_song(song)
 
     def play_previous(self, server_id: int) -> bool:
         '''Plays the previous song in the queue
@@ -0,0 +1,295 @@
+import asyncio
+import contextlib
+import contextvars
+import heapq
+import itertools
+import time
+from metrics import METRICS
+from typing import AsyncIterator, Awaitable, Callable, Coroutine, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+# lower values are served first
+PRIORITY_PLAYING = 0  # the song that is about to play
+PRIORITY_INTERACTIVE = 1  # a user is waiting for the answer, e.g. the first page of a playlist
+PRIORITY_BACKGROUND = 2  # prefetching and resolving queued songs
+
+REQUEST_RATE = 10.0  # requests per second to YouTube when it isn't throttling
+REQUEST_BURST = 20
+MIN_REQUEST_RATE = 0.5  # the rate never drops below this while backing off
+RATE_RECOVERY = 0.5  # requests per second added back after every successful request
+MAX_CONCURRENT_REQUESTS = 16
+BASE_BACKOFF = 1.0  # seconds requests are paused after the first throttled response
+MAX_BACKOFF = 60.0
+MAX_RETRIES = 2  # a throttled request is retried this many times after the backoff
+
+
+class ThrottledError(Exception):
+    """Raised when an upstream service throttles or fails temporarily (429 or 5xx)."""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after  # seconds asked by the service, if it said so
+
+
+class TokenBucket:
+    """Allows `rate` operations per second on average with bursts of up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        """Initializes a TokenBucket instance, full.
+        Args:
+            rate (float): The number of tokens added per second.
+            capacity (float): The maximum number of tokens.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def set_rate(self, rate: float) -> None:
+        '''Changes the rate, the tokens gained at the old rate are kept'''
+        self._refill()
+        self.rate = rate
+
+    def delay(self) -> float:
+        '''Returns the number of seconds until a token is available'''
+        self._refill()
+        return max(0.0, (1 - self._tokens) / self.rate)
+
+    def take(self) -> None:
+        '''Takes a token, delay() must be 0'''
+        self._tokens -= 1
+
+    async def acquire(self) -> None:
+        '''Waits until a token is available and takes it'''
+        while True:
+            delay = self.delay()
+            if delay <= 0:
+                self.take()
+                return
+            await asyncio.sleep(delay)
+
+
+class SharedPriority:
+    """The priority of a task whose result several callers may wait for, e.g. a search
+    started by prefetching that the song about to play then needs. The requests the
+    task makes are scheduled at the priority of its most urgent caller, raise_to()
+    moves the request it is waiting for ahead when a more urgent caller joins.
+    """
+
+    def __init__(self, priority: int):
+        self.priority = priority
+        self._waiting: Optional[Tuple["RequestScheduler", asyncio.Future]] = None
+
+    def raise_to(self, priority: int) -> None:
+        '''Raises the priority of the task and of the request it is waiting for, if priority is more urgent'''
+        if priority >= self.priority:
+            return
+        self.priority = priority
+        if self._waiting is not None:
+            scheduler, future = self._waiting
+            scheduler._requeue(future, priority)
+
+
+# the SharedPriority of the running task, set by create_shared_task
+_shared_priority: "contextvars.ContextVar[Optional[SharedPriority]]" = contextvars.ContextVar(
+    "shared_priority", default=None
+)
+
+
+def create_shared_task(coroutine: Coroutine, priority: int) -> Tuple[asyncio.Task, SharedPriority]:
+    """Runs a coroutine in a task whose scheduled requests can be re-prioritized.
+    Args:
+        coroutine: The coroutine making the requests, e.g. a search or an extraction.
+        priority: The priority of its first caller.
+    Returns:
+        The task and the SharedPriority the callers joining it raise.
+    """
+    shared = SharedPriority(priority)
+
+    async def run():
+        _shared_priority.set(shared)  # the task runs in a copy of the context
+        return await coroutine
+
+    return asyncio.create_task(run()), shared
+
+
+class RequestScheduler:
+    """Schedules the requests made to an upstream service by priority.
+    Requests start within a token bucket rate and a concurrency cap, the ones for
+    the song that is about to play before background prefetching. When the service
+    throttles, requests are paused with an exponential backoff and the rate is
+    halved, then raised again step by step as requests succeed, so the bot slows
+    down smoothly instead of failing every guild at once.
+    """
+
+    def __init__(
+        self,
+        rate: float = REQUEST_RATE,
+        burst: float = REQUEST_BURST,
+        concurrency: int = MAX_CONCURRENT_REQUESTS,
+    ):
+        """Initializes a RequestScheduler instance.
+        Args:
+            rate (float): The maximum number of requests started per second.
+            burst (float): The number of requests that can start at once after a quiet period.
+            concurrency (int): The maximum number of requests running at the same time.
+        """
+        self.max_rate = rate
+        self.concurrency = concurrency
+        self._bucket = TokenBucket(rate, burst)
+        self._active = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []  # (priority, order, future)
+        self._order = itertools.count()
+        self._changed = asyncio.Event()
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._backoff = 0.0
+        self._paused_until = 0.0
+
+    @property
+    def rate(self) -> float:
+        '''The current number of requests started per second'''
+        return self._bucket.rate
+
+    @property
+    def waiting_count(self) -> int:
+        '''The number of requests waiting to start'''
+        # a re-prioritized request has an entry per priority
+        return len({id(future) for _, _, future in self._waiters if not future.done()})
+
+    @property
+    def active_count(self) -> int:
+        '''The number of requests running'''
+        return self._active
+
+    async def acquire(self, priority: int = PRIORITY_INTERACTIVE) -> None:
+        '''Waits until a request of the given priority may start, release() must be called after it
+        Inside a task made by create_shared_task, the request gets the priority of the most urgent
+        caller of the task.
+        '''
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        shared = _shared_priority.get()
+        if shared is not None:
+            priority = min(priority, shared.priority)
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._order), future))
+        self._changed.set()
+        if shared is not None:
+            shared._waiting = (self, future)
+        try:
+            with METRICS.stage("scheduler_wait"):
+                await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()  # started right before the cancellation
+            else:
+                future.cancel()  # skipped by the dispatcher
+            raise
+        finally:
+            if shared is not None:
+                shared._waiting = None
+
+    def _requeue(self, future: asyncio.Future, priority: int) -> None:
+        '''Moves a waiting request to a more urgent priority, its old entry is skipped once started'''
+        if not future.done():
+            heapq.heappush(self._waiters, (priority, next(self._order), future))
+            self._changed.set()
+
+    def release(self) -> None:
+        '''Marks a request started with acquire() as finished'''
+        self._active -= 1
+        self._changed.set()
+
+    def throttled(self, retry_after: Optional[float] = None) -> None:
+        '''Reports a throttled request, pauses the requests and halves the rate'''
+        now = time.monotonic()
+        if now < self._paused_until:
+            # requests started before the pause fail together, they count as one report
+            if retry_after:
+                self._paused_until = max(self._paused_until, now + retry_after)
+            return
+        self._backoff = min(max(self._backoff * 2, BASE_BACKOFF), MAX_BACKOFF)
+        self._paused_until = now + max(self._backoff, retry_after or 0.0)
+        self._bucket.set_rate(max(MIN_REQUEST_RATE, self._bucket.rate / 2))
+        self._changed.set()
+
+    def succeeded(self) -> None:
+        '''Reports a successful request, the rate grows back to its maximum'''
+        self._backoff = 0.0
+        if self._bucket.rate < self.max_rate:
+            self._bucket.set_rate(min(self.max_rate, self._bucket.rate + RATE_RECOVERY))
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_INTERACTIVE) -> AsyncIterator[None]:
+        '''Runs the body as a scheduled request, throttled errors raised in it are reported'''
+        await self.acquire(priority)
+        try:
+            yield
+        except ThrottledError as e:
+            self.throttled(e.retry_after)
+            raise
+        else:
+            self.succeeded()
+        finally:
+            self.release()
+
+    async def run(
+        self,
+        request: Callable[[], Awaitable[T]],
+        priority: int = PRIORITY_INTERACTIVE,
+        retries: int = MAX_RETRIES,
+    ) -> T:
+        '''Runs a request in a slot, retrying it after the backoff if it is throttled
+        Args:
+            request: A function returning the awaitable of the request
+            priority: PRIORITY_PLAYING, PRIORITY_INTERACTIVE or PRIORITY_BACKGROUND
+            retries: The number of retries of a throttled request
+        Returns:
+            The result of the request
+        Raises:
+            ThrottledError: If the request is still throttled after the retries
+        '''
+        for attempt in itertools.count():
+            try:
+                async with self.slot(priority):
+                    return await request()
+            except ThrottledError:
+                if attempt >= retries:
+                    raise
+
+    async def _dispatch(self) -> None:
+        '''Starts the waiting requests by priority when the limits allow it'''
+        while True:
+            self._changed.clear()
+            while self._waiters and self._waiters[0][2].done():
+                heapq.heappop(self._waiters)  # cancelled while waiting, or started from another entry
+            if not self._waiters or self._active >= self.concurrency:
+                await self._changed.wait()
+                continue
+
+            delay = max(self._paused_until - time.monotonic(), self._bucket.delay())
+            if delay > 0:
+                try:
+                    # woken up early by a backoff or a finished request
+                    await asyncio.wait_for(self._changed.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, _, future = heapq.heappop(self._waiters)
+            self._bucket.take()
+            self._active += 1
+            future.set_result(None)
+
+    def close(self) -> None:
+        '''Stops starting requests'''
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+        self._changed = asyncio.Event()  # a new dispatcher may run in another event loop
@@ -0,0 +1,123 @@
+import multiprocessing
+import signal
+import time
+from typing import Callable, Dict, List, Optional
+
+IDENTIFY_INTERVAL = 5.5  # seconds between shard starts, Discord allows one identify every 5 seconds
+RESTART_DELAY = 5  # seconds before a crashed shard is started again
+MAX_RESTART_DELAY = 300
+STABLE_UPTIME = 600  # a shard running this long is considered healthy again
+SHUTDOWN_TIMEOUT = 30  # seconds a shard gets to save its snapshot and exit
+
+
+def parse_shard_range(text: str, shard_count: int) -> List[int]:
+    """Parses the shards a host runs, e.g. "0-3" or "4".
+    Args:
+        text (str): The range, an empty string means every shard.
+        shard_count (int): The total number of shards of the bot.
+    Returns:
+        List[int]: The shard ids.
+    """
+    if not text:
+        return list(range(shard_count))
+    first, _, last = text.partition("-")
+    shard_ids = list(range(int(first), int(last or first) + 1))
+    if not shard_ids or shard_ids[0] < 0 or shard_ids[-1] >= shard_count:
+        raise ValueError(f"Shards {text} aren't between 0 and {shard_count - 1}")
+    return shard_ids
+
+
+class ShardProcess:
+    """One shard of the bot running in its own process."""
+
+    def __init__(self, shard_id: int):
+        """Initializes a ShardProcess instance.
+        Args:
+            shard_id (int): The id of the shard.
+        """
+        self.shard_id = shard_id
+        self.process: Optional[multiprocessing.Process] = None
+        self.started_at = 0.0
+        self.restart_delay = RESTART_DELAY
+        self.restart_at = 0.0  # when a crashed shard is started again, 0 if it isn't waiting
+
+
+class ShardSupervisor:
+    """Starts one process per shard and restarts the ones that exit unexpectedly.
+    SIGINT and SIGTERM are forwarded to the shards so each of them saves its snapshot.
+    """
+
+    def __init__(
+        self,
+        run_shard: Callable[[int, int], None],
+        shard_ids: List[int],
+        shard_count: int,
+    ):
+        """Initializes a ShardSupervisor instance.
+        Args:
+            run_shard: The function running a shard, called with (shard id, shard count) in the new process.
+            shard_ids (List[int]): The shards run by this host.
+            shard_count (int): The total number of shards of the bot.
+        """
+        self.run_shard = run_shard
+        self.shard_count = shard_count
+        self.shards: Dict[int, ShardProcess] = {
+            shard_id: ShardProcess(shard_id) for shard_id in shard_ids
+        }
+        self._stopping = False
+        # spawned processes don't inherit the supervisor's signal handlers
+        self._context = multiprocessing.get_context("spawn")
+
+    def _start(self, shard: ShardProcess) -> None:
+        '''Starts the process of a shard'''
+        shard.process = self._context.Process(
+            target=self.run_shard,
+            args=(shard.shard_id, self.shard_count),
+            name=f"funky-bot-shard-{shard.shard_id}",
+        )
+        shard.process.start()
+        shard.started_at = time.monotonic()
+        shard.restart_at = 0.0
+        print(f"started shard {shard.shard_id} (pid {shard.process.pid})")
+
+    def _stop(self, *_) -> None:
+        '''Asks every shard to shut down'''
+        self._stopping = True
+        for shard in self.shards.values():
+            if shard.process is not None and shard.process.is_alive():
+                shard.process.terminate()  # SIGTERM, the bot saves its snapshot and closes
+
+    def run(self) -> None:
+        '''Starts the shards and supervises them until SIGINT or SIGTERM'''
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGTERM, self._stop)
+
+        for shard in self.shards.values():
+            if self._stopping:
+                break
+            self._start(shard)
+            time.sleep(IDENTIFY_INTERVAL)
+
+        while not self._stopping:
+            now = time.monotonic()
+            for shard in self.shards.values():
+                if shard.process.is_alive() or self._stopping:
+                    continue
+                if shard.restart_at == 0.0:
+                    if now - shard.started_at > STABLE_UPTIME:
+                        shard.restart_delay = RESTART_DELAY
+                    print(f"shard {shard.shard_id} exited with code {shard.process.exitcode}, "
+                          f"restarting in {shard.restart_delay}s")
+                    shard.restart_at = now + shard.restart_delay
+                    shard.restart_delay = min(shard.restart_delay * 2, MAX_RESTART_DELAY)
+                elif now >= shard.restart_at:
+                    self._start(shard)
+            time.sleep(1)
+
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+        for shard in self.shards.values():
+            if shard.process is None:
+                continue
+            shard.process.join(max(0.0, deadline - time.monotonic()))
+            if shard.process.is_alive():
+                shard.process.kill()
@@ -0,0 +1,101 @@
+import gzip
+import json
+import os
+import time
+from registry import Channel, Registry, Song
+from typing import Any, List, Optional
+
+SNAPSHOT_PATH = "registry_snapshot.json.gz"
+SNAPSHOT_INTERVAL = 30  # seconds between periodic snapshots
+SNAPSHOT_VERSION = 1
+MAX_SNAPSHOT_AGE = 24 * 3600  # older snapshots are ignored at startup
+
+
+def song_to_record(song: Song) -> List[Any]:
+    """Converts a song to a compact JSON record, stream URLs are left out since they expire.
+    Args:
+        song (Song): The song.
+    Returns:
+        List[Any]: [query, video id, title, duration]
+    """
+    return [song.query, song.video_id, song.title, song.duration]
+
+
+def song_from_record(record: List[Any]) -> Song:
+    """Creates a song from a record made by song_to_record."""
+    query, video_id, title, duration = record
+    return Song(query, video_id, title, duration)
+
+
+def registry_to_snapshot(registry: Registry) -> dict:
+    """Returns the state of every guild of the registry as a JSON serializable dict.
+    Args:
+        registry (Registry): The registry to save.
+    Returns:
+        dict: The snapshot, with the channel ids, current song, queue and history of every guild.
+    """
+    guilds = []
+    for guild_id, server in registry.servers.items():
+        channel = server.channel
+        if channel is None:
+            continue
+        guilds.append(
+            {
+                "guild": guild_id,
+                "voice": channel.voice.id,
+                "text": channel.text.id,
+                "current": song_to_record(channel.current) if channel.current else None,
+                "queue": [song_to_record(song) for song in channel.queue],
+                "history": [song_to_record(song) for song in channel.history],
+            }
+        )
+    return {"version": SNAPSHOT_VERSION, "saved_at": time.time(), "guilds": guilds}
+
+
+def restore_channel(channel: Channel, guild_snapshot: dict) -> None:
+    """Restores the songs of a guild snapshot into a new channel.
+    The song that was playing is put back at the front of the queue so it plays again.
+    Args:
+        channel (Channel): The channel created for the guild.
+        guild_snapshot (dict): One entry of the "guilds" list of a snapshot.
+    """
+    for record in guild_snapshot["history"]:
+        channel.history.append(song_from_record(record))
+    if guild_snapshot["current"] is not None:
+        channel.add_song(song_from_record(guild_snapshot["current"]))
+    for record in guild_snapshot["queue"]:
+        channel.add_song(song_from_record(record))
+
+
+def save_snapshot(snapshot: dict, path: str = SNAPSHOT_PATH) -> None:
+    """Writes a snapshot as gzipped JSON, atomically so a crash never leaves a partial file.
+    Args:
+        snapshot (dict): The snapshot made by registry_to_snapshot.
+        path (str): The path of the snapshot file.
+    """
+    temporary_path = path + ".tmp"
+    with gzip.open(temporary_path, "wt", encoding="utf-8") as snapshot_file:
+        json.dump(snapshot, snapshot_file, separators=(",", ":"))
+    os.replace(temporary_path, path)
+
+
+def load_snapshot(path: str = SNAPSHOT_PATH) -> Optional[dict]:
+    """Reads a snapshot written by save_snapshot.
+    Args:
+        path (str): The path of the snapshot file.
+    Returns:
+        Optional[dict]: The snapshot, None if there is none or it is unreadable or too old.
+    """
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as snapshot_file:
+            snapshot = json.load(snapshot_file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable snapshot: {e}")
+        return None
+    if snapshot.get("version") != SNAPSHOT_VERSION:
+        return None
+    if time.time() - snapshot.get("saved_at", 0) > MAX_SNAPSHOT_AGE:
+        return None
+    return snapshot
@@ -0,0 +1,74 @@
+import asyncio
+from request_scheduler import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, SharedPriority, create_shared_task
+from typing import Dict, List, Tuple
+
+RESOLVE_CONCURRENCY = 4  # songs searched at the same time in the background
+
+
+class SongResolver:
+    """Searches enqueued songs on YouTube in the background, in the order they were added.
+    At most RESOLVE_CONCURRENCY songs are searched at the same time, a song that is
+    about to play can be resolved right away with resolve().
+    """
+
+    def __init__(self, concurrency: int = RESOLVE_CONCURRENCY):
+        """Initializes a SongResolver instance.
+        Args:
+            concurrency (int): The number of background searches running at the same time.
+        """
+        self.concurrency = concurrency
+        self._pending: "asyncio.Queue" = asyncio.Queue()
+        self._in_flight: Dict[int, Tuple[asyncio.Task, SharedPriority]] = {}  # id of the song -> its resolution
+        self._workers: List[asyncio.Task] = []
+
+    @property
+    def pending_count(self) -> int:
+        '''The number of songs waiting to be resolved in the background'''
+        return self._pending.qsize()
+
+    def schedule(self, song) -> None:
+        '''Resolves a song in the background after the songs scheduled before it'''
+        if song.resolved:
+            return
+        if not self._workers:
+            self._workers = [
+                asyncio.create_task(self._work()) for _ in range(self.concurrency)
+            ]
+        self._pending.put_nowait(song)
+
+    async def resolve(self, song, priority: int = PRIORITY_INTERACTIVE) -> None:
+        '''Resolves a song now, or waits for its running resolution
+        Args:
+            song (Song): The song to resolve
+            priority (int): The priority of the search, a running search is moved up to it
+        Raises:
+            NoSearchResultsError: If the search has no playable result.
+        '''
+        if song.resolved:
+            return
+        in_flight = self._in_flight.get(id(song))
+        if in_flight is None:
+            in_flight = create_shared_task(song.resolve(priority), priority)
+            self._in_flight[id(song)] = in_flight
+            in_flight[0].add_done_callback(lambda _: self._in_flight.pop(id(song), None))
+        task, shared = in_flight
+        shared.raise_to(priority)  # e.g. the song is about to play while a prefetch searches it
+        await asyncio.shield(task)
+
+    async def _work(self) -> None:
+        '''A background worker resolving the scheduled songs one at a time'''
+        while True:
+            song = await self._pending.get()
+            try:
+                await self.resolve(song, PRIORITY_BACKGROUND)
+            except Exception as e:
+                # the song is resolved again when it is about to play and reported then
+                print(e)
+            finally:
+                self._pending.task_done()
+
+    def close(self) -> None:
+        '''Stops the background workers'''
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
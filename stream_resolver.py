@@ -0,0 +1,103 @@
+import asyncio
+import time
+from urllib.parse import parse_qs, urlparse
+from extraction_pool import ExtractionPool
+from song_resolver import SongResolver
+from request_scheduler import PRIORITY_BACKGROUND, PRIORITY_PLAYING, SharedPriority, create_shared_task
+from typing import Dict, Set, Tuple
+
+PREFETCH_COUNT = 2  # number of upcoming songs resolved ahead of time
+STREAM_URL_TTL = 3600  # seconds a stream URL is trusted when it has no expire parameter
+EXPIRY_MARGIN = 300  # seconds before expiry a stream URL is considered stale
+
+
+def get_stream_expiry(stream_url: str) -> float:
+    """Returns the time at which a stream URL stops working.
+    Args:
+        stream_url (str): The direct media URL returned by youtube_dl.
+    Returns:
+        float: A unix timestamp taken from the "expire" parameter of the URL,
+        or STREAM_URL_TTL seconds from now if it has none.
+    """
+    expire = parse_qs(urlparse(stream_url).query).get("expire")
+    if expire and expire[0].isdigit():
+        return float(expire[0])
+    return time.time() + STREAM_URL_TTL
+
+
+class StreamResolver:
+    """Resolves the direct stream URLs of songs, ahead of time for queued ones.
+    The resolved URL and its expiry are stored on the Song so playback can start
+    without waiting on extraction.
+    """
+
+    def __init__(
+        self,
+        extractor: ExtractionPool,
+        song_resolver: SongResolver,
+        prefetch_count: int = PREFETCH_COUNT,
+    ):
+        """Initializes a StreamResolver instance.
+        Args:
+            extractor (ExtractionPool): The pool that runs youtube_dl extractions.
+            song_resolver (SongResolver): Searches the songs that aren't resolved yet.
+            prefetch_count (int): How many upcoming songs of a queue to resolve ahead.
+        """
+        self.extractor = extractor
+        self.song_resolver = song_resolver
+        self.prefetch_count = prefetch_count
+        self._in_flight: Dict[str, Tuple[asyncio.Task, SharedPriority]] = {}  # video url -> extraction task
+        self._background: Set[asyncio.Task] = set()
+
+    @staticmethod
+    def has_valid_stream(song) -> bool:
+        '''Returns True if the song has a stream URL that won't expire soon'''
+        return (
+            song.stream_url is not None
+            and song.stream_expiry - EXPIRY_MARGIN > time.time()
+        )
+
+    async def resolve(self, song, priority: int = PRIORITY_PLAYING) -> str:
+        '''Returns the stream URL of a song, extracting it if missing or expired
+        Args:
+            song (Song): The song to resolve
+            priority (int): The priority of the search and extraction, running ones are moved up to it
+        Returns:
+            str: The direct audio URL of the song
+        '''
+        if self.has_valid_stream(song):
+            return song.stream_url
+
+        await self.song_resolver.resolve(song, priority)
+        video_url = song.url
+        in_flight = self._in_flight.get(video_url)
+        if in_flight is None:
+            in_flight = create_shared_task(self.extractor.extract(video_url, priority), priority)
+            self._in_flight[video_url] = in_flight
+            in_flight[0].add_done_callback(lambda _: self._in_flight.pop(video_url, None))
+        task, shared = in_flight
+        shared.raise_to(priority)
+
+        stream_url, codec = await asyncio.shield(task)
+        song.stream_url = stream_url
+        song.stream_codec = codec
+        song.stream_expiry = get_stream_expiry(stream_url)
+        return stream_url
+
+    def prefetch(self, channel) -> None:
+        '''Resolves the next songs of a channel queue in the background
+        Args:
+            channel (Channel): The channel whose queue is prefetched
+        '''
+        for song in channel.upcoming_songs(self.prefetch_count):
+            if not self.has_valid_stream(song):
+                task = asyncio.create_task(self._prefetch_song(song))
+                self._background.add(task)  # keep a reference until it is done
+                task.add_done_callback(self._background.discard)
+
+    async def _prefetch_song(self, song) -> None:
+        '''Resolves a song and logs instead of raising on failure'''
+        try:
+            await self.resolve(song, PRIORITY_BACKGROUND)
+        except Exception as e:
+            print(e)
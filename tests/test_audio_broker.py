@@ -0,0 +1,80 @@
+import threading
+import time
+
+from audio_broker import SharedAudioBroker, SharedStream
+
+
+class FakeSource:
+    def __init__(self, frames=5, delay=0.0):
+        self.frames = [f"frame{i}".encode() for i in range(frames)]
+        self.delay = delay
+        self.reads = 0
+        self.cleaned_up = False
+
+    def read(self):
+        time.sleep(self.delay)
+        if self.reads >= len(self.frames):
+            return b""
+        self.reads += 1
+        return self.frames[self.reads - 1]
+
+    def is_opus(self):
+        return False
+
+    def cleanup(self):
+        self.cleaned_up = True
+
+
+def read_all(subscriber):
+    frames = []
+    while frame := subscriber.read():
+        frames.append(frame)
+    return frames
+
+
+def test_subscribers_share_one_decode():
+    source = FakeSource()
+    closed = []
+    stream = SharedStream("video", lambda offset: source, closed.append)
+    first = stream.subscribe()
+    second = stream.subscribe()
+
+    assert read_all(first) == source.frames
+    assert read_all(second) == source.frames
+    assert source.reads == len(source.frames)
+
+    first.cleanup()
+    assert not source.cleaned_up
+    second.cleanup()
+    assert source.cleaned_up
+    assert closed == [stream]
+
+
+def test_late_subscriber_starts_from_the_beginning():
+    source = FakeSource()
+    stream = SharedStream("video", lambda offset: source, lambda stream: None)
+    first = stream.subscribe()
+    first.read()
+    first.read()
+
+    late = stream.subscribe()
+    assert read_all(late) == source.frames
+    assert read_all(first) == source.frames[2:]
+
+
+def test_slow_source_does_not_block_subscribe():
+    source = FakeSource(delay=0.5)
+    broker = SharedAudioBroker()
+    first = broker.subscribe("video", lambda offset: source)
+    reader = threading.Thread(target=first.read)
+    reader.start()
+    time.sleep(0.05)  # let the reader block on the upstream source
+
+    started = time.monotonic()
+    second = broker.subscribe("video", lambda offset: FakeSource())
+    elapsed = time.monotonic() - started
+    reader.join()
+
+    assert elapsed < 0.1
+    assert second.stream is first.stream
+    assert broker.stream_count == 1
@@ -0,0 +1,55 @@
+import asyncio
+import time
+
+import pytest
+
+import extraction_pool
+from extraction_pool import ExtractionPool
+
+
+def fake_extract_stream(video_url):
+    if "stalled" in video_url:
+        time.sleep(60)  # a connection that never answers
+    if "slow" in video_url:
+        time.sleep(0.6)
+    return video_url + "/stream", "opus"
+
+
+def test_a_timed_out_extraction_does_not_block_the_next_one(monkeypatch):
+    monkeypatch.setattr(extraction_pool, "_extract_stream", fake_extract_stream)
+
+    async def extractions():
+        pool = ExtractionPool({}, size=1, timeout=1)
+        try:
+            with pytest.raises(asyncio.TimeoutError):
+                await pool._extract("https://example.com/stalled")
+            start = time.monotonic()
+            assert await pool._extract("https://example.com/fast") == ("https://example.com/fast/stream", "opus")
+            assert time.monotonic() - start < 1
+        finally:
+            pool.shutdown()
+
+    asyncio.run(extractions())
+
+
+def test_time_queued_behind_other_jobs_does_not_count_towards_the_timeout(monkeypatch):
+    monkeypatch.setattr(extraction_pool, "_extract_stream", fake_extract_stream)
+
+    async def extractions():
+        pool = ExtractionPool({}, size=1, timeout=1)
+        try:
+            await pool._extract("https://example.com/warmup")  # the worker process starts
+            urls = [f"https://example.com/slow{index}" for index in range(4)]
+            results = await asyncio.gather(*(pool._extract(url) for url in urls))
+            assert [stream_url for stream_url, _ in results] == [url + "/stream" for url in urls]
+        finally:
+            pool.shutdown()
+
+    asyncio.run(extractions())
+
+
+def test_socket_timeout_is_below_the_extraction_timeout():
+    pool = ExtractionPool({"format": "bestaudio"}, size=1)
+    pool.shutdown()
+    assert pool.ydl_options["socket_timeout"] < pool.timeout
+    assert pool.ydl_options["format"] == "bestaudio"
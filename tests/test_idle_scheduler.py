@@ -0,0 +1,71 @@
+import asyncio
+
+from idle_scheduler import IdleScheduler
+
+TIMEOUT = 0.05
+
+
+def run_scheduler(actions, wait=TIMEOUT * 3):
+    '''Runs the actions on a started scheduler and returns the guilds that became idle'''
+    idle = []
+
+    async def on_idle(guild_id):
+        idle.append(guild_id)
+
+    async def main():
+        scheduler = IdleScheduler(TIMEOUT, on_idle)
+        scheduler.start()
+        await actions(scheduler)
+        await asyncio.sleep(wait)
+        scheduler.stop()
+        return scheduler
+
+    scheduler = asyncio.run(main())
+    return idle, scheduler
+
+
+def test_touched_guilds_expire():
+    async def actions(scheduler):
+        scheduler.touch(1)
+        scheduler.touch(2)
+
+    idle, scheduler = run_scheduler(actions)
+    assert sorted(idle) == [1, 2]
+    assert len(scheduler) == 0
+
+
+def test_touch_pushes_the_deadline_back():
+    async def actions(scheduler):
+        scheduler.touch(1)
+        for _ in range(4):
+            await asyncio.sleep(TIMEOUT / 2)
+            scheduler.touch(1)
+        assert len(scheduler) == 1
+
+    idle, _ = run_scheduler(actions, wait=TIMEOUT / 4)
+    assert idle == []
+    idle, _ = run_scheduler(actions)
+    assert idle == [1]
+
+
+def test_suspended_and_removed_guilds_dont_expire():
+    async def actions(scheduler):
+        scheduler.touch(1)
+        scheduler.touch(2)
+        scheduler.touch(3)
+        scheduler.suspend(1)
+        scheduler.remove(2)
+
+    idle, _ = run_scheduler(actions)
+    assert idle == [3]
+
+
+def test_suspended_guild_expires_after_being_touched_again():
+    async def actions(scheduler):
+        scheduler.touch(1)
+        scheduler.suspend(1)
+        await asyncio.sleep(TIMEOUT * 2)
+        scheduler.touch(1)
+
+    idle, _ = run_scheduler(actions)
+    assert idle == [1]
@@ -0,0 +1,67 @@
+import asyncio
+import os
+import time
+
+import lyrics
+from lyrics import LyricsService, paginate_lyrics
+
+
+def test_a_long_line_comes_after_the_lines_before_it():
+    pages = paginate_lyrics("intro\n" + "x" * 25, 10)
+    assert pages == ["intro", "x" * 10, "x" * 10, "x" * 5]
+
+
+def test_pages_keep_the_order_of_the_lines():
+    text = "first verse\nsecond line\n" + "long " * 10 + "\nlast line"
+    pages = paginate_lyrics(text, 20)
+    assert all(len(page) <= 20 for page in pages)
+    assert "".join(pages).replace("\n", "") == text.replace("\n", "")
+
+
+def make_service(tmp_path, search):
+    service = LyricsService("token", 100, cache_dir=str(tmp_path))
+    service._search = search
+    return service
+
+
+def test_lyrics_requests_do_not_wait_behind_prefetches(tmp_path):
+    def search(title):
+        time.sleep(0.2 if title.startswith("prefetched") else 0.01)
+        return [title]
+
+    async def run():
+        service = make_service(tmp_path, search)
+        for index in range(10):
+            service.prefetch(f"prefetched {index}")
+        await asyncio.sleep(0.01)
+        start = time.monotonic()
+        assert await service.get_pages("requested") == ["requested"]
+        assert time.monotonic() - start < 0.2
+        service.close()
+
+    asyncio.run(run())
+
+
+def test_prefetches_are_dropped_when_the_backlog_is_full(tmp_path, monkeypatch):
+    monkeypatch.setattr(lyrics, "MAX_PENDING_PREFETCHES", 3)
+
+    async def run():
+        service = make_service(tmp_path, lambda title: [title])
+        for index in range(10):
+            service.prefetch(f"song {index}")
+        assert len(service._background) == 3
+        service.close()
+
+    asyncio.run(run())
+
+
+def test_the_disk_cache_keeps_the_newest_entries(tmp_path, monkeypatch):
+    monkeypatch.setattr(lyrics, "MAX_DISK_ENTRIES", 2)
+    service = make_service(tmp_path, lambda title: [title])
+    for index in range(4):
+        service._write_disk(f"key {index}", ["page"])
+        os.utime(service._path(f"key {index}"), (index + 1, time.time() - 10 + index))
+    service._prune_disk()
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        os.path.basename(service._path(key)) for key in ("key 2", "key 3")
+    )
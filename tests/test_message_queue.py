@@ -0,0 +1,7 @@
+from message_queue import split_message
+
+
+def test_split_message_cuts_between_lines():
+    text = "\n".join(["aaaa", "", "bbbb", "cccc"])
+    assert split_message(text, 10) == ["aaaa\n\nbbbb", "cccc"]
+    assert split_message("x" * 25, 10) == ["x" * 10, "x" * 10, "x" * 5]
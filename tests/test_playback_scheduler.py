@@ -0,0 +1,42 @@
+import asyncio
+
+from playback_scheduler import PlaybackScheduler
+
+
+def make_scheduler(active):
+    played = []
+
+    async def play_next(guild_id):
+        played.append(guild_id)
+
+    async def on_error(guild_id, error):
+        pass
+
+    return PlaybackScheduler(play_next, on_error, lambda guild_id: guild_id in active), played
+
+
+def test_notifying_plays_the_next_song():
+    async def run():
+        scheduler, played = make_scheduler({1})
+        scheduler.notify(1)
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        assert played == [1]
+        scheduler.stop_all()
+
+    asyncio.run(run())
+
+
+def test_a_guild_that_was_left_is_not_restarted_by_a_late_notification():
+    async def run():
+        active = {1}
+        scheduler, played = make_scheduler(active)
+        scheduler.notify(1)
+        await asyncio.sleep(0)
+        active.discard(1)
+        scheduler.stop(1)
+        scheduler.notify_threadsafe(1)  # the after callback run by VoiceClient.disconnect
+        await asyncio.sleep(0.01)
+        assert scheduler._guilds == {}
+
+    asyncio.run(run())
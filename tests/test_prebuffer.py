@@ -0,0 +1,64 @@
+import asyncio
+
+from prebuffer import Prewarmer
+
+
+class FakeSource:
+    def __init__(self, song):
+        self.song = song
+        self.cleaned_up = False
+
+    def cleanup(self):
+        self.cleaned_up = True
+
+
+def make_prewarmer():
+    prepared = []
+
+    async def prepare(song):
+        source = FakeSource(song)
+        prepared.append(source)
+        return source
+
+    return Prewarmer(prepare), prepared
+
+
+def test_a_paused_song_does_not_prepare_the_next_one_until_resumed():
+    async def run():
+        prewarmer, prepared = make_prewarmer()
+        prewarmer.schedule(1, 0.05, lambda: "next")
+        prewarmer.pause(1)
+        await asyncio.sleep(0.1)
+        assert prepared == []
+        prewarmer.resume(1)
+        await asyncio.sleep(0.1)
+        assert [source.song for source in prepared] == ["next"]
+        assert (await prewarmer.take(1, "next")) is prepared[0]
+
+    asyncio.run(run())
+
+
+def test_pausing_cleans_up_a_prepared_source():
+    async def run():
+        prewarmer, prepared = make_prewarmer()
+        prewarmer.schedule(1, 0, lambda: "next")
+        await asyncio.sleep(0.01)
+        prewarmer.pause(1)
+        assert prepared[0].cleaned_up
+
+    asyncio.run(run())
+
+
+def test_a_queue_change_prepares_the_new_next_song():
+    async def run():
+        queue = ["first", "second"]
+        prewarmer, prepared = make_prewarmer()
+        prewarmer.schedule(1, 0, lambda: queue[0])
+        await asyncio.sleep(0.01)
+        queue.pop(0)  # e.g. -remove 1
+        prewarmer.reschedule(1)
+        await asyncio.sleep(0.01)
+        assert prepared[0].cleaned_up
+        assert (await prewarmer.take(1, "second")) is prepared[1]
+
+    asyncio.run(run())
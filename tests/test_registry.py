@@ -0,0 +1,74 @@
+import pytest
+
+from registry import MAX_HISTORY_LENGTH, Channel, Song
+
+
+def make_channel(count=0):
+    channel = Channel(None, None)
+    for i in range(count):
+        channel.add_song(Song(f"song{i}"))
+    return channel
+
+
+def titles(songs):
+    return [song.title for song in songs]
+
+
+def test_move_in_queue():
+    channel = make_channel(4)
+
+    assert channel.move_in_queue(3, 0).title == "song3"
+    assert titles(channel.queue) == ["song3", "song0", "song1", "song2"]
+    assert channel.move_in_queue(1, 3).title == "song0"
+    assert titles(channel.queue) == ["song3", "song1", "song2", "song0"]
+
+
+def test_move_in_queue_out_of_range_keeps_the_queue():
+    channel = make_channel(3)
+
+    with pytest.raises(IndexError):
+        channel.move_in_queue(0, 3)
+    with pytest.raises(IndexError):
+        channel.move_in_queue(5, 0)
+    assert titles(channel.queue) == ["song0", "song1", "song2"]
+
+
+def test_remove_from_queue():
+    channel = make_channel(3)
+
+    assert channel.remove_from_queue(1).title == "song1"
+    assert titles(channel.queue) == ["song0", "song2"]
+    with pytest.raises(IndexError):
+        channel.remove_from_queue(2)
+
+
+def test_next_song_and_play_previous():
+    channel = make_channel(3)
+    assert not channel.play_previous()  # nothing played yet
+
+    assert channel.next_song().title == "song0"
+    assert not channel.play_previous()  # no history before the first song
+    assert channel.next_song().title == "song1"
+
+    assert channel.play_previous()
+    assert channel.peek_next_song().title == "song0"
+    assert channel.next_song().title == "song0"
+    assert titles(channel.queue) == ["song1", "song2"]
+    assert channel.next_song().title == "song1"
+    assert channel.next_song().title == "song2"
+    assert channel.next_song() is None
+
+
+def test_history_is_bounded():
+    channel = make_channel(MAX_HISTORY_LENGTH + 10)
+    while channel.next_song() is not None:
+        pass
+
+    assert len(channel.history) == MAX_HISTORY_LENGTH
+    assert channel.history[0].title == "song9"
+    # previous walks back through the kept history only
+    for _ in range(MAX_HISTORY_LENGTH):
+        assert channel.play_previous()
+        channel.next_song()
+    assert not channel.play_previous()
+    assert channel.current.title == "song9"
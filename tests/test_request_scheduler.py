@@ -0,0 +1,62 @@
+import asyncio
+import time
+
+from request_scheduler import PRIORITY_BACKGROUND, PRIORITY_PLAYING, RequestScheduler
+from stream_resolver import StreamResolver
+
+REQUEST_SECONDS = 0.05
+
+
+class FakeExtractor:
+    """Extracts through a scheduler that runs one request at a time."""
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+
+    async def extract(self, video_url, priority):
+        async def request():
+            await asyncio.sleep(REQUEST_SECONDS)
+            return video_url + "/stream", "opus"
+
+        return await self.scheduler.run(request, priority)
+
+
+class FakeSong:
+    def __init__(self, video_id):
+        self.video_id = video_id
+        self.stream_url = None
+        self.stream_codec = None
+        self.stream_expiry = 0.0
+
+    @property
+    def url(self):
+        return "https://www.youtube.com/watch?v=" + self.video_id
+
+
+class ResolvedSongs:
+    async def resolve(self, song, priority):
+        pass
+
+
+def test_a_playing_song_moves_its_prefetch_ahead_of_the_background_requests():
+    async def run():
+        scheduler = RequestScheduler(rate=1000, burst=1000, concurrency=1)
+        resolver = StreamResolver(FakeExtractor(scheduler), ResolvedSongs())
+        background = [
+            asyncio.create_task(resolver.resolve(FakeSong(f"queued{index}"), PRIORITY_BACKGROUND))
+            for index in range(20)
+        ]
+        playing = FakeSong("playing")
+        prefetch = asyncio.create_task(resolver.resolve(playing, PRIORITY_BACKGROUND))
+        await asyncio.sleep(0)
+
+        start = time.monotonic()
+        await resolver.resolve(playing, PRIORITY_PLAYING)  # joins the prefetch
+        # the request running when it joined, then its own
+        assert time.monotonic() - start < 4 * REQUEST_SECONDS
+        assert scheduler.waiting_count == 19
+
+        await asyncio.gather(prefetch, *background)
+        scheduler.close()
+
+    asyncio.run(run())
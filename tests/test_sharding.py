@@ -0,0 +1,23 @@
+import pytest
+
+from registry import Registry
+from shard_launcher import parse_shard_range
+
+
+def test_parse_shard_range():
+    assert parse_shard_range("", 4) == [0, 1, 2, 3]
+    assert parse_shard_range("2", 4) == [2]
+    assert parse_shard_range("1-3", 4) == [1, 2, 3]
+    for text in ("3-1", "2-4", "-1"):
+        with pytest.raises(ValueError):
+            parse_shard_range(text, 4)
+
+
+def test_registry_owns_the_guilds_of_its_shard():
+    guild_ids = [(n << 22) | 12345 for n in range(8)]
+    registries = [Registry(shard_id, 4) for shard_id in range(4)]
+
+    for n, guild_id in enumerate(guild_ids):
+        assert [registry.owns(guild_id) for registry in registries].count(True) == 1
+        assert registries[n % 4].owns(guild_id)
+    assert all(Registry().owns(guild_id) for guild_id in guild_ids)
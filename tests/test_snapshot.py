@@ -0,0 +1,71 @@
+import gzip
+import json
+import time
+from types import SimpleNamespace
+
+from registry import Channel, Registry, Song
+from snapshot import (
+    MAX_SNAPSHOT_AGE,
+    load_snapshot,
+    registry_to_snapshot,
+    restore_channel,
+    save_snapshot,
+)
+
+
+def make_registry():
+    registry = Registry()
+    guild = SimpleNamespace(id=1)
+    registry.add_channel(guild, SimpleNamespace(id=10), SimpleNamespace(id=20))
+    channel = registry.servers[1].channel
+    channel.add_song(Song("first", "aaaaaaaaaaa", "First", 100))
+    channel.add_song(Song("second", "bbbbbbbbbbb", "Second", 200))
+    channel.add_song(Song("third"))
+    channel.next_song()
+    channel.next_song()
+    return registry
+
+
+def titles(songs):
+    return [song.title for song in songs]
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / "snapshot.json.gz")
+    save_snapshot(registry_to_snapshot(make_registry()), path)
+
+    snapshot = load_snapshot(path)
+    guild_snapshot = snapshot["guilds"][0]
+    assert (guild_snapshot["guild"], guild_snapshot["voice"], guild_snapshot["text"]) == (1, 10, 20)
+
+    channel = Channel(None, None)
+    restore_channel(channel, guild_snapshot)
+    # the song that was playing is played again, then the rest of the queue
+    assert titles(channel.history) == ["First"]
+    assert titles(channel.queue) == ["Second", "third"]
+    restored = channel.queue[0]
+    assert (restored.query, restored.video_id, restored.duration) == ("second", "bbbbbbbbbbb", 200)
+    assert not channel.queue[1].resolved
+    assert channel.current is None
+
+
+def test_load_snapshot_missing_or_unreadable(tmp_path):
+    assert load_snapshot(str(tmp_path / "missing.json.gz")) is None
+
+    path = tmp_path / "broken.json.gz"
+    path.write_bytes(b"not gzip")
+    assert load_snapshot(str(path)) is None
+
+
+def test_load_snapshot_ignores_old_snapshots(tmp_path):
+    path = str(tmp_path / "snapshot.json.gz")
+    snapshot = registry_to_snapshot(make_registry())
+    snapshot["saved_at"] = time.time() - MAX_SNAPSHOT_AGE - 1
+    save_snapshot(snapshot, path)
+    assert load_snapshot(path) is None
+
+    snapshot["saved_at"] = time.time()
+    snapshot["version"] = -1
+    with gzip.open(path, "wt", encoding="utf-8") as snapshot_file:
+        json.dump(snapshot, snapshot_file)
+    assert load_snapshot(path) is None
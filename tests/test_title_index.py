@@ -0,0 +1,39 @@
+from title_index import TitleIndex, load_title_index, save_title_index
+
+
+def filled_index(count):
+    index = TitleIndex(max_titles=count + 10)
+    for number in range(count):
+        index.add(None, f"fill{number}", f"Artist {number} - Song {number} (Official Video)", played=False)
+    return index
+
+
+def test_common_words_do_not_hide_a_title():
+    index = filled_index(12000)  # the filler ids sort before the one looked for
+    index.add(7, "uxI8MTrasNA", "Drake - Hotline Bling (Official Video)")
+    suggestions = index.suggest(7, "hotline bling official video")
+    assert [entry.video_id for entry in suggestions] == ["uxI8MTrasNA"]
+    assert [entry.video_id for entry in index.suggest(None, "official video bling")] == ["uxI8MTrasNA"]
+
+
+def test_common_words_alone_return_at_most_the_limit():
+    index = filled_index(1000)
+    assert len(index.suggest(None, "official vid", limit=25)) == 25
+
+
+def test_typos_and_guild_titles_first():
+    index = TitleIndex()
+    index.add(1, "a", "Bohemian Rhapsody")
+    index.add(2, "b", "Bohemian Like You")
+    assert [entry.video_id for entry in index.suggest(2, "bohemian")] == ["b", "a"]
+    assert [entry.video_id for entry in index.suggest(1, "rapsody")] == ["a"]
+
+
+def test_the_index_survives_a_restart(tmp_path):
+    index = TitleIndex()
+    index.add(1, "a", "Bohemian Rhapsody", 355)
+    path = str(tmp_path / "titles.json.gz")
+    save_title_index(index.to_records(), path)
+    restored = load_title_index(path)
+    assert restored.get("a").duration == 355
+    assert [entry.video_id for entry in restored.suggest(1, "")] == ["a"]
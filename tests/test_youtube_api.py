@@ -0,0 +1,101 @@
+import asyncio
+import json
+
+from youtube_api import TTLCache, get_playlist_id, parse_duration, parse_search_results
+
+
+def test_empty_values_expire_with_the_empty_ttl():
+    calls = []
+
+    async def fetch():
+        calls.append(None)
+        return []
+
+    async def lookups():
+        cache = TTLCache(10, ttl=3600, empty_ttl=0)
+        assert await cache.get_or_fetch("consent page", fetch) == []
+        assert await cache.get_or_fetch("consent page", fetch) == []
+        assert len(cache) == 0
+
+    asyncio.run(lookups())
+    assert len(calls) == 2  # the empty result isn't served from the cache
+
+
+def test_values_are_cached_for_the_ttl():
+    calls = []
+
+    async def fetch():
+        calls.append(None)
+        return ["result"]
+
+    async def lookups():
+        cache = TTLCache(10, ttl=3600, empty_ttl=0)
+        await cache.get_or_fetch("song", fetch)
+        assert await cache.get_or_fetch("song", fetch) == ["result"]
+
+    asyncio.run(lookups())
+    assert len(calls) == 1
+
+
+def test_playlist_links_are_playlists():
+    assert get_playlist_id("https://www.youtube.com/playlist?list=PL123") == "PL123"
+
+
+def test_videos_played_from_a_playlist_are_videos():
+    assert get_playlist_id("https://www.youtube.com/watch?v=dQw4w9WgXcQ&list=RDdQw4w9WgXcQ") is None
+    assert get_playlist_id("https://youtu.be/dQw4w9WgXcQ?list=PL123") is None
+    assert get_playlist_id("never gonna give you up") is None
+
+
+def test_cancelling_the_first_caller_does_not_fail_the_others():
+    async def fetch():
+        await asyncio.sleep(0.05)
+        return ["result"]
+
+    async def lookups():
+        cache = TTLCache(10, ttl=3600)
+        owner = asyncio.create_task(cache.get_or_fetch("song", fetch))
+        await asyncio.sleep(0)
+        joiner = asyncio.create_task(cache.get_or_fetch("song", fetch))
+        await asyncio.sleep(0)
+        owner.cancel()
+        assert await joiner == ["result"]
+        assert owner.cancelled()
+        assert cache.get("song") == ["result"]
+
+    asyncio.run(lookups())
+
+
+def search_page(renderers):
+    data = {"contents": {"sectionListRenderer": {"contents": [{"itemSectionRenderer": {"contents": renderers}}]}}}
+    return f"<html><script>var ytInitialData = {json.dumps(data)};</script></html>"
+
+
+def video_renderer(video_id, title, length=None):
+    renderer = {"videoId": video_id, "title": {"runs": [{"text": title}]}, "ownerText": {"runs": [{"text": "Channel"}]}}
+    if length is not None:
+        renderer["lengthText"] = {"simpleText": length}
+    return {"videoRenderer": renderer}
+
+
+def test_search_results_are_parsed_in_ranking_order_without_duplicates():
+    html = search_page([
+        video_renderer("aaaaaaaaaaa", "First", "3:45"),
+        {"shelfRenderer": {"content": {"items": [video_renderer("bbbbbbbbbbb", "Live")]}}},
+        video_renderer("aaaaaaaaaaa", "First again", "3:45"),
+        video_renderer("ccccccccccc", "Long", "1:02:03"),
+    ])
+    results = parse_search_results(html)
+    assert [(result.video_id, result.title, result.duration) for result in results] == [
+        ("aaaaaaaaaaa", "First", 225),
+        ("bbbbbbbbbbb", "Live", None),
+        ("ccccccccccc", "Long", 3723),
+    ]
+    assert results[0].channel == "Channel"
+    assert not results[1].is_playable()
+    assert not results[2].is_playable(max_duration=3600)
+
+
+def test_a_page_without_initial_data_has_no_results():
+    assert parse_search_results("<html>consent</html>") == []
+    assert parse_duration("LIVE") is None
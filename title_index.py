@@ -0,0 +1,285 @@
+import bisect
+import difflib
+import gzip
+import heapq
+import json
+import operator
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import List, Optional, Set, Tuple
+
+TITLE_INDEX_PATH = "title_index.json.gz"
+TITLE_INDEX_VERSION = 1
+MAX_INDEXED_TITLES = 20000  # titles known by the whole bot, the least recently played are dropped
+MAX_GUILD_TITLES = 200  # titles remembered per guild
+MAX_INDEXED_GUILDS = 10000
+MAX_SUGGESTIONS = 25  # Discord shows at most 25 autocomplete choices
+MIN_FUZZY_LENGTH = 3  # shorter words are only matched as prefixes
+FUZZY_CUTOFF = 0.75
+MAX_FUZZY_TOKENS = 500  # words compared when looking for typos of a typed word
+
+WORD_RE = re.compile(r"\w+")
+VIDEO_ID_OF_WORD = operator.itemgetter(1)  # of a (word, video id) pair of the word list
+RANK_KEY = operator.attrgetter("plays", "last_played")  # most played first, then most recently played
+
+
+def title_words(text: str) -> List[str]:
+    """Returns the lower cased words of a title or of a query."""
+    return WORD_RE.findall(text.lower())
+
+
+class IndexedTitle:
+    """A video that was played, with what is needed to enqueue it without searching."""
+
+    __slots__ = ("video_id", "title", "duration", "plays", "last_played")
+
+    def __init__(
+        self,
+        video_id: str,
+        title: str,
+        duration: Optional[int] = None,
+        plays: int = 0,
+        last_played: float = 0.0,
+    ):
+        self.video_id = video_id
+        self.title = title
+        self.duration = duration
+        self.plays = plays
+        self.last_played = last_played
+
+
+class TitleIndex:
+    """An in memory index of the titles played by the bot, answering autocomplete queries.
+    Every word of a title is kept in a sorted list, so the titles whose words start
+    with the typed words are found with a binary search instead of a YouTube search.
+    A typed word without matches is compared to the indexed words to tolerate typos.
+    Titles are remembered globally and per guild, the titles of the guild come first.
+    """
+
+    def __init__(
+        self,
+        max_titles: int = MAX_INDEXED_TITLES,
+        max_guild_titles: int = MAX_GUILD_TITLES,
+        max_guilds: int = MAX_INDEXED_GUILDS,
+    ):
+        """Initializes an empty TitleIndex instance.
+        Args:
+            max_titles (int): The maximum number of titles kept.
+            max_guild_titles (int): The maximum number of titles remembered per guild.
+            max_guilds (int): The maximum number of guilds with remembered titles.
+        """
+        self.max_titles = max_titles
+        self.max_guild_titles = max_guild_titles
+        self.max_guilds = max_guilds
+        self._titles: "OrderedDict[str, IndexedTitle]" = OrderedDict()  # video id -> title, least recent first
+        self._words: List[Tuple[str, str]] = []  # sorted (word, video id)
+        self._guilds: "OrderedDict[int, OrderedDict[str, None]]" = OrderedDict()  # guild id -> video ids
+        self.changes = 0  # incremented by every add, tells if the index must be saved again
+
+    def __len__(self) -> int:
+        return len(self._titles)
+
+    def get(self, video_id: str) -> Optional[IndexedTitle]:
+        '''Returns the indexed title of a video, None if it isn't indexed'''
+        return self._titles.get(video_id)
+
+    def add(
+        self,
+        guild_id: Optional[int],
+        video_id: str,
+        title: str,
+        duration: Optional[int] = None,
+        played: bool = True,
+    ) -> None:
+        '''Indexes a video for a guild, or updates it if it is already indexed
+        Args:
+            guild_id: The guild the video was played or queued in, None for none
+            video_id: The id of the video
+            title: The title of the video
+            duration: The length of the video in seconds if known
+            played: True if the video was played, it is counted as a play
+        '''
+        if not title:
+            return
+        self.changes += 1
+        entry = self._titles.get(video_id)
+        if entry is None:
+            entry = self._titles[video_id] = IndexedTitle(video_id, title, duration)
+            self._index_words(entry)
+            while len(self._titles) > self.max_titles:
+                self._remove(next(iter(self._titles)))
+        else:
+            self._titles.move_to_end(video_id)
+            entry.duration = duration or entry.duration
+        if played:
+            entry.plays += 1
+            entry.last_played = time.time()
+
+        if guild_id is None:
+            return
+        guild_titles = self._guilds.get(guild_id)
+        if guild_titles is None:
+            guild_titles = self._guilds[guild_id] = OrderedDict()
+            while len(self._guilds) > self.max_guilds:
+                self._guilds.popitem(last=False)
+        else:
+            self._guilds.move_to_end(guild_id)
+        guild_titles[video_id] = None
+        guild_titles.move_to_end(video_id)
+        while len(guild_titles) > self.max_guild_titles:
+            guild_titles.popitem(last=False)
+
+    def _index_words(self, entry: IndexedTitle) -> None:
+        for word in set(title_words(entry.title)):
+            bisect.insort(self._words, (word, entry.video_id))
+
+    def _remove(self, video_id: str) -> None:
+        '''Drops a title, the guilds still referencing it skip it when suggesting'''
+        entry = self._titles.pop(video_id)
+        for word in set(title_words(entry.title)):
+            position = bisect.bisect_left(self._words, (word, video_id))
+            if position < len(self._words) and self._words[position] == (word, video_id):
+                del self._words[position]
+
+    def _prefix_range(self, prefix: str) -> Tuple[int, int]:
+        '''Returns the slice of the word list holding the words starting with prefix'''
+        start = bisect.bisect_left(self._words, (prefix,))
+        return start, bisect.bisect_left(self._words, (prefix + "\U0010ffff",), start)
+
+    def _prefix_matches(self, prefix: str) -> Set[str]:
+        '''Returns the video ids having a word starting with prefix'''
+        start, end = self._prefix_range(prefix)
+        return set(map(VIDEO_ID_OF_WORD, self._words[start:end]))
+
+    def _fuzzy_matches(self, typed: str) -> Set[str]:
+        '''Returns the video ids having a word close to typed, words are assumed to start with the right letter'''
+        matches = set()
+        position = bisect.bisect_left(self._words, (typed[0],))
+        matcher = difflib.SequenceMatcher(b=typed)
+        compared = 0
+        previous_word = None
+        for index in range(position, len(self._words)):
+            word, video_id = self._words[index]
+            if not word.startswith(typed[0]) or compared >= MAX_FUZZY_TOKENS:
+                break
+            if word != previous_word:
+                previous_word = word
+                compared += 1
+                matcher.set_seq1(word[:len(typed) + 2])  # the end of the word may not be typed yet
+                close = matcher.real_quick_ratio() >= FUZZY_CUTOFF and matcher.ratio() >= FUZZY_CUTOFF
+            if close:
+                matches.add(video_id)
+        return matches
+
+    def _matching_ids(self, words: List[str]) -> Set[str]:
+        '''Returns the video ids matching every typed word, by prefix or else by similarity
+        Every match of every word counts, the words are intersected from the rarest one so
+        common words ("official", "video") only narrow down a small set.
+        '''
+        counted: List[Tuple[int, str, Optional[Set[str]]]] = []  # (matches, word, fuzzy matches)
+        for word in set(words):
+            start, end = self._prefix_range(word)
+            if start < end:
+                counted.append((end - start, word, None))
+                continue
+            fuzzy = self._fuzzy_matches(word) if len(word) >= MIN_FUZZY_LENGTH else set()
+            if not fuzzy:
+                return set()
+            counted.append((len(fuzzy), word, fuzzy))
+        counted.sort(key=lambda count: count[0])
+
+        _, word, fuzzy = counted[0]
+        matching = fuzzy if fuzzy is not None else self._prefix_matches(word)
+        for _, word, fuzzy in counted[1:]:
+            if not matching:
+                break
+            matching &= fuzzy if fuzzy is not None else self._prefix_matches(word)
+        return matching
+
+    def suggest(
+        self, guild_id: Optional[int], query: str, limit: int = MAX_SUGGESTIONS
+    ) -> List[IndexedTitle]:
+        '''Returns the indexed titles matching what a user typed, best first
+        Titles played in the guild come first, then the most played ones.
+        An empty query returns the titles recently played in the guild.
+        Args:
+            guild_id: The guild of the user, None outside of guilds
+            query: The text typed so far
+            limit: The maximum number of titles returned
+        '''
+        guild_titles = self._guilds.get(guild_id, {}) if guild_id is not None else {}
+        words = title_words(query)
+        if not words:
+            recent = (self._titles.get(video_id) for video_id in reversed(guild_titles))
+            return [entry for entry in recent if entry is not None][:limit]
+
+        matching = self._matching_ids(words)
+        suggestions = heapq.nlargest(
+            limit, map(self._titles.__getitem__, matching.intersection(guild_titles)), key=RANK_KEY
+        )
+        if len(suggestions) < limit:
+            others = map(self._titles.__getitem__, matching.difference(guild_titles))
+            suggestions += heapq.nlargest(limit - len(suggestions), others, key=RANK_KEY)
+        return suggestions
+
+    def to_records(self) -> dict:
+        '''Returns the index as a JSON serializable dict'''
+        return {
+            "version": TITLE_INDEX_VERSION,
+            "titles": [
+                [entry.video_id, entry.title, entry.duration, entry.plays, entry.last_played]
+                for entry in self._titles.values()
+            ],
+            "guilds": {str(guild_id): list(video_ids) for guild_id, video_ids in self._guilds.items()},
+        }
+
+    @classmethod
+    def from_records(cls, records: dict, **limits) -> "TitleIndex":
+        '''Creates an index from the dict made by to_records'''
+        index = cls(**limits)
+        for video_id, title, duration, plays, last_played in records["titles"][-index.max_titles:]:
+            entry = IndexedTitle(video_id, title, duration, plays, last_played)
+            index._titles[video_id] = entry
+        # building the sorted word list at once is faster than inserting every word
+        index._words = sorted(
+            (word, entry.video_id)
+            for entry in index._titles.values()
+            for word in set(title_words(entry.title))
+        )
+        for guild_id, video_ids in list(records["guilds"].items())[-index.max_guilds:]:
+            index._guilds[int(guild_id)] = OrderedDict.fromkeys(video_ids[-index.max_guild_titles:])
+        return index
+
+
+def save_title_index(records: dict, path: str = TITLE_INDEX_PATH) -> None:
+    """Writes the records of a title index as gzipped JSON, atomically.
+    Args:
+        records (dict): The records made by TitleIndex.to_records.
+        path (str): The path of the index file.
+    """
+    temporary_path = path + ".tmp"
+    with gzip.open(temporary_path, "wt", encoding="utf-8") as index_file:
+        json.dump(records, index_file, separators=(",", ":"))
+    os.replace(temporary_path, path)
+
+
+def load_title_index(path: str = TITLE_INDEX_PATH) -> TitleIndex:
+    """Reads a title index written by save_title_index.
+    Args:
+        path (str): The path of the index file.
+    Returns:
+        TitleIndex: The index, empty if there is no readable file.
+    """
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as index_file:
+            records = json.load(index_file)
+    except FileNotFoundError:
+        return TitleIndex()
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable title index: {e}")
+        return TitleIndex()
+    if records.get("version") != TITLE_INDEX_VERSION:
+        return TitleIndex()
+    return TitleIndex.from_records(records)
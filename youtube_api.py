@@ -1,38 +1,539 @@
-import requests
+import asyncio
+import aiohttp
+import json
 import re
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs, quote, urlparse
 from pytube import YouTube
-from typing import List
+from request_scheduler import RequestScheduler, ThrottledError, PRIORITY_INTERACTIVE
+from metrics import METRICS
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional
+
+REQUEST_TIMEOUT = 10  # seconds for a whole request
+CONNECT_TIMEOUT = 3  # seconds to establish a connection
+MAX_CONNECTIONS = 100
+MAX_CONNECTIONS_PER_HOST = 20
+KEEPALIVE_TIMEOUT = 30  # seconds an idle pooled connection is kept open
+SEARCH_CACHE_SIZE = 5000
+SEARCH_CACHE_TTL = 6 * 3600  # 6 hours, search rankings drift slowly
+EMPTY_SEARCH_TTL = 60  # seconds, an empty results page may be a consent page or a transient failure
+TITLE_CACHE_SIZE = 20000
+TITLE_CACHE_TTL = 7 * 24 * 3600  # 1 week, video titles rarely change
+MAX_SONG_DURATION = 3 * 3600  # 3 hours, longer videos are not queued
+BASE_SEARCH_URL = "https://www.youtube.com/results?q="
+BASE_VIDEO_URL = "https://www.youtube.com/watch?v="
+BASE_PLAYLIST_URL = "https://www.youtube.com/playlist?list="
+BROWSE_API_URL = "https://www.youtube.com/youtubei/v1/browse?key="
+MAX_PLAYLIST_SIZE = 500  # entries enqueued from one playlist
+
+INITIAL_DATA_RE = re.compile(r"(?:var ytInitialData|window\[\"ytInitialData\"\])\s*=\s*")
+INNERTUBE_API_KEY_RE = re.compile(r'"INNERTUBE_API_KEY"\s*:\s*"([^"]+)"')
+INNERTUBE_CONTEXT_RE = re.compile(r'"INNERTUBE_CONTEXT"\s*:\s*')
+
+
+class NoSearchResultsError(Exception):
+    """Raised when a search has no playable result."""
+
+
+class YoutubeHTTPError(Exception):
+    """Raised when YouTube answers a request with an unexpected status code."""
+
+    def __init__(self, status: int, url: str):
+        super().__init__(f"Unexpected status code {status} for {url}")
+        self.status = status
+        self.url = url
+
+
+class YoutubeThrottledError(YoutubeHTTPError, ThrottledError):
+    """Raised when YouTube throttles a request (429) or fails temporarily (5xx)."""
+
+    def __init__(self, status: int, url: str, retry_after: Optional[float] = None):
+        YoutubeHTTPError.__init__(self, status, url)
+        self.retry_after = retry_after
+
+
+def check_status(response: aiohttp.ClientResponse) -> None:
+    """Raises the typed error matching the status of a response that isn't 200.
+    Raises:
+        YoutubeThrottledError: For 429 and 5xx responses, with the Retry-After delay if given.
+        YoutubeHTTPError: For other unexpected status codes.
+    """
+    if response.status == 200:
+        return
+    url = str(response.url)
+    if response.status == 429 or response.status >= 500:
+        retry_after = response.headers.get("Retry-After", "")
+        raise YoutubeThrottledError(
+            response.status, url, float(retry_after) if retry_after.isdigit() else None
+        )
+    raise YoutubeHTTPError(response.status, url)
+
+
+class SearchResult:
+    """Represents one video of a YouTube search results page."""
+
+    def __init__(
+        self, video_id: str, title: str, duration: Optional[int], channel: str
+    ) -> None:
+        """Initializes a SearchResult instance.
+        Args:
+            video_id (str): The id of the video.
+            title (str): The title of the video.
+            duration (Optional[int]): The length of the video in seconds, None for livestreams.
+            channel (str): The name of the channel that uploaded the video.
+        """
+        self.video_id = video_id
+        self.title = title
+        self.duration = duration
+        self.channel = channel
+
+    @property
+    def url(self) -> str:
+        """The watch URL of the video."""
+        return BASE_VIDEO_URL + self.video_id
+
+    @property
+    def is_live(self) -> bool:
+        """True if the video is a livestream (it has no fixed length)."""
+        return self.duration is None
+
+    def is_playable(self, max_duration: int = MAX_SONG_DURATION) -> bool:
+        """Returns True if the video is not a livestream and not longer than max_duration."""
+        return not self.is_live and self.duration <= max_duration
+
+    def __repr__(self) -> str:
+        return f"SearchResult({self.video_id!r}, {self.title!r}, {self.duration!r}, {self.channel!r})"
+
+
+def parse_duration(text: str) -> Optional[int]:
+    """Converts a duration like "1:02:03" or "3:45" to seconds.
+    Args:
+        text (str): The duration text shown by YouTube.
+    Returns:
+        Optional[int]: The duration in seconds, None if it can't be parsed.
+    """
+    seconds = 0
+    for part in text.strip().split(":"):
+        if not part.isdigit():
+            return None
+        seconds = seconds * 60 + int(part)
+    return seconds
+
+
+def _runs_text(node: Any) -> str:
+    """Returns the text of a YouTube text node ({"runs": [...]} or {"simpleText": ...})."""
+    if not isinstance(node, dict):
+        return ""
+    if "simpleText" in node:
+        return node["simpleText"]
+    return "".join(run.get("text", "") for run in node.get("runs", []))
+
+
+def _find_renderers(node: Any, name: str) -> List[dict]:
+    """Returns every renderer called name (e.g. "videoRenderer") in the initial data, in page order."""
+    renderers = []
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        if isinstance(current, dict):
+            if name in current and isinstance(current[name], dict):
+                renderers.append(current[name])
+                continue
+            stack.extend(reversed(list(current.values())))
+        elif isinstance(current, list):
+            stack.extend(reversed(current))
+    return renderers
+
+
+def extract_initial_data(html: str) -> Optional[dict]:
+    """Extracts the ytInitialData JSON embedded in a YouTube page.
+    Args:
+        html (str): The page HTML.
+    Returns:
+        Optional[dict]: The decoded initial data, None if the page has none.
+    """
+    match = INITIAL_DATA_RE.search(html)
+    if not match:
+        return None
+    try:
+        data, _ = json.JSONDecoder().raw_decode(html, match.end())
+    except ValueError:
+        return None
+    return data
+
+
+def parse_search_results(html: str) -> List[SearchResult]:
+    """Parses a YouTube search results page into de-duplicated SearchResults.
+    Args:
+        html (str): The HTML of the search results page.
+    Returns:
+        List[SearchResult]: The videos of the page in ranking order.
+    """
+    data = extract_initial_data(html)
+    if data is None:
+        return []
+
+    results = []
+    seen = set()
+    for renderer in _find_renderers(data, "videoRenderer"):
+        video_id = renderer.get("videoId")
+        if not video_id or video_id in seen:
+            continue
+        seen.add(video_id)
+        length = _runs_text(renderer.get("lengthText"))
+        results.append(
+            SearchResult(
+                video_id,
+                _runs_text(renderer.get("title")),
+                parse_duration(length) if length else None,
+                _runs_text(renderer.get("ownerText") or renderer.get("longBylineText")),
+            )
+        )
+    return results
+
+
+def parse_playlist_entries(data: Any) -> List[SearchResult]:
+    """Parses the videos of a playlist page or of a continuation of it.
+    Args:
+        data: The initial data of the playlist page or the continuation response.
+    Returns:
+        List[SearchResult]: The videos in playlist order, unavailable ones are left out.
+    """
+    results = []
+    for renderer in _find_renderers(data, "playlistVideoRenderer"):
+        video_id = renderer.get("videoId")
+        if not video_id or renderer.get("isPlayable") is False:
+            continue
+        length = renderer.get("lengthSeconds")
+        results.append(
+            SearchResult(
+                video_id,
+                _runs_text(renderer.get("title")),
+                int(length) if length and str(length).isdigit() else None,
+                _runs_text(renderer.get("shortBylineText")),
+            )
+        )
+    return results
+
+
+def find_continuation_token(data: Any) -> Optional[str]:
+    """Returns the token of the next page of a playlist, None on the last page."""
+    for renderer in _find_renderers(data, "continuationItemRenderer"):
+        token = (
+            renderer.get("continuationEndpoint", {})
+            .get("continuationCommand", {})
+            .get("token")
+        )
+        if token:
+            return token
+    return None
+
+
+def get_playlist_id(url: str) -> Optional[str]:
+    """Returns the playlist id of a YouTube playlist URL.
+    A link to a video played from a playlist or a mix (watch?v=...&list=...) is a
+    link to the video, not to the playlist.
+    Args:
+        url (str): The URL the user typed.
+    Returns:
+        Optional[str]: The playlist id, None if url isn't a YouTube playlist URL.
+    """
+    parsed = urlparse(url.strip())
+    if not parsed.netloc.endswith(("youtube.com", "youtu.be")):
+        return None
+    query = parse_qs(parsed.query)
+    if "v" in query or parsed.netloc.endswith("youtu.be"):
+        return None
+    playlist_id = query.get("list")
+    return playlist_id[0] if playlist_id else None
+
+
+def normalize_query(query: str) -> str:
+    """Normalizes a search query so equivalent queries share a cache entry.
+    Args:
+        query (str): The raw search query.
+    Returns:
+        str: The query lower cased with whitespace collapsed.
+    """
+    return " ".join(query.lower().split())
+
+
+class TTLCache:
+    """A bounded cache with per entry expiry and least recently used eviction.
+    Concurrent misses on the same key share a single in-flight fetch.
+    """
+
+    def __init__(self, max_size: int, ttl: float, empty_ttl: Optional[float] = None) -> None:
+        """Initializes a TTLCache instance.
+        Args:
+            max_size (int): The maximum number of entries kept in the cache.
+            ttl (float): The number of seconds an entry stays valid.
+            empty_ttl (Optional[float]): The number of seconds an empty value (e.g. no results)
+                stays valid, 0 to never store them. Defaults to ttl.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.empty_ttl = ttl if empty_ttl is None else empty_ttl
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (expiry, value)
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}  # key -> running fetch task
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hit_rate(self) -> float:
+        """The share of lookups that found a valid entry, 0 before the first lookup."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Returns the cached value of key or default if it is missing or expired."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        expiry, value = entry
+        if expiry < time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Stores value under key, evicting the least recently used entries if full."""
+        ttl = self.ttl if value else self.empty_ttl
+        if ttl <= 0:
+            self._entries.pop(key, None)
+            return
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def get_or_fetch(
+        self, key: Hashable, fetch: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        """Returns the cached value of key, fetching and caching it on a miss.
+        If a fetch for the same key is already running, its result is awaited
+        instead of starting another one. The fetch runs in a task of its own, so
+        cancelling the caller that started it doesn't fail the other callers.
+        Args:
+            key: The cache key.
+            fetch: A coroutine function producing the value.
+        Returns:
+            The cached or freshly fetched value.
+        """
+        missing = object()
+        value = self.get(key, missing)
+        if value is not missing:
+            return value
+
+        task = self._in_flight.get(key)
+        if task is None:
+            async def fetch_and_store() -> Any:
+                fetched = await fetch()
+                self.set(key, fetched)
+                return fetched
+
+            task = asyncio.ensure_future(fetch_and_store())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._fetch_done(key, done))
+        return await asyncio.shield(task)
+
+    def _fetch_done(self, key: Hashable, task: asyncio.Future) -> None:
+        """Forgets a finished fetch, its error is marked as retrieved when nobody waits on it."""
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            task.exception()
+
 
 class YoutubeAPI:
-    """A class used to interact with the YouTube API"""
+    """A class used to interact with the YouTube API
+    All instances share one pooled HTTP session so searches reuse keep-alive
+    connections and never block the event loop, and one request scheduler that
+    limits the rate of the requests and backs off when YouTube throttles them.
+    """
+
+    _session: Optional[aiohttp.ClientSession] = None
+    scheduler = RequestScheduler()  # also used by the extraction pool
+    # caches shared by all instances
+    search_cache = TTLCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL, EMPTY_SEARCH_TTL)  # normalized query -> results
+    title_cache = TTLCache(TITLE_CACHE_SIZE, TITLE_CACHE_TTL)  # video id -> title
+
     def __init__(self) -> None:
         """Initializes a new instance of the YoutubeAPI class."""
-        self.base_search_url = "https://www.youtube.com/results?q="
-        self.base_video_url = "https://www.youtube.com/watch?v="
+        self.base_search_url = BASE_SEARCH_URL
+        self.base_video_url = BASE_VIDEO_URL
+
+    @classmethod
+    def get_session(cls) -> aiohttp.ClientSession:
+        """Returns the shared HTTP session, creating it on first use.
+        Must be called from inside a running event loop.
+        """
+        if cls._session is None or cls._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=MAX_CONNECTIONS,
+                limit_per_host=MAX_CONNECTIONS_PER_HOST,
+                keepalive_timeout=KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=300,
+            )
+            timeout = aiohttp.ClientTimeout(
+                total=REQUEST_TIMEOUT, sock_connect=CONNECT_TIMEOUT
+            )
+            cls._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return cls._session
 
-    # get_top_search_results returns a list of urls for the most relevant videos.
-    def get_top_search_results(self, video_title: str) ->  List[str]:
-        """Returns a list of URLs for the most relevant videos.
+    @classmethod
+    async def close_session(cls) -> None:
+        """Closes the shared HTTP session and its pooled connections."""
+        if cls._session is not None and not cls._session.closed:
+            await cls._session.close()
+        cls._session = None
+
+    async def _get_text(self, url: str, priority: int) -> str:
+        """Fetches a page through the scheduler.
+        Raises:
+            YoutubeHTTPError: If the status code isn't 200, YoutubeThrottledError if throttled.
+        """
+        async def request() -> str:
+            async with self.get_session().get(url) as response:
+                check_status(response)
+                return await response.text()
+
+        return await self.scheduler.run(request, priority)
+
+    async def _post_json(self, url: str, payload: dict, priority: int) -> Any:
+        """Posts to an API endpoint through the scheduler and returns the decoded answer."""
+        async def request() -> Any:
+            async with self.get_session().post(url, json=payload) as response:
+                check_status(response)
+                return await response.json()
+
+        return await self.scheduler.run(request, priority)
+
+    async def search(
+        self, video_title: str, priority: int = PRIORITY_INTERACTIVE
+    ) -> List[SearchResult]:
+        """Returns the most relevant videos for a search with their metadata.
+        Args:
+            video_title (str): The title of the video to search for.
+            priority (int): The priority of the request in the scheduler if it isn't cached.
+        Returns:
+            List[SearchResult]: The de-duplicated results in ranking order.
+        """
+        return await self.search_cache.get_or_fetch(
+            normalize_query(video_title),
+            lambda: self._fetch_search_results(video_title, priority),
+        )
+
+    async def _fetch_search_results(self, video_title: str, priority: int) -> List[SearchResult]:
+        """Searches YouTube without the cache and parses the results page."""
+        with METRICS.stage("search"):
+            text = await self._get_text(self.base_search_url + quote(video_title), priority)
+
+        results = parse_search_results(text)
+        if not results:
+            # the page layout changed, fall back to scraping bare video ids
+            video_ids = dict.fromkeys(re.findall(r'watch\?v=([\w-]{11})', text))
+            # the duration is unknown there, 0 keeps them playable
+            results = [SearchResult(video_id, "", 0, "") for video_id in video_ids]
+
+        for result in results:
+            if result.title:
+                self.title_cache.set(result.video_id, result.title)
+        return results
+
+    async def get_first_playable(
+        self,
+        video_title: str,
+        max_duration: int = MAX_SONG_DURATION,
+        priority: int = PRIORITY_INTERACTIVE,
+    ) -> SearchResult:
+        """Returns the best search result that is not a livestream or too long.
         Args:
             video_title (str): The title of the video to search for.
+            max_duration (int): The maximum accepted length in seconds.
+            priority (int): The priority of the requests in the scheduler.
         Returns:
-            List[str]: A list of URLs for the most relevant videos.
+            SearchResult: The first playable result.
+        Raises:
+            NoSearchResultsError: If no result is playable.
+        """
+        for result in await self.search(video_title, priority):
+            if result.is_playable(max_duration):
+                if not result.title:
+                    result.title = await self.get_title(result.url, priority)
+                return result
+        raise NoSearchResultsError(f"No playable results for {video_title!r}")
+
+    async def iter_playlist(
+        self,
+        playlist_id: str,
+        max_entries: int = MAX_PLAYLIST_SIZE,
+        priority: int = PRIORITY_INTERACTIVE,
+    ) -> AsyncIterator[SearchResult]:
+        """Yields the videos of a playlist page by page as they are fetched.
+        Args:
+            playlist_id (str): The id of the playlist.
+            max_entries (int): The maximum number of videos yielded.
+            priority (int): The priority of the requests in the scheduler.
+        Yields:
+            SearchResult: The videos of the playlist in order.
         """
-        encoded_url = self.base_search_url + requests.utils.quote(video_title)
+        with METRICS.stage("playlist_page"):
+            text = await self._get_text(BASE_PLAYLIST_URL + quote(playlist_id), priority)
+
+        data = extract_initial_data(text)
+        if data is None:
+            return
+        api_key = INNERTUBE_API_KEY_RE.search(text)
+        context_match = INNERTUBE_CONTEXT_RE.search(text)
+        context = (
+            json.JSONDecoder().raw_decode(text, context_match.end())[0]
+            if context_match else None
+        )
 
-        response = requests.get(url=encoded_url)
-        if response.status_code != 200:
-            raise Exception("Unexpected status code: %d".format(response.status_code))
+        count = 0
+        while True:
+            for result in parse_playlist_entries(data):
+                if result.title:
+                    self.title_cache.set(result.video_id, result.title)
+                yield result
+                count += 1
+                if count >= max_entries:
+                    return
 
-        matches = re.findall(r'watch\?v=(.+?)"', response.text)
-        return [self.base_video_url + video_id for video_id in matches]
+            token = find_continuation_token(data)
+            if token is None or api_key is None or context is None:
+                return
+            with METRICS.stage("playlist_page"):
+                data = await self._post_json(
+                    BROWSE_API_URL + api_key.group(1),
+                    {"context": context, "continuation": token},
+                    priority,
+                )
 
-    def get_first_title(self, search_title: str) -> str:
-        """Takes a search title and returns the title of the first video in the search results.
+    async def get_title(self, video_url: str, priority: int = PRIORITY_INTERACTIVE) -> str:
+        """Returns the title of a video, cached by its video id.
         Args:
-            search_title (str): The title of the video to search for.
+            video_url (str): The URL of the video.
+            priority (int): The priority of the request in the scheduler if it isn't cached.
         Returns:
-            str: The title of the first video in the search results.
+            str: The title of the video.
         """
-        first_link = self.get_top_search_results(search_title)[0]
-        return YouTube(first_link).title
\ No newline at end of file
+        video_id = video_url[len(self.base_video_url):]
+
+        async def fetch_title() -> str:
+            with METRICS.stage("title"):
+                # pytube is blocking, so run it off the event loop
+                return await self.scheduler.run(
+                    lambda: asyncio.to_thread(lambda: YouTube(video_url).title), priority
+                )
+
+        return await self.title_cache.get_or_fetch(video_id, fetch_title)